@@ -0,0 +1,149 @@
+from sqlalchemy import Table, Column, Integer, Float, MetaData, text
+from rollups import ensure_rollup_schema, apply_staged_rollups, rebuild_rollups, ensure_rollups
+
+agg_metadata = MetaData()
+
+movie_rating_stats = Table('movie_rating_stats', agg_metadata,
+    Column('movie_id', Integer, primary_key=True),
+    Column('rating_sum', Float, nullable=False),
+    Column('rating_count', Integer, nullable=False),
+    Column('avg_rating', Float),
+)
+
+user_rating_stats = Table('user_rating_stats', agg_metadata,
+    Column('user_id', Integer, primary_key=True),
+    Column('rating_sum', Float, nullable=False),
+    Column('rating_count', Integer, nullable=False),
+)
+
+genre_rating_stats = Table('genre_rating_stats', agg_metadata,
+    Column('genre_id', Integer, primary_key=True),
+    Column('rating_sum', Float, nullable=False),
+    Column('rating_count', Integer, nullable=False),
+    Column('avg_rating', Float),
+    Column('movie_count', Integer, nullable=False),
+)
+
+director_rating_stats = Table('director_rating_stats', agg_metadata,
+    Column('director_id', Integer, primary_key=True),
+    Column('rating_sum', Float, nullable=False),
+    Column('rating_count', Integer, nullable=False),
+    Column('avg_rating', Float),
+    Column('movie_count', Integer, nullable=False),
+)
+
+year_rating_stats = Table('year_rating_stats', agg_metadata,
+    Column('year', Integer, primary_key=True),
+    Column('rating_sum', Float, nullable=False),
+    Column('rating_count', Integer, nullable=False),
+    Column('avg_rating', Float),
+    Column('movie_count', Integer, nullable=False),
+)
+
+# movies whose rating stats changed since the leaderboards last consumed them (ranking.py)
+movie_stats_changes = Table('movie_stats_changes', agg_metadata,
+    Column('movie_id', Integer, primary_key=True),
+)
+
+def ensure_aggregate_schema(engine):
+    agg_metadata.create_all(engine)
+    ensure_rollup_schema(engine)
+
+def stage_ratings(conn, rows):
+    """
+    Put a batch of rating dicts (one per user_id/movie_id) into the connection's
+    staged_ratings temp table, replacing the previous batch.
+    """
+    conn.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS staged_ratings ("
+        "user_id INTEGER NOT NULL, movie_id INTEGER NOT NULL, rating REAL NOT NULL, timestamp INTEGER, "
+        "PRIMARY KEY (user_id, movie_id))"))
+    conn.execute(text("DELETE FROM staged_ratings"))
+    if rows:
+        conn.execute(text("INSERT OR REPLACE INTO staged_ratings (user_id, movie_id, rating, timestamp) "
+                          "VALUES (:user_id, :movie_id, :rating, :timestamp)"), rows)
+
+def apply_staged_deltas(conn):
+    """
+    Fold the staged batch into the per-movie and per-user stats. A new rating adds its value
+    and one to the count; a changed rating adds the difference from the stored value. Must run
+    before the batch is merged into `ratings`.
+    """
+    for table, key in (('movie_rating_stats', 'movie_id'), ('user_rating_stats', 'user_id')):
+        conn.execute(text(f"""
+            INSERT INTO {table} ({key}, rating_sum, rating_count)
+            SELECT s.{key}, SUM(s.rating - COALESCE(r.rating, 0)), SUM(r.rating_id IS NULL)
+            FROM staged_ratings s
+            LEFT JOIN ratings r ON r.user_id = s.user_id AND r.movie_id = s.movie_id
+            GROUP BY s.{key}
+            ON CONFLICT({key}) DO UPDATE SET
+                rating_sum = {table}.rating_sum + excluded.rating_sum,
+                rating_count = {table}.rating_count + excluded.rating_count"""))
+    conn.execute(text("""
+        UPDATE movie_rating_stats SET avg_rating = rating_sum / rating_count
+        WHERE movie_id IN (SELECT DISTINCT movie_id FROM staged_ratings)"""))
+    conn.execute(text("INSERT OR IGNORE INTO movie_stats_changes (movie_id) "
+                      "SELECT DISTINCT movie_id FROM staged_ratings"))
+
+def merge_staged_ratings(conn):
+    conn.execute(text("""
+        INSERT INTO ratings (user_id, movie_id, rating, timestamp)
+        SELECT user_id, movie_id, rating, timestamp FROM staged_ratings WHERE true
+        ON CONFLICT(user_id, movie_id) DO UPDATE SET rating = excluded.rating, timestamp = excluded.timestamp"""))
+
+def load_rating_batch(conn, rows):
+    """Stage, fold into the summary tables and time rollups and upsert one batch of ratings (SQLite)."""
+    stage_ratings(conn, rows)
+    apply_staged_deltas(conn)
+    apply_staged_rollups(conn)
+    merge_staged_ratings(conn)
+
+def rebuild(conn):
+    """Recompute every summary table and time rollup from scratch, e.g. after a destructive reload."""
+    conn.execute(text("DELETE FROM movie_rating_stats"))
+    conn.execute(text("""
+        INSERT INTO movie_rating_stats (movie_id, rating_sum, rating_count, avg_rating)
+        SELECT movie_id, SUM(rating), COUNT(*), AVG(rating) FROM ratings GROUP BY movie_id"""))
+    conn.execute(text("DELETE FROM user_rating_stats"))
+    conn.execute(text("""
+        INSERT INTO user_rating_stats (user_id, rating_sum, rating_count)
+        SELECT user_id, SUM(rating), COUNT(*) FROM ratings GROUP BY user_id"""))
+    refresh_derived(conn)
+    rebuild_rollups(conn)
+
+def ensure_populated(conn):
+    """Backfill the summaries once for a database whose ratings predate them."""
+    empty = conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM movie_rating_stats)")).scalar()
+    if empty and conn.execute(text("SELECT EXISTS (SELECT 1 FROM ratings)")).scalar():
+        rebuild(conn)
+    else:
+        ensure_rollups(conn)
+
+def refresh_derived(conn):
+    """
+    Rebuild the genre, director and year stats from movie_rating_stats. This touches one
+    row per movie link rather than every rating, so it is cheap to run after each load or
+    whenever genre/director links change.
+    """
+    conn.execute(text("DELETE FROM genre_rating_stats"))
+    conn.execute(text("""
+        INSERT INTO genre_rating_stats (genre_id, rating_sum, rating_count, avg_rating, movie_count)
+        SELECT mg.genre_id, SUM(s.rating_sum), SUM(s.rating_count),
+               SUM(s.rating_sum) / SUM(s.rating_count), COUNT(DISTINCT s.movie_id)
+        FROM movie_genres mg JOIN movie_rating_stats s ON s.movie_id = mg.movie_id
+        GROUP BY mg.genre_id"""))
+    conn.execute(text("DELETE FROM director_rating_stats"))
+    conn.execute(text("""
+        INSERT INTO director_rating_stats (director_id, rating_sum, rating_count, avg_rating, movie_count)
+        SELECT md.director_id, SUM(s.rating_sum), SUM(s.rating_count),
+               SUM(s.rating_sum) / SUM(s.rating_count), COUNT(DISTINCT s.movie_id)
+        FROM movie_directors md JOIN movie_rating_stats s ON s.movie_id = md.movie_id
+        GROUP BY md.director_id"""))
+    conn.execute(text("DELETE FROM year_rating_stats"))
+    conn.execute(text("""
+        INSERT INTO year_rating_stats (year, rating_sum, rating_count, avg_rating, movie_count)
+        SELECT m.year, SUM(s.rating_sum), SUM(s.rating_count),
+               SUM(s.rating_sum) / SUM(s.rating_count), COUNT(*)
+        FROM movies m JOIN movie_rating_stats s ON s.movie_id = m.movie_id
+        WHERE m.year IS NOT NULL
+        GROUP BY m.year"""))
@@ -0,0 +1,365 @@
+"""
+Pipeline benchmark on synthetic MovieLens-shaped data.
+
+    python benchmark.py --scale 100k                      # generate, run every stage, write JSON
+    python benchmark.py --scale 1m --compare bench_results/1m-abc1234.json
+
+Stages are timed separately (CSV read, transform, OMDb enrichment against the local stub,
+movie and ratings loads, summary refresh, each query in queries.sql, each report on both
+engines in reports.py, cold start of the CLI entry points with -X importtime) and written with
+throughput and peak RSS to bench_results/<scale>-<commit>.json. --compare flags stages
+that got slower than --threshold relative to an earlier results file.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent
+SCALES = {
+    # ratings: (movies, users) roughly as in the MovieLens releases of that size
+    "100k": (100_000, 9_742, 610),
+    "1m": (1_000_000, 27_000, 6_040),
+    "25m": (25_000_000, 62_423, 162_541),
+}
+GENRES = ["Drama", "Comedy", "Thriller", "Action", "Romance", "Adventure", "Crime", "Sci-Fi",
+          "Horror", "Fantasy", "Children", "Animation", "Mystery", "Documentary", "War",
+          "Musical", "Western", "IMAX", "Film-Noir"]
+RATING_VALUES = np.arange(1, 11) / 2.0
+RATING_WEIGHTS = np.array([1.4, 2.8, 1.8, 7.4, 5.6, 19.9, 13.1, 26.6, 7.7, 13.2])
+CHUNK = 1_000_000
+# cold-start commands (stage name -> script and arguments), run as cron / health checks would
+STARTUP_COMMANDS = {
+    "startup.moviepipe_help": ["moviepipe.py", "--help"],
+    "startup.moviepipe_report": ["moviepipe.py", "report", "top_movies"],
+    "startup.moviepipe_check_data": ["moviepipe.py", "check", "data"],
+    "startup.run_query": ["run_query.py", "--no-cache"],
+    "startup.etl_help": ["etl.py", "--help"],
+    "startup.moviepipe_etl_help": ["moviepipe.py", "etl", "--help"],
+}
+# entries that must start without HEAVY_MODULES (run_query.py goes through reports.py and pandas)
+LIGHT_COMMANDS = {"startup.moviepipe_help", "startup.moviepipe_report", "startup.moviepipe_check_data",
+                  "startup.etl_help", "startup.moviepipe_etl_help"}
+HEAVY_MODULES = {"pandas", "numpy", "sqlalchemy", "requests"}
+
+
+def generate(out_dir, n_ratings, n_movies, n_users, seed=42):
+    """
+    Write movies.csv and ratings.csv with long-tailed movie popularity and user activity,
+    Zipf-distributed genres, MovieLens' half-star rating distribution and one rating per
+    (user, movie). Only the pair keys are held in memory; ratings are written in chunks.
+    """
+    rng = np.random.default_rng(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    genre_p = 1.0 / np.arange(1, len(GENRES) + 1)
+    genre_p /= genre_p.sum()
+    with open(out_dir / "movies.csv", "w", encoding="utf-8") as f:
+        f.write("movieId,title,genres\n")
+        years = rng.integers(1915, 2019, n_movies)
+        n_genres = rng.integers(1, 4, n_movies)
+        for mid in range(1, n_movies + 1):
+            picks = rng.choice(len(GENRES), n_genres[mid - 1], replace=False, p=genre_p)
+            # Every 7th title has a trailing article and an alternate title, quoted for the comma.
+            if mid % 7 == 0:
+                title = f"\"Synthetic Movie {mid}, The (Film {mid}) ({years[mid - 1]})\""
+            else:
+                title = f"Synthetic Movie {mid} ({years[mid - 1]})"
+            f.write(f"{mid},{title},{'|'.join(GENRES[g] for g in picks)}\n")
+
+    movie_p = 1.0 / np.arange(1, n_movies + 1) ** 0.9
+    movie_p /= movie_p.sum()
+    user_p = rng.pareto(1.2, n_users) + 1
+    user_p /= user_p.sum()
+    rating_p = RATING_WEIGHTS / RATING_WEIGHTS.sum()
+    # MovieLens has one rating per (user, movie): draw pairs until there are enough distinct ones,
+    # keeping first occurrences in draw order
+    keys = np.empty(0, dtype=np.int64)
+    while len(keys) < n_ratings:
+        extra = int((n_ratings - len(keys)) * 1.1) + 1000
+        drawn = (rng.choice(n_users, extra, p=user_p).astype(np.int64) * n_movies
+                 + rng.choice(n_movies, extra, p=movie_p))
+        keys = np.concatenate([keys, drawn])
+        _, first = np.unique(keys, return_index=True)
+        keys = keys[np.sort(first)]
+    keys = keys[:n_ratings]
+    ts = 828_124_615
+    with open(out_dir / "ratings.csv", "w", encoding="utf-8") as f:
+        f.write("userId,movieId,rating,timestamp\n")
+        written = 0
+        while written < n_ratings:
+            n = min(CHUNK, n_ratings - written)
+            users = keys[written:written + n] // n_movies + 1
+            movies = keys[written:written + n] % n_movies + 1
+            values = rng.choice(RATING_VALUES, n, p=rating_p)
+            stamps = ts + np.cumsum(rng.integers(0, 60, n))
+            ts = int(stamps[-1])
+            lines = [f"{u},{m},{r:.1f},{t}\n" for u, m, r, t in zip(users.tolist(), movies.tolist(),
+                                                                  values.tolist(), stamps.tolist())]
+            f.writelines(lines)
+            written += n
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Recorder:
+    def __init__(self):
+        self.stages = {}
+
+    def time(self, name, fn, rows=None, rate=True):
+        from ingest import peak_memory_mb
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if rows is None and isinstance(result, int):
+            rows = result
+        entry = {"seconds": round(elapsed, 4), "rows": rows,
+                 "rows_per_sec": round(rows / elapsed, 1) if rate and rows and elapsed > 0 else None,
+                 "peak_rss_mb": peak_memory_mb()}
+        self.stages[name] = entry
+        rate = f" {entry['rows_per_sec']:>12,.0f} rows/s" if entry["rows_per_sec"] else ""
+        print(f"{name:36s} {elapsed:9.3f}s{rate}")
+        return result
+
+
+def import_seconds(stderr):
+    """Total of the top-level cumulative times in `python -X importtime` output."""
+    total = 0
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        # nested imports are indented under their parent; count top-level ones only
+        if line.startswith("import time:") and len(parts) == 3 and not parts[2].startswith("  "):
+            if parts[1].strip().isdigit():
+                total += int(parts[1])
+    return total / 1e6
+
+
+def imported_modules(stderr):
+    """Top-level package names of every module in `python -X importtime` output."""
+    return {line.split("|")[2].strip().split(".")[0] for line in stderr.splitlines()
+            if line.startswith("import time:") and line.count("|") == 2}
+
+
+def time_startup(rec):
+    """
+    Wall time and import time of each STARTUP_COMMANDS entry in a fresh interpreter. Fails if
+    a LIGHT_COMMANDS entry imports a HEAVY_MODULES package, so a stray top-level import shows up.
+    """
+    for name, cmd in STARTUP_COMMANDS.items():
+        proc = rec.time(name, lambda cmd=cmd: subprocess.run([sys.executable, "-X", "importtime", str(ROOT / cmd[0])]
+                                                            + cmd[1:], capture_output=True, text=True),
+                        rate=False)
+        if proc.returncode:
+            raise RuntimeError(f"{' '.join(cmd)} failed:\n{proc.stderr[-2000:]}")
+        rec.stages[name]["import_seconds"] = round(import_seconds(proc.stderr), 4)
+        heavy = HEAVY_MODULES & imported_modules(proc.stderr)
+        if name in LIGHT_COMMANDS and heavy:
+            raise RuntimeError(f"{' '.join(cmd)} imported {', '.join(sorted(heavy))}")
+
+
+def run_stages(work, rec, omdb_titles, query_repeat):
+    """Run each pipeline stage inside `work` against a fresh movies.db."""
+    from stub_omdb import start_stub_server
+    server, url = start_stub_server()
+    os.environ.update(DB_URL=f"sqlite:///{work / 'movies.db'}", OMDB_URL=url, OMDB_API_KEY="bench",
+                      OMDB_RPS="100000", OMDB_CACHE_DB=str(work / "omdb_cache.db"))
+    os.chdir(work)
+    import pandas as pd
+    import etl_load
+    from ingest import iter_csv_chunks, MOVIES_DTYPES, RATINGS_DTYPES
+    from transform import parse_titles, explode_genres
+    from omdb_cache import open_cache
+    from aggregates import refresh_derived
+    from db_profile import bulk_load
+    from search import sync_search
+    from db import get_engine
+
+    def read_all(path, dtypes):
+        return sum(len(c) for c in iter_csv_chunks(path, dtypes))
+
+    rec.time("csv_read.movies", lambda: read_all("movies.csv", MOVIES_DTYPES))
+    rec.time("csv_read.ratings", lambda: read_all("ratings.csv", RATINGS_DTYPES))
+
+    df_movies = pd.read_csv("movies.csv", dtype=MOVIES_DTYPES)
+    rec.time("transform.parse_titles", lambda: len(parse_titles(df_movies["title"])))
+    rec.time("transform.explode_genres", lambda: len(explode_genres(df_movies)))
+
+    titles = parse_titles(df_movies["title"]).head(omdb_titles)
+    queries = [(t, None if pd.isna(y) else int(y)) for t, y in zip(titles["title"], titles["year"])]
+    cache = open_cache()
+    rec.time("omdb.enrich_stub",
+             lambda: len(etl_load.enrich_from_omdb(queries, etl_load.title_matcher(cache, 16))))
+    cache.close()
+
+    # The loads below only read the cache filled above, so they time the database alone.
+    etl_load.OMDB_API_KEY = None
+    etl_load.ensure_schema()
+    args = argparse.Namespace(incremental=False, batch_size=etl_load.BATCH_SIZE, omdb_concurrency=16)
+    genre_dim, director_dim = etl_load.dimension_resolvers()
+
+    def prepare_movies():
+        cache = open_cache()
+        seen = set()
+        matcher = etl_load.title_matcher(cache)
+        batch = [row for chunk in iter_csv_chunks("movies.csv", MOVIES_DTYPES)
+                 for row in etl_load.prepare_movies_chunk(chunk, matcher, args, seen)[0]]
+        cache.close()
+        return batch
+
+    # The parts of etl_load.load_movie_batch, each timed over all movies as its own stage
+    # (one transaction per batch, as in etl.py) so movie, genre and director writes show up apart.
+    def write_batches(write):
+        n = 0
+        for part in etl_load.iter_batches(movie_batch, args.batch_size):
+            with get_engine().begin() as conn:
+                n += write(conn, part)
+        return n
+
+    def write_movies(conn, part):
+        etl_load.bulk_upsert(conn, etl_load.movies, [row for row, _, _ in part], ["movie_id"])
+        return len(part)
+
+    def write_genres(conn, part):
+        return genre_dim.link(conn, [(row["movie_id"], names) for row, names, _ in part])
+
+    def write_directors(conn, part):
+        return director_dim.link(conn, [(row["movie_id"], names) for row, _, names in part])
+
+    def write_search(conn, part):
+        sync_search(conn, [row["movie_id"] for row, _, _ in part])
+        return len(part)
+
+    def refresh():
+        with get_engine().begin() as conn:
+            refresh_derived(conn)
+
+    # Same load setup as etl.py: bulk pragmas, indexes rebuilt once at the end.
+    index_start = None
+    with bulk_load(get_engine()):
+        movie_batch = rec.time("load.prepare_movies", prepare_movies)
+        rec.time("load.movies", lambda: write_batches(write_movies))
+        rec.time("load.genres", lambda: write_batches(write_genres))
+        rec.time("load.directors", lambda: write_batches(write_directors))
+        rec.time("load.search_index", lambda: write_batches(write_search))
+        rec.time("load.ratings", lambda: sum(etl_load.load_ratings(chunk, etl_load.BATCH_SIZE)
+                                             for chunk in iter_csv_chunks("ratings.csv", RATINGS_DTYPES)))
+        rec.time("load.refresh_summaries", refresh)
+        index_start = time.perf_counter()
+    rec.stages["load.rebuild_indexes"] = {"seconds": round(time.perf_counter() - index_start, 4), "rows": None,
+                                          "rows_per_sec": None, "peak_rss_mb": rec.stages["load.ratings"]["peak_rss_mb"]}
+    print(f"{'load.rebuild_indexes':36s} {rec.stages['load.rebuild_indexes']['seconds']:9.3f}s")
+
+    import sqlite3
+    con = sqlite3.connect(work / "movies.db")
+    sql = (ROOT / "queries.sql").read_text(encoding="utf-8")
+    for i, stmt in enumerate(s.strip() for s in sql.split(";")):
+        if not stmt:
+            continue
+
+        def run_query(stmt=stmt):
+            rows = 0
+            for _ in range(query_repeat):
+                rows = len(con.execute(stmt).fetchall())
+            return rows
+        name = f"query.{i + 1}"
+        rec.time(name, run_query, rate=False)
+        rec.stages[name]["seconds_per_run"] = round(rec.stages[name]["seconds"] / query_repeat, 6)
+    con.close()
+
+    from reports import REPORTS, SqliteEngine, MemoryEngine
+    engines = {"sqlite": SqliteEngine(str(work / "movies.db"))}
+    engines["memory"] = rec.time("reports.memory_load", lambda: MemoryEngine.from_sqlite(str(work / "movies.db")),
+                                 rate=False)
+    for kind, eng in engines.items():
+        for rep in REPORTS.values():
+            name = f"reports.{kind}.{rep.name}"
+
+            def run_report(rep=rep, eng=eng):
+                rows = 0
+                for _ in range(query_repeat):
+                    rows = len(eng.run(rep, rep.defaults))
+                return rows
+            rec.time(name, run_report, rate=False)
+            rec.stages[name]["seconds_per_run"] = round(rec.stages[name]["seconds"] / query_repeat, 6)
+        eng.close()
+    time_startup(rec)
+    server.shutdown()
+
+
+def compare(current, baseline_path, threshold, min_seconds):
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    print(f"\nvs {baseline_path} (commit {baseline.get('commit')}):")
+    regressions = 0
+    for name, entry in current["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old or not old.get("seconds"):
+            continue
+        ratio = entry["seconds"] / old["seconds"]
+        # Stages shorter than min_seconds are mostly timer noise; report them but don't flag.
+        slow = ratio > 1 + threshold and max(entry["seconds"], old["seconds"]) >= min_seconds
+        flag = "  REGRESSION" if slow else ""
+        regressions += bool(flag)
+        print(f"{name:36s} {old['seconds']:9.3f}s -> {entry['seconds']:9.3f}s  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="100k")
+    parser.add_argument("--data-dir", default="bench_data", help="where synthetic CSVs are cached")
+    parser.add_argument("--out", help="results file (default bench_results/<scale>-<commit>.json)")
+    parser.add_argument("--omdb-titles", type=int, default=2000, help="titles enriched against the stub")
+    parser.add_argument("--query-repeat", type=int, default=5)
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio flagged as regression")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="ignore regressions in shorter stages")
+    parser.add_argument("--regenerate", action="store_true")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    n_ratings, n_movies, n_users = SCALES[args.scale]
+    data = Path(args.data_dir).resolve() / args.scale
+    if args.regenerate or not (data / "ratings.csv").exists():
+        print(f"Generating {args.scale} synthetic dataset in {data} ...")
+        start = time.perf_counter()
+        generate(data, n_ratings, n_movies, n_users)
+        print(f"generated in {time.perf_counter() - start:.1f}s")
+
+    work = Path(args.data_dir).resolve() / f"{args.scale}-run"
+    work.mkdir(parents=True, exist_ok=True)
+    for name in ("movies.db", "movies.db-wal", "movies.db-shm", "omdb_cache.db", "omdb_cache.db-wal", "omdb_cache.db-shm"):
+        (work / name).unlink(missing_ok=True)
+    for name in ("movies.csv", "ratings.csv"):
+        target = work / name
+        target.unlink(missing_ok=True)
+        if hasattr(os, "symlink"):
+            os.symlink(data / name, target)
+        else:
+            target.write_bytes((data / name).read_bytes())
+
+    commit = git_commit()
+    out = Path(args.out).resolve() if args.out else ROOT / "bench_results" / f"{args.scale}-{commit}.json"
+    rec = Recorder()
+    run_stages(work, rec, args.omdb_titles, args.query_repeat)
+
+    result = {"commit": commit, "scale": args.scale, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "ratings": n_ratings, "movies": n_movies, "users": n_users,
+              "python": sys.version.split()[0], "stages": rec.stages}
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"\nResults written to {out}")
+    if args.compare and compare(result, args.compare, args.threshold, args.min_seconds):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
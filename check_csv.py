@@ -1,8 +1,47 @@
-import os, pandas as pd
-print('CWD:', os.getcwd())
-for f in ['movies.csv','ratings.csv']:
-    print('\nFILE:', f, 'exists=', os.path.exists(f), 'size=', os.path.getsize(f) if os.path.exists(f) else 'N/A')
-    if os.path.exists(f):
-        df = pd.read_csv(f)
-        print('shape:', df.shape)
-        print(df.head(3).to_string(index=False))
+"""
+Quick look at the input CSVs: size, shape and the first rows. Standard library only, so
+it starts fast enough for health checks (also: moviepipe check csv).
+"""
+import os
+import csv
+import argparse
+from itertools import islice
+from report_defs import format_table
+
+FILES = ["movies.csv", "ratings.csv"]
+
+
+def count_lines(path, block=1 << 20):
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        while chunk := f.read(block):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    return lines + (last != b"\n")
+
+
+def describe(path, head=3):
+    exists = os.path.exists(path)
+    print('\nFILE:', path, 'exists=', exists, 'size=', os.path.getsize(path) if exists else 'N/A')
+    if not exists:
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = list(islice(reader, head))
+    print('shape:', (max(count_lines(path) - 1, 0), len(header)))
+    print(format_table(header, rows))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show size, shape and first rows of the input CSVs")
+    parser.add_argument("files", nargs="*", default=FILES)
+    parser.add_argument("--head", type=int, default=3, help="rows to show per file")
+    args = parser.parse_args(argv)
+    print('CWD:', os.getcwd())
+    for f in args.files:
+        describe(f, args.head)
+
+
+if __name__ == "__main__":
+    main()
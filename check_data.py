@@ -1,11 +1,32 @@
-import sqlite3
+"""
+Row counts of the core tables (also: moviepipe check data). SQLite databases are read
+with sqlite3 directly; other DB_URL backends go through SQLAlchemy.
+"""
+import argparse
+from db import is_sqlite, sqlite_connect
 
-con = sqlite3.connect("movies.db")
-cur = con.cursor()
+TABLES = ["movies", "ratings", "genres", "directors", "movie_genres", "movie_directors"]
 
-print("\n Table row counts:\n")
-for t in ["movies","ratings","genres","directors","movie_genres","movie_directors"]:
-    cur.execute(f"SELECT COUNT(*) FROM {t}")
-    print(f"{t:15s} : {cur.fetchone()[0]}")
 
-con.close()
\ No newline at end of file
+def table_counts(tables=TABLES):
+    if is_sqlite():
+        con = sqlite_connect()
+        try:
+            return {t: con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in tables}
+        finally:
+            con.close()
+    from sqlalchemy import text
+    from db import get_engine
+    with get_engine().connect() as con:
+        return {t: con.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar() for t in tables}
+
+
+def main(argv=None):
+    argparse.ArgumentParser(description="Row counts of the core tables").parse_args(argv)
+    print("\n Table row counts:\n")
+    for t, n in table_counts().items():
+        print(f"{t:15s} : {n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+SQLite performance profile: secondary indexes for the report joins, pragma sets for the
+bulk-load and read-serving phases, and EXPLAIN QUERY PLAN checks.
+
+    python db_profile.py --apply read      # create indexes, ANALYZE, switch to WAL
+    python db_profile.py --explain         # query plans for queries.sql and the report scripts
+"""
+import argparse
+from contextlib import contextmanager
+from sqlalchemy import event, text
+from db import db_url, get_engine
+
+# (name, table, columns). The UNIQUE/PRIMARY KEY indexes are not listed: upserts need them.
+INDEXES = [
+    ("ix_ratings_movie_rating", "ratings", ("movie_id", "rating")),
+    ("ix_ratings_timestamp", "ratings", ("timestamp", "movie_id", "rating")),
+    ("ix_movie_genres_genre", "movie_genres", ("genre_id", "movie_id")),
+    ("ix_movie_directors_director", "movie_directors", ("director_id", "movie_id")),
+    ("ix_movies_year", "movies", ("year", "movie_id")),
+    ("ix_movie_rating_stats_count", "movie_rating_stats", ("rating_count", "avg_rating")),
+    ("ix_user_rating_stats_count", "user_rating_stats", ("rating_count",)),
+    ("ix_genre_rating_stats_count", "genre_rating_stats", ("rating_count", "avg_rating")),
+    ("ix_director_rating_stats_count", "director_rating_stats", ("movie_count", "avg_rating")),
+]
+
+PRAGMAS = {
+    # Re-runnable loads trade durability for speed: no fsync, big page cache, temp in RAM.
+    "bulk_load": {"journal_mode": "WAL", "synchronous": "OFF", "cache_size": -262144,
+                  "temp_store": "MEMORY"},
+    "read": {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -65536,
+             "temp_store": "MEMORY", "mmap_size": 268435456},
+}
+
+_profiles = {}
+
+
+def apply_pragmas(dbapi_conn, profile):
+    cur = dbapi_conn.cursor()
+    for name, value in PRAGMAS[profile].items():
+        cur.execute(f"PRAGMA {name} = {value}")
+    cur.close()
+
+
+def use_profile(engine, profile):
+    """Apply a pragma profile to every connection the engine hands out from now on."""
+    if engine.dialect.name != "sqlite":
+        return
+    if engine not in _profiles:
+        @event.listens_for(engine, "checkout")
+        def _on_checkout(dbapi_conn, record, proxy):
+            apply_pragmas(dbapi_conn, _profiles[engine])
+    _profiles[engine] = profile
+
+
+def _table_exists(conn, table):
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :t"),
+                        {"t": table}).fetchone() is not None
+
+
+def create_indexes(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    for name, table, cols in INDEXES:
+        if _table_exists(conn, table):
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(cols)})"))
+
+
+def drop_indexes(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    for name, _, _ in INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def analyze(conn):
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("ANALYZE"))
+
+
+@contextmanager
+def bulk_load(engine, rebuild_indexes=True):
+    """
+    Run a load under the bulk_load pragmas. With rebuild_indexes the secondary indexes are
+    dropped first and rebuilt afterwards (cheaper than maintaining them row by row on a
+    large load); either way the tables are ANALYZEd and the read profile is restored.
+    """
+    use_profile(engine, "bulk_load")
+    if rebuild_indexes:
+        with engine.begin() as conn:
+            drop_indexes(conn)
+    try:
+        yield
+    finally:
+        with engine.begin() as conn:
+            create_indexes(conn)
+            analyze(conn)
+        use_profile(engine, "read")
+
+
+def explain(conn, sql, params=None):
+    """EXPLAIN QUERY PLAN detail lines for one statement."""
+    return [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params or {}).fetchall()]
+
+
+def report_queries():
+    """(label, sql, params) for queries.sql and the reports registered in reports.py."""
+    from reports import REPORTS, sql_statements
+    found = [(f"queries.sql #{i}", stmt, {}) for i, stmt in enumerate(sql_statements("queries.sql"), 1)]
+    for rep in REPORTS.values():
+        found.append((f"reports.{rep.name}", rep.sql.strip(), rep.defaults))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite index/pragma performance profile")
+    parser.add_argument("--db", help="SQLite file or database URL (default: DB_URL)")
+    parser.add_argument("--apply", choices=sorted(PRAGMAS), help="create indexes, ANALYZE and apply pragmas")
+    parser.add_argument("--explain", action="store_true", help="print EXPLAIN QUERY PLAN for the reports")
+    args = parser.parse_args()
+
+    engine = get_engine(db_url(args.db))
+    if args.apply:
+        use_profile(engine, args.apply)
+        with engine.begin() as conn:
+            create_indexes(conn)
+            analyze(conn)
+        print(f"Applied '{args.apply}' profile and {len(INDEXES)} indexes.")
+    if args.explain:
+        with engine.connect() as conn:
+            for label, sql, params in report_queries():
+                print(f"\n{label}")
+                for line in explain(conn, sql, params):
+                    print("   ", line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Name -> id resolution for the genre and director dimensions.
+
+A DimensionResolver keeps every name it has seen mapped to its surrogate id. For a batch of
+movies, resolve() takes all distinct names at once, inserts the unknown ones with a single
+conflict-ignoring INSERT and reads their ids back with one SELECT ... IN per RESOLVE_CHUNK
+names; link() then writes the bridge rows (movie_genres / movie_directors) in one
+executemany that skips links already present. The statement count per batch is therefore
+constant instead of growing with the number of names and links.
+"""
+from sqlalchemy import select
+from db import insert_ignore
+
+# names per SELECT ... IN (stays under SQLite's bound-parameter limit)
+RESOLVE_CHUNK = 500
+
+
+class DimensionResolver:
+    def __init__(self, table, key_col, name_col, bridge):
+        self.table = table
+        self.key = table.c[key_col]
+        self.name = table.c[name_col]
+        self.bridge = bridge
+        self.ids = {}
+
+    def preload(self, conn):
+        """Cache every existing name so later batches only touch new ones."""
+        self.ids.update(conn.execute(select(self.name, self.key)).fetchall())
+
+    def resolve(self, conn, names):
+        """Ids for the given names (stripped; blanks dropped), creating any that are missing."""
+        # first-seen order, so new ids are assigned in the order the names appear
+        wanted = dict.fromkeys(n.strip() for n in names if n and n.strip())
+        missing = [n for n in wanted if n not in self.ids]
+        if missing:
+            insert_ignore(conn, self.table, [{self.name.name: n} for n in missing])
+            for i in range(0, len(missing), RESOLVE_CHUNK):
+                part = missing[i:i + RESOLVE_CHUNK]
+                self.ids.update(conn.execute(select(self.name, self.key).where(self.name.in_(part))).fetchall())
+        return {n: self.ids[n] for n in wanted}
+
+    def link(self, conn, links):
+        """
+        links: list of (movie_id, names). Resolves the names and inserts the bridge rows,
+        ignoring ones that already exist. Returns the number of links offered.
+        """
+        ids = self.resolve(conn, [n for _, names in links for n in names])
+        rows = {(mid, ids[n.strip()]) for mid, names in links for n in names if n and n.strip()}
+        return insert_ignore(conn, self.bridge,
+                             [{"movie_id": mid, self.key.name: key} for mid, key in sorted(rows)])
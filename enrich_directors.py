@@ -0,0 +1,177 @@
+"""
+Resumable director enrichment. Works through every movie that has no director links yet,
+looks titles up through title_match.py (cache, local title index, then ranked OMDb queries)
+and commits directors, links and a per-movie status (done / not_found / error) once per batch. Interrupt it at any time;
+the next run continues with the movies that have no status, plus errors to retry.
+
+    python enrich_directors.py --batch-size 200 --omdb-concurrency 8
+"""
+import os
+import time
+import argparse
+from db import get_engine, sqlite_connect, sqlite_url
+from omdb import OmdbClient, OMDB_CONCURRENCY, QuotaExceeded, normalize_year
+from omdb_cache import open_cache
+from title_match import TitleMatcher
+from aggregates import ensure_aggregate_schema, ensure_populated, refresh_derived
+from pipeline_state import bump_data_version
+from ranking import refresh as refresh_rankings
+from rollups import sync_links as sync_rollup_links
+from search import ensure_search_index, sync_search
+
+DB = None  # the SQLite file named by DB_URL
+OMDB_API_KEY = os.environ.get("OMDB_API_KEY")
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directors (
+    director_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    director_name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS movie_directors (
+    movie_id INTEGER NOT NULL,
+    director_id INTEGER NOT NULL,
+    PRIMARY KEY (movie_id, director_id)
+);
+CREATE TABLE IF NOT EXISTS director_enrichment (
+    movie_id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL
+);
+"""
+
+
+def pending_movies(con, retry_not_found=False, max_attempts=MAX_ATTEMPTS, limit=None):
+    """Movies without director links whose enrichment is not finished."""
+    statuses = "('done', 'not_found')" if not retry_not_found else "('done')"
+    sql = f"""
+        SELECT m.movie_id, m.title, m.year
+        FROM movies m
+        LEFT JOIN director_enrichment e ON e.movie_id = m.movie_id
+        WHERE NOT EXISTS (SELECT 1 FROM movie_directors md WHERE md.movie_id = m.movie_id)
+          AND (e.movie_id IS NULL OR (e.status NOT IN {statuses} AND e.attempts < ?))
+        ORDER BY m.movie_id"""
+    params = [max_attempts]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return con.execute(sql, params).fetchall()
+
+
+def director_names(data):
+    field = (data or {}).get("Director") or ""
+    if field == "N/A":
+        return []
+    return [d.strip() for d in field.split(",") if d.strip()]
+
+
+def save_batch(con, results):
+    """
+    results: list of (movie_id, status, names, error). Writes directors, links and statuses
+    in one transaction. Returns the number of links actually inserted (links that already
+    existed, or names repeated for a movie, are not counted).
+    """
+    names = sorted({n for _, _, ns, _ in results for n in ns})
+    now = time.time()
+    with con:
+        con.executemany("INSERT OR IGNORE INTO directors (director_name) VALUES (?)", [(n,) for n in names])
+        ids = {}
+        for i in range(0, len(names), 500):
+            part = names[i:i + 500]
+            ids.update(con.execute(
+                f"SELECT director_name, director_id FROM directors WHERE director_name IN ({','.join('?' * len(part))})",
+                part).fetchall())
+        before = con.total_changes
+        con.executemany("INSERT OR IGNORE INTO movie_directors (movie_id, director_id) VALUES (?, ?)",
+                        [(mid, ids[n]) for mid, _, ns, _ in results for n in ns])
+        inserted = con.total_changes - before
+        sync_search(con, [mid for mid, _, ns, _ in results if ns])
+        con.executemany("""
+            INSERT INTO director_enrichment (movie_id, status, attempts, error, updated_at)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT(movie_id) DO UPDATE SET status = excluded.status, error = excluded.error,
+                attempts = director_enrichment.attempts + 1, updated_at = excluded.updated_at""",
+                        [(mid, status, error, now) for mid, status, _, error in results])
+    return inserted
+
+
+def run(db=DB, batch_size=BATCH_SIZE, concurrency=OMDB_CONCURRENCY, retry_not_found=False, limit=None,
+        api_key=OMDB_API_KEY):
+    con = sqlite_connect(db)
+    con.executescript(SCHEMA)
+    with con:
+        ensure_search_index(con)
+    todo = pending_movies(con, retry_not_found, limit=limit)
+    print(f"Movies needing directors: {len(todo)}")
+
+    cache = open_cache()
+    client = OmdbClient(api_key, concurrency=concurrency, usage=cache) if api_key else None
+    if client is None:
+        print("OMDB_API_KEY is not set; resolving titles from the cache only.")
+    matcher = TitleMatcher(cache, client)
+    counts = {"done": 0, "not_found": 0, "error": 0}
+    links = 0
+    start = time.perf_counter()
+    try:
+        for b in range(0, len(todo), batch_size):
+            batch = todo[b:b + batch_size]
+            by_query = {}
+            for mid, title, year in batch:
+                by_query.setdefault((title, normalize_year(year)), []).append(mid)
+            results = []
+            quota_hit = False
+            for query, data, error in matcher.lookup_many(by_query):
+                if isinstance(error, QuotaExceeded):
+                    quota_hit = True
+                    continue
+                names = director_names(data) if error is None else []
+                status = "error" if error is not None else ("done" if names else "not_found")
+                for mid in by_query[query]:
+                    results.append((mid, status, names, str(error) if error else None))
+            links += save_batch(con, results)
+            for _, status, _, _ in results:
+                counts[status] += 1
+            done = min(b + batch_size, len(todo))
+            print(f"[{done}/{len(todo)}] done={counts['done']} not_found={counts['not_found']} "
+                  f"error={counts['error']} links={links} ({time.perf_counter() - start:.1f}s)")
+            if quota_hit:
+                print("OMDb daily quota reached; stopping. Re-run later to continue.")
+                break
+    except KeyboardInterrupt:
+        print("Interrupted; progress up to the last completed batch is saved.")
+    finally:
+        con.close()
+        print("OMDb cache:", cache.stats())
+        print("Title matching:", matcher.stats())
+        cache.close()
+
+    engine = get_engine(sqlite_url(db))
+    ensure_aggregate_schema(engine)
+    with engine.begin() as conn:
+        ensure_populated(conn)
+        refresh_derived(conn)
+        sync_rollup_links(conn)
+        if links:
+            refresh_rankings(conn, full=True, boards=("directors",))
+            bump_data_version(conn)
+    return counts, links
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumable OMDb director enrichment")
+    parser.add_argument("--db", default=DB, help="SQLite file (default: the DB_URL database)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="movies committed per transaction")
+    parser.add_argument("--omdb-concurrency", type=int, default=OMDB_CONCURRENCY)
+    parser.add_argument("--retry-not-found", action="store_true",
+                        help="also retry titles OMDb previously had no director for")
+    parser.add_argument("--limit", type=int, help="process at most this many movies")
+    args = parser.parse_args(argv)
+    counts, links = run(args.db, args.batch_size, args.omdb_concurrency, args.retry_not_found, args.limit)
+    print(f"Done! {counts}, new links: {links}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+"""
+The MovieLens + OMDb load behind etl.py, which parses the command line and imports this
+module only once there is a load to run.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import pandas as pd
+from sqlalchemy import (Table, Column, Integer, String, MetaData, Float, Text,
+                        UniqueConstraint, ForeignKey, select)
+from sqlalchemy.dialects import sqlite as sqlite_dialect, mysql as mysql_dialect
+from sqlalchemy.exc import IntegrityError
+from omdb import OmdbClient, OMDB_CONCURRENCY
+from omdb_cache import open_cache
+from title_match import TitleMatcher
+from pipeline_state import (ensure_state_schema, get_state, save_state, file_checksum, tail_checksum,
+                            plan_ratings_load, changed_movies, save_fingerprints, bump_data_version)
+from aggregates import ensure_aggregate_schema, ensure_populated, load_rating_batch, refresh_derived, rebuild
+from db import get_engine
+from dimensions import DimensionResolver
+from db_profile import create_indexes, bulk_load
+from ranking import refresh as refresh_rankings
+from rollups import sync_links as sync_rollup_links
+from search import ensure_search_index, sync_search
+from transform import parse_titles, explode_genres, genres_by_movie
+from ingest import (iter_csv_chunks, iter_row_ranges, newer_than, newest_timestamp, peak_memory_mb,
+                    MOVIES_DTYPES, RATINGS_DTYPES, CHUNK_SIZE)
+from metrics import metrics, profiling
+from snapshot import write_snapshot, SNAPSHOT_DIR
+from watch import watch, FLUSH_ROWS, FLUSH_SECONDS
+from etl import BATCH_SIZE
+
+OMDB_API_KEY = os.environ.get("OMDB_API_KEY")
+
+metadata = MetaData()
+
+movies = Table('movies', metadata,
+    Column('movie_id', Integer, primary_key=True),
+    Column('title', Text, nullable=False),
+    Column('year', Integer),
+    Column('imdb_id', String, unique=True),
+    Column('plot', Text),
+    Column('box_office', String),
+    Column('runtime', Integer),
+)
+
+genres = Table('genres', metadata,
+    Column('genre_id', Integer, primary_key=True, autoincrement=True),
+    Column('genre_name', String, unique=True, nullable=False),
+)
+
+movie_genres = Table('movie_genres', metadata,
+    Column('movie_id', Integer, ForeignKey('movies.movie_id', ondelete='CASCADE'), primary_key=True),
+    Column('genre_id', Integer, ForeignKey('genres.genre_id', ondelete='CASCADE'), primary_key=True),
+)
+
+directors = Table('directors', metadata,
+    Column('director_id', Integer, primary_key=True, autoincrement=True),
+    Column('director_name', String, unique=True, nullable=False),
+)
+
+movie_directors = Table('movie_directors', metadata,
+    Column('movie_id', Integer, ForeignKey('movies.movie_id', ondelete='CASCADE'), primary_key=True),
+    Column('director_id', Integer, ForeignKey('directors.director_id', ondelete='CASCADE'), primary_key=True),
+)
+
+ratings = Table('ratings', metadata,
+    Column('rating_id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', Integer, nullable=False),
+    Column('movie_id', Integer, ForeignKey('movies.movie_id', ondelete='CASCADE')),
+    Column('rating', Float, nullable=False),
+    Column('timestamp', Integer),
+    UniqueConstraint('user_id', 'movie_id', name='uix_user_movie')
+)
+
+def ensure_schema():
+    engine = get_engine()
+    metadata.create_all(engine)
+    ensure_state_schema(engine)
+    ensure_aggregate_schema(engine)
+    with engine.begin() as conn:
+        create_indexes(conn)
+        ensure_search_index(conn)
+
+def title_matcher(cache, concurrency=OMDB_CONCURRENCY):
+    """TitleMatcher over the persistent cache and the shared rate-limited client (offline without an API key)."""
+    client = OmdbClient(OMDB_API_KEY, concurrency=concurrency, usage=cache) if OMDB_API_KEY else None
+    return TitleMatcher(cache, client)
+
+def enrich_from_omdb(queries, matcher):
+    """
+    Resolve (title, year) queries through a title_match.TitleMatcher: the persistent cache
+    and the local title index first, then ranked candidate queries (normalized title,
+    alternate titles, no year) fetched concurrently until one is found.
+    Returns {(title, year): data}. Failed lookups are not cached so a later run retries them.
+    """
+    client = matcher.client
+    results = {}
+    before = matcher.stats()
+    retries_before = client.retries if client else 0
+    start = time.perf_counter()
+    with metrics.stage("enrich.omdb", rows=len(queries)):
+        for (title, year), data, error in matcher.lookup_many(queries):
+            if error is not None:
+                print(f"Warning: OMDb query failed for {title}: {error}")
+                metrics.count("omdb_errors")
+                continue
+            results[(title, year)] = data
+    elapsed = time.perf_counter() - start
+    stats = {k: v - before[k] for k, v in matcher.stats().items() if isinstance(v, int)}
+    metrics.count("omdb_cache_hits", stats['cache'])
+    metrics.count("omdb_local_matches", stats['local'])
+    metrics.count("omdb_not_found", stats['not_found'])
+    if client:
+        metrics.count("omdb_requests", stats['calls'])
+        metrics.count("omdb_retries", client.retries - retries_before)
+    print(f"OMDb: {stats['resolved']} of {stats['movies']} titles resolved in {elapsed:.1f}s "
+          f"(cache {stats['cache']}, local index {stats['local']}, OMDb {stats['network']}"
+          + (f"; {stats['calls']} requests, {stats['calls'] / max(1, stats['movies']):.2f} per title, "
+             f"{client.retries - retries_before} retries)" if client else "; offline)"))
+    return results
+
+def upsert_movie(conn, movie_row):
+    """
+    movie_row: dict with keys movie_id, title, year, imdb_id, plot, box_office, runtime
+    Use SELECT then INSERT/UPDATE for portability.
+    """
+    sel = select(movies.c.movie_id).where(movies.c.movie_id == movie_row['movie_id'])
+    existing = conn.execute(sel).fetchone()
+    if existing:
+        upd = movies.update().where(movies.c.movie_id == movie_row['movie_id']).values(
+            title=movie_row.get('title'),
+            year=movie_row.get('year'),
+            imdb_id=movie_row.get('imdb_id'),
+            plot=movie_row.get('plot'),
+            box_office=movie_row.get('box_office'),
+            runtime=movie_row.get('runtime')
+        )
+        conn.execute(upd)
+    else:
+        ins = movies.insert().values(**movie_row)
+        conn.execute(ins)
+
+def upsert_rating(conn, rating_row):
+    sel = select(ratings.c.rating_id).where((ratings.c.user_id == rating_row['user_id']) & (ratings.c.movie_id == rating_row['movie_id']))
+    existing = conn.execute(sel).fetchone()
+    if existing:
+        upd = ratings.update().where(ratings.c.rating_id == existing[0]).values(rating=rating_row['rating'], timestamp=rating_row.get('timestamp'))
+        conn.execute(upd)
+    else:
+        ins = ratings.insert().values(**rating_row)
+        conn.execute(ins)
+
+def bulk_upsert(conn, table, rows, key_cols):
+    """
+    Upsert a batch of row dicts with a single executemany statement.
+    SQLite uses INSERT ... ON CONFLICT DO UPDATE, MySQL uses ON DUPLICATE KEY UPDATE;
+    other backends fall back to the per-row upsert_movie/upsert_rating path.
+    """
+    if not rows:
+        return
+    update_cols = [c for c in rows[0] if c not in key_cols]
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        stmt = sqlite_dialect.insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=key_cols,
+                                          set_={c: stmt.excluded[c] for c in update_cols})
+    elif dialect == "mysql":
+        stmt = mysql_dialect.insert(table)
+        stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_cols})
+    else:
+        upsert = upsert_movie if table is movies else upsert_rating
+        for row in rows:
+            upsert(conn, row)
+        return
+    conn.execute(stmt, rows)
+
+def iter_batches(items, batch_size):
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+def ratings_rows(df_ratings):
+    """
+    Convert the ratings DataFrame into row dicts without iterrows. Rows with a missing
+    user, movie or rating are skipped; duplicate (user_id, movie_id) pairs keep the last row.
+    """
+    df = df_ratings.dropna(subset=['userId', 'movieId', 'rating'])
+    user_ids = df['userId'].astype('int64').tolist()
+    movie_ids = df['movieId'].astype('int64').tolist()
+    values = df['rating'].astype('float64').tolist()
+    if 'timestamp' in df.columns:
+        stamps = [None if pd.isna(t) else int(t) for t in df['timestamp'].tolist()]
+    else:
+        stamps = [None] * len(df)
+    rows = {}
+    for uid, mid, rating, ts in zip(user_ids, movie_ids, values, stamps):
+        rows[(uid, mid)] = {'user_id': uid, 'movie_id': mid, 'rating': rating, 'timestamp': ts}
+    return list(rows.values())
+
+def load_ratings(df_ratings, batch_size=BATCH_SIZE):
+    """
+    Bulk-load ratings, one transaction per batch. Returns the number of rows written.
+    On SQLite each batch is staged and folded into the summary tables incrementally;
+    other backends upsert directly and rebuild the summaries at the end of the run.
+    """
+    with metrics.stage("parse.ratings", rows=len(df_ratings)):
+        rows = ratings_rows(df_ratings)
+    return write_ratings(rows, batch_size)
+
+class RatingsLoadError(Exception):
+    pass
+
+def write_ratings(rows, batch_size=BATCH_SIZE):
+    """
+    Write prepared rating rows (from ratings_rows) in batches; see load_ratings. A batch that
+    fails is rolled back and the rest are still written, then RatingsLoadError is raised so
+    the run stops before saving the ratings offset and watermark past the lost rows.
+    """
+    loaded = failed = 0
+    for batch in iter_batches(rows, batch_size):
+        try:
+            with metrics.stage("upsert.ratings", rows=len(batch)), get_engine().begin() as conn:
+                if conn.dialect.name == "sqlite":
+                    load_rating_batch(conn, batch)
+                else:
+                    bulk_upsert(conn, ratings, batch, ['user_id', 'movie_id'])
+            loaded += len(batch)
+        except IntegrityError as e:
+            # rows the database rejects; anything else (schema, connection) is a bug and propagates
+            print(f"Warning: failed to load ratings batch of {len(batch)} rows: {e}")
+            metrics.count("ratings_failed_rows", len(batch))
+            failed += len(batch)
+    if failed:
+        raise RatingsLoadError(f"{failed} of {len(rows)} ratings failed to load")
+    return loaded
+
+def parse_ratings_range(task):
+    """
+    Worker side of the parallel ratings load: read one row-aligned byte range of the CSV
+    and return (rows ready for write_ratings, rows read, newest timestamp).
+    """
+    path, start, end, chunk_size, watermark = task
+    rows, read, newest = [], 0, None
+    for chunk in iter_csv_chunks(path, RATINGS_DTYPES, chunk_size, start, end):
+        read += len(chunk)
+        chunk = newer_than(chunk, watermark)
+        rows.extend(ratings_rows(chunk))
+        chunk_newest = newest_timestamp(chunk)
+        if chunk_newest is not None:
+            newest = chunk_newest if newest is None else max(newest, chunk_newest)
+    return rows, read, newest
+
+def load_ratings_parallel(path, plan, args):
+    """
+    Parse ratings in a pool of args.workers processes while this process is the only
+    writer. Each task is exactly one chunk of the serial read and results are written in
+    file order, so batches, rating ids and summary deltas match a serial load. At most two
+    parsed chunks per worker are in flight to bound memory.
+    Yields (rows read, rows loaded, newest timestamp) per chunk.
+    """
+    ranges = iter_row_ranges(path, args.chunk_size, plan['start'], plan['end'])
+    with ProcessPoolExecutor(args.workers) as pool:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(pool.submit(parse_ratings_range, (path, start, end, args.chunk_size, plan['watermark'])))
+            while len(pending) >= 2 * args.workers:
+                yield _write_parsed(pending.popleft(), args.batch_size)
+        while pending:
+            yield _write_parsed(pending.popleft(), args.batch_size)
+
+def _write_parsed(future, batch_size):
+    with metrics.stage("parse.ratings_wait") as entry:
+        rows, read, newest = future.result()
+        entry["rows"] += read
+    return read, write_ratings(rows, batch_size), newest
+
+def parse_title_and_year(title_raw):
+    title = title_raw
+    year = None
+    if title_raw and title_raw.strip().endswith(")"):
+        try:
+            i = title_raw.rfind(" (")
+            if i != -1:
+                year_part = title_raw[i+2:-1]
+                if year_part.isdigit():
+                    year = int(year_part)
+                    title = title_raw[:i]
+        except Exception:
+            pass
+    return title.strip(), year
+
+def dimension_resolvers():
+    """Fresh (genre, director) name -> id resolvers; run() preloads them from the database."""
+    return (DimensionResolver(genres, 'genre_id', 'genre_name', movie_genres),
+            DimensionResolver(directors, 'director_id', 'director_name', movie_directors))
+
+def load_movie_batch(batch, genre_dim, director_dim):
+    """
+    batch: list of (movie_row, genre_names, director_names). Upserts the movies with one
+    executemany and links genres/directors through the batched dimension resolvers, all
+    inside a single transaction.
+    """
+    with get_engine().begin() as conn:
+        with metrics.stage("upsert.movies", rows=len(batch)):
+            bulk_upsert(conn, movies, [movie_row for movie_row, _, _ in batch], ['movie_id'])
+        with metrics.stage("upsert.genres") as entry:
+            entry["rows"] += genre_dim.link(conn, [(movie_row['movie_id'], names) for movie_row, names, _ in batch])
+        with metrics.stage("upsert.directors") as entry:
+            entry["rows"] += director_dim.link(conn, [(movie_row['movie_id'], names) for movie_row, _, names in batch])
+        with metrics.stage("upsert.search", rows=len(batch)):
+            sync_search(conn, [movie_row['movie_id'] for movie_row, _, _ in batch])
+
+def movie_row_from(mid, title, year, omdb_data, seen_imdb_ids):
+    movie_row = {
+        'movie_id': mid,
+        'title': title,
+        'year': year,
+        'imdb_id': None,
+        'plot': None,
+        'box_office': None,
+        'runtime': None
+    }
+    if omdb_data:
+        imdb_id = omdb_data.get('imdbID')
+        # duplicate MovieLens titles resolve to the same OMDb record; imdb_id is UNIQUE
+        if imdb_id not in seen_imdb_ids:
+            movie_row['imdb_id'] = imdb_id
+            seen_imdb_ids.add(imdb_id)
+        movie_row['plot'] = omdb_data.get('Plot')
+        movie_row['box_office'] = omdb_data.get('BoxOffice')
+        try:
+            rt = omdb_data.get('Runtime')
+            if rt and rt.lower().endswith('min'):
+                movie_row['runtime'] = int(rt.split()[0])
+        except Exception:
+            movie_row['runtime'] = None
+    return movie_row
+
+def prepare_movies_chunk(df_movies, matcher, args, seen_imdb_ids):
+    """
+    Parse and enrich one chunk of movies.csv. Returns (batch, fingerprints): the
+    (movie_row, genre_names, director_names) rows load_movie_batch takes and the
+    fingerprints to save once they are loaded. Both are empty when nothing changed.
+    """
+    with metrics.stage("parse.movies", rows=len(df_movies)):
+        titles = parse_titles(df_movies['title'])
+        years = [None if pd.isna(y) else int(y) for y in titles['year']]
+        genres_raw = df_movies['genres'].tolist() if 'genres' in df_movies.columns else [None] * len(df_movies)
+        parsed = list(zip(df_movies['movieId'].astype('int64').tolist(), titles['title'].tolist(), years, genres_raw))
+        with get_engine().connect() as conn:
+            changed, fingerprints = changed_movies(conn, parsed)
+    if args.incremental:
+        parsed = changed
+    if not parsed:
+        return [], []
+
+    omdb_results = enrich_from_omdb([(title, year) for _, title, year, _ in parsed], matcher)
+
+    genre_map = {}
+    if 'genres' in df_movies.columns:
+        with metrics.stage("parse.genres") as entry:
+            loaded_ids = {mid for mid, _, _, _ in parsed}
+            long = explode_genres(df_movies[df_movies['movieId'].isin(loaded_ids)])
+            genre_map = genres_by_movie(long)
+            entry["rows"] += len(long)
+
+    batch = []
+    for mid, title, year, _ in parsed:
+        omdb_data = omdb_results.get((title, year))
+        movie_row = movie_row_from(mid, title, year, omdb_data, seen_imdb_ids)
+        director_names = []
+        if omdb_data:
+            directors_field = omdb_data.get('Director')
+            if directors_field and directors_field != "N/A":
+                director_names = [d.strip() for d in directors_field.split(',') if d.strip()]
+        batch.append((movie_row, genre_map.get(mid, []), director_names))
+    return batch, fingerprints
+
+def load_movies_chunk(df_movies, matcher, args, seen_imdb_ids, genre_dim, director_dim):
+    """
+    Parse, enrich and load one chunk of movies.csv. Returns the number of movies loaded.
+    """
+    batch, fingerprints = prepare_movies_chunk(df_movies, matcher, args, seen_imdb_ids)
+    if not batch:
+        return 0
+    for movie_batch in iter_batches(batch, args.batch_size):
+        load_movie_batch(movie_batch, genre_dim, director_dim)
+    with get_engine().begin() as conn:
+        save_fingerprints(conn, fingerprints)
+    return len(batch)
+
+def report(label, count, elapsed):
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    peak = peak_memory_mb()
+    peak_text = f", peak RSS {peak:,.0f} MB" if peak is not None else ""
+    print(f"Loaded {count} {label} in {elapsed:.2f}s ({rate:,.0f} rows/s{peak_text})")
+
+def run(args):
+    """Load movies and ratings according to the parsed command-line arguments."""
+    engine = get_engine()
+    with engine.connect() as conn:
+        movies_state = get_state(conn, 'movies') if args.incremental else None
+        ratings_state = get_state(conn, 'ratings') if args.incremental else None
+
+    genre_dim, director_dim = dimension_resolvers()
+    with engine.connect() as conn:
+        genre_dim.preload(conn)
+        director_dim.preload(conn)
+
+    loaded_movies = loaded_ratings = 0
+    movies_checksum = file_checksum(args.movies)
+    if movies_state and movies_state['file_checksum'] == movies_checksum:
+        print("movies.csv unchanged since last run; skipping movies.")
+    else:
+        start = time.perf_counter()
+        seen_imdb_ids = set()
+        cache = open_cache()
+        matcher = title_matcher(cache, args.omdb_concurrency)
+        for chunk in metrics.iter_stage("read.movies", iter_csv_chunks(args.movies, MOVIES_DTYPES, args.chunk_size)):
+            loaded_movies += load_movies_chunk(chunk, matcher, args, seen_imdb_ids, genre_dim, director_dim)
+        cache.close()
+        report("movies", loaded_movies, time.perf_counter() - start)
+        with engine.begin() as conn:
+            save_state(conn, 'movies', path=str(args.movies), file_checksum=movies_checksum,
+                       size=Path(args.movies).stat().st_size)
+
+    plan = plan_ratings_load(args.ratings, ratings_state)
+    watermark = ratings_state['watermark'] if ratings_state else None
+    if plan['mode'] == 'unchanged':
+        print("ratings.csv has no new rows since last run.")
+    else:
+        start = time.perf_counter()
+        if args.workers > 1:
+            for _, loaded, newest in load_ratings_parallel(args.ratings, plan, args):
+                loaded_ratings += loaded
+                if newest is not None:
+                    watermark = newest if watermark is None else max(watermark, newest)
+        else:
+            chunks = iter_csv_chunks(args.ratings, RATINGS_DTYPES, args.chunk_size, plan['start'], plan['end'])
+            for chunk in metrics.iter_stage("read.ratings", chunks):
+                chunk = newer_than(chunk, plan['watermark'])
+                loaded_ratings += load_ratings(chunk, args.batch_size)
+                newest = newest_timestamp(chunk)
+                if newest is not None:
+                    watermark = newest if watermark is None else max(watermark, newest)
+        if args.incremental:
+            print(f"Incremental ({plan['mode']}) ratings load.")
+        report("ratings", loaded_ratings, time.perf_counter() - start)
+
+    with engine.begin() as conn:
+        save_state(conn, 'ratings', path=str(args.ratings), size=Path(args.ratings).stat().st_size,
+                   byte_offset=plan['end'], tail_checksum=tail_checksum(args.ratings, plan['end']),
+                   watermark=watermark)
+        if loaded_movies or loaded_ratings:
+            with metrics.stage("refresh.summaries"):
+                if conn.dialect.name == "sqlite":
+                    refresh_derived(conn)
+                    if loaded_movies:
+                        sync_rollup_links(conn)
+                else:
+                    rebuild(conn)
+            with metrics.stage("refresh.rankings"):
+                refresh_rankings(conn, full=conn.dialect.name != "sqlite")
+            bump_data_version(conn)
+
+def run_etl(args):
+    """Run the load for etl.py's parsed `args`. Options etl.py leaves at None take the
+    defaults defined next to the code that uses them."""
+    for name, default in (("chunk_size", CHUNK_SIZE), ("omdb_concurrency", OMDB_CONCURRENCY),
+                          ("flush_rows", FLUSH_ROWS), ("flush_seconds", FLUSH_SECONDS)):
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    if args.snapshot is True:
+        args.snapshot = SNAPSHOT_DIR
+    if args.watch:
+        args.incremental = True
+
+    if not Path(args.movies).exists() or not Path(args.ratings).exists():
+        print("ERROR: movies.csv or ratings.csv not found in current directory.")
+        print("Put MovieLens 'movies.csv' and 'ratings.csv' here and re-run.")
+        return
+
+    engine = get_engine()
+    with profiling(args.profile, args.cprofile, engines=[engine]):
+        ensure_schema()
+        with engine.begin() as conn:
+            ensure_populated(conn)
+        # a full load rebuilds the secondary indexes once at the end instead of per row
+        try:
+            with metrics.stage("load"), bulk_load(engine, rebuild_indexes=not args.incremental):
+                run(args)
+        except RatingsLoadError as e:
+            raise SystemExit(f"ERROR: {e}. The ratings position was not saved, so the next "
+                             "--incremental run retries them.")
+        if args.watch:
+            watch(args.ratings, args.watch_dir, args.flush_rows, args.flush_seconds, args.watch_timeout)
+        if args.snapshot:
+            with metrics.stage("snapshot"):
+                write_snapshot(engine, args.snapshot)
+
+    print("ETL finished.")
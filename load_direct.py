@@ -1,85 +1,189 @@
 import os
-import sqlite3
+import argparse
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import inspect, text
+from db import get_engine, is_sqlite, sqlite_connect, bulk_insert
+from aggregates import ensure_aggregate_schema, ensure_populated, load_rating_batch, refresh_derived, rebuild
+from db_profile import bulk_load, create_indexes
+from ranking import refresh as refresh_rankings
+from search import ensure_search_index, rebuild_search, sync_search
+from transform import parse_titles
+from ingest import (iter_csv_chunks, newer_than, newest_timestamp, peak_memory_mb, MOVIES_DTYPES, RATINGS_DTYPES,
+                    CHUNK_SIZE)
+from pipeline_state import (ensure_state_schema, get_state, save_state, file_checksum, tail_checksum,
+                            plan_ratings_load, changed_movies, save_fingerprints, bump_data_version)
+from snapshot import write_snapshot, SNAPSHOT_DIR
 
-DB_FILE = "movies.db"
 SCHEMA_FILE = "schema.sql"
 MOVIES_CSV = "movies.csv"
 RATINGS_CSV = "ratings.csv"
 
-print("Using DB file:", os.path.abspath(DB_FILE))
-if not os.path.exists(SCHEMA_FILE):
-    raise SystemExit("schema.sql not found in folder. Put schema.sql next to this script.")
+parser = argparse.ArgumentParser(description="Direct (pandas, bulk insert) load of the MovieLens CSVs")
+parser.add_argument("--incremental", action="store_true",
+                    help="keep existing rows and load only changed movies / new ratings")
+parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                    help="CSV rows read and loaded at a time (bounds memory)")
+parser.add_argument("--snapshot", nargs="?", const=SNAPSHOT_DIR, metavar="DIR",
+                    help=f"write a columnar snapshot after the load (default dir: {SNAPSHOT_DIR})")
+args = parser.parse_args()
 
-with sqlite3.connect(DB_FILE) as conn:
-    sql = open(SCHEMA_FILE, "r", encoding="utf-8").read()
-    conn.executescript(sql)
+engine = get_engine()
+print("Using database:", engine.url.render_as_string(hide_password=True))
+if is_sqlite():
+    if not os.path.exists(SCHEMA_FILE):
+        raise SystemExit("schema.sql not found in folder. Put schema.sql next to this script.")
+    with sqlite_connect() as conn:
+        sql = open(SCHEMA_FILE, "r", encoding="utf-8").read()
+        conn.executescript(sql)
+else:
+    # schema.sql is SQLite DDL; other backends get the same tables from the ETL's metadata
+    from etl_load import metadata
+    metadata.create_all(engine)
 print("Schema applied/verified.")
 
-print("Reading CSVs...")
-movies_df = pd.read_csv(MOVIES_CSV)
-ratings_df = pd.read_csv(RATINGS_CSV)
-print("movies shape:", movies_df.shape)
-print("ratings shape:", ratings_df.shape)
-
-def parse_title_year(title_raw):
-    title = str(title_raw)
-    year = None
-    if title.endswith(")"):
-        i = title.rfind(" (")
-        if i != -1:
-            part = title[i+2:-1]
-            if part.isdigit():
-                year = int(part)
-                title = title[:i]
-    return title.strip(), year
-
-movies_parsed = []
-for _, r in movies_df.iterrows():
-    mid = int(r["movieId"])
-    raw_title = r["title"]
-    title, year = parse_title_year(raw_title)
-    movies_parsed.append({
-        "movie_id": mid,
-        "title": title,
-        "year": year,
+ensure_state_schema(engine)
+ensure_aggregate_schema(engine)
+with engine.begin() as conn:
+    create_indexes(conn)
+with engine.connect() as conn:
+    movies_state = get_state(conn, "movies") if args.incremental else None
+    ratings_state = get_state(conn, "ratings") if args.incremental else None
+
+def clean_movies(chunk, conn):
+    titles = parse_titles(chunk["title"])
+    years = [None if pd.isna(y) else int(y) for y in titles["year"]]
+    parsed = list(zip(chunk["movieId"].astype("int64").tolist(), titles["title"].tolist(), years,
+                      chunk["genres"].tolist()))
+    changed, fingerprints = changed_movies(conn, parsed)
+    if args.incremental:
+        parsed = changed
+    movies_clean = pd.DataFrame({
+        "movie_id": [p[0] for p in parsed],
+        "title": [p[1] for p in parsed],
+        "year": pd.array([p[2] for p in parsed], dtype="Int64"),
         "imdb_id": None,
         "plot": None,
         "box_office": None,
         "runtime": None
     })
-movies_clean = pd.DataFrame(movies_parsed)
+    return movies_clean, fingerprints
 
-ratings_clean = ratings_df.rename(columns={"userId": "user_id", "movieId": "movie_id"})
-cols = ["user_id", "movie_id", "rating"]
-if "timestamp" in ratings_clean.columns:
-    cols.append("timestamp")
-ratings_clean = ratings_clean[cols]
+def clean_ratings(chunk):
+    # a rating without its user, movie or value cannot be stored; a missing timestamp is kept as NULL
+    chunk = chunk.dropna(subset=["userId", "movieId", "rating"]).astype({"userId": "int64", "movieId": "int64"})
+    ratings_clean = chunk.rename(columns={"userId": "user_id", "movieId": "movie_id"})
+    cols = ["user_id", "movie_id", "rating"]
+    if "timestamp" in ratings_clean.columns:
+        ratings_clean = ratings_clean.astype({"timestamp": "Int64"})
+        cols.append("timestamp")
+    return ratings_clean[cols]
 
-engine = create_engine(f"sqlite:///{DB_FILE}")
+def upsert_movies(conn, movies_clean):
+    # keep OMDb columns of existing movies; only the MovieLens fields can have changed
+    rows = movies_clean[["movie_id", "title", "year"]].astype(object)
+    rows = rows.where(rows.notna(), None).to_dict("records")
+    if not rows:
+        return
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(
+            "INSERT INTO movies (movie_id, title, year) VALUES (:movie_id, :title, :year) "
+            "ON CONFLICT(movie_id) DO UPDATE SET title = excluded.title, year = excluded.year"), rows)
+    else:
+        from etl_load import bulk_upsert, movies
+        bulk_upsert(conn, movies, rows, ["movie_id"])
 
-with engine.begin() as conn:
-    conn.execute(text("DELETE FROM movie_genres"))
-    conn.execute(text("DELETE FROM movie_directors"))
-    conn.execute(text("DELETE FROM genres"))
-    conn.execute(text("DELETE FROM directors"))
-    conn.execute(text("DELETE FROM ratings"))
-    conn.execute(text("DELETE FROM movies"))
-    print("Cleared existing rows from tables.")
-
-    movies_clean.to_sql("movies", con=conn, if_exists="append", index=False)
-    print("Inserted movies:", len(movies_clean))
-    ratings_clean.to_sql("ratings", con=conn, if_exists="append", index=False)
-    print("Inserted ratings:", len(ratings_clean))
-
-with sqlite3.connect(DB_FILE) as conn:
-    cur = conn.cursor()
+def records(df):
+    """Row dicts with NaN as None, for bulk_insert / executemany."""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+def upsert_ratings(conn, ratings_clean):
+    if "timestamp" not in ratings_clean.columns:
+        ratings_clean = ratings_clean.assign(timestamp=None)
+    ratings_clean = ratings_clean.drop_duplicates(["user_id", "movie_id"], keep="last")
+    if conn.dialect.name == "sqlite":
+        load_rating_batch(conn, records(ratings_clean))
+    else:
+        # no staged deltas off SQLite: upsert here and rebuild the summaries once after the load
+        from etl_load import bulk_upsert, ratings
+        bulk_upsert(conn, ratings, records(ratings_clean), ["user_id", "movie_id"])
+
+movies_checksum = file_checksum(MOVIES_CSV)
+skip_movies = bool(movies_state and movies_state["file_checksum"] == movies_checksum)
+plan = plan_ratings_load(RATINGS_CSV, ratings_state)
+watermark = ratings_state["watermark"] if ratings_state else None
+print("Streaming CSVs in chunks of", args.chunk_size, "rows; ratings mode:", plan["mode"])
+
+with bulk_load(engine, rebuild_indexes=not args.incremental), engine.begin() as conn:
+    if args.incremental:
+        ensure_populated(conn)
+        ensure_search_index(conn)
+    else:
+        conn.execute(text("DELETE FROM movie_genres"))
+        conn.execute(text("DELETE FROM movie_directors"))
+        conn.execute(text("DELETE FROM genres"))
+        conn.execute(text("DELETE FROM directors"))
+        conn.execute(text("DELETE FROM ratings"))
+        conn.execute(text("DELETE FROM movies"))
+        # per-movie state about the rows just deleted: the fingerprints are rewritten by this
+        # load, and enrich_directors.py must look every movie up again (as after snapshot restore)
+        conn.execute(text("DELETE FROM movie_fingerprints"))
+        if inspect(conn).has_table("director_enrichment"):
+            conn.execute(text("DELETE FROM director_enrichment"))
+        print("Cleared existing rows from tables.")
+
+    n_movies = 0
+    if not skip_movies:
+        for chunk in iter_csv_chunks(MOVIES_CSV, MOVIES_DTYPES, args.chunk_size):
+            movies_clean, fingerprints = clean_movies(chunk, conn)
+            if args.incremental:
+                upsert_movies(conn, movies_clean)
+                sync_search(conn, movies_clean["movie_id"].tolist())
+            else:
+                bulk_insert(conn, "movies", records(movies_clean))
+            save_fingerprints(conn, fingerprints)
+            n_movies += len(movies_clean)
+    print("Loaded movies:", n_movies)
+
+    n_ratings = 0
+    if plan["mode"] != "unchanged":
+        for chunk in iter_csv_chunks(RATINGS_CSV, RATINGS_DTYPES, args.chunk_size, plan["start"], plan["end"]):
+            ratings_clean = clean_ratings(newer_than(chunk, plan["watermark"]))
+            if args.incremental:
+                upsert_ratings(conn, ratings_clean)
+            else:
+                bulk_insert(conn, "ratings", records(ratings_clean))
+            newest = newest_timestamp(ratings_clean)
+            if newest is not None:
+                watermark = newest if watermark is None else max(watermark, newest)
+            n_ratings += len(ratings_clean)
+    print("Loaded ratings:", n_ratings)
+
+    if args.incremental and conn.dialect.name == "sqlite":
+        refresh_derived(conn)
+    else:
+        rebuild(conn)
+    refresh_rankings(conn, full=not args.incremental or conn.dialect.name != "sqlite")
+    if not args.incremental:
+        rebuild_search(conn)
+    bump_data_version(conn)
+    print("Summary tables updated.")
+
+    save_state(conn, "movies", path=MOVIES_CSV, file_checksum=movies_checksum, size=os.path.getsize(MOVIES_CSV))
+    save_state(conn, "ratings", path=RATINGS_CSV, size=os.path.getsize(RATINGS_CSV), byte_offset=plan["end"],
+               tail_checksum=tail_checksum(RATINGS_CSV, plan["end"]), watermark=watermark)
+
+if args.snapshot:
+    write_snapshot(engine, args.snapshot)
+
+peak = peak_memory_mb()
+if peak is not None:
+    print(f"Peak memory: {peak:,.0f} MB")
+
+with engine.connect() as conn:
     for t in ["movies","ratings","genres","directors","movie_genres","movie_directors"]:
         try:
-            cur.execute(f"SELECT COUNT(*) FROM {t}")
-            print(f"{t:15s} : {cur.fetchone()[0]}")
+            print(f"{t:15s} : {conn.execute(text(f'SELECT COUNT(*) FROM {t}')).scalar()}")
         except Exception as e:
             print(f"{t:15s} : ERROR ->", e)
 
-print("Done.")
\ No newline at end of file
+print("Done.")
@@ -0,0 +1,148 @@
+"""
+Load test for report_server.py: --concurrency keep-alive connections request a mix of
+reports and parameterized variants for --duration seconds (or --requests in total), then
+print throughput and latency percentiles.
+
+    python report_server.py --port 8080 &
+    python loadtest.py --url http://127.0.0.1:8080 --concurrency 16 --duration 10
+    python loadtest.py --spawn --pool-size 4       # start a server on a free port, test, stop it
+"""
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+from collections import Counter
+from urllib.parse import urlsplit
+
+PATHS = [
+    "/reports/top_movies",
+    "/reports/top_movies?min_count=50&limit=20",
+    "/reports/top_movies_filtered?genre=Comedy",
+    "/reports/top_movies_filtered?year_from=1990&year_to=1999",
+    "/reports/top_movies_filtered?genre=Drama&year_from=2000&limit=25",
+    "/reports/top_genres?min_count=1000",
+    "/reports/top_directors?min_movies=2",
+    "/reports/prolific_directors?limit=20",
+    "/reports/ratings_by_year",
+    "/reports/movies_per_year?limit=30",
+    "/reports/top_users?limit=25",
+    "/search?q=star+wa&prefix=1",
+    "/search?q=the+empire+strikes&phrase=1&fields=title",
+]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))]
+
+
+async def worker(host, port, paths, offset, deadline, budget, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    i = offset
+    try:
+        while time.perf_counter() < deadline and budget[0] > 0:
+            budget[0] -= 1
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+    finally:
+        writer.close()
+
+
+async def run_load(url, concurrency, duration, requests, paths=PATHS):
+    parts = urlsplit(url)
+    latencies, statuses = [], Counter()
+    budget = [requests or float("inf")]
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(parts.hostname, parts.port or 80, paths, n, start + duration, budget,
+                                  latencies, statuses) for n in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    ms = {f"p{p}": round(percentile(latencies, p) * 1000, 3) for p in (50, 90, 99)}
+    return {"requests": len(latencies), "seconds": round(elapsed, 3),
+            "requests_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+            "latency_ms": {**ms, "max": round(latencies[-1] * 1000, 3) if latencies else None},
+            "status": dict(sorted(statuses.items()))}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(port, pool_size, db=None, timeout=30):
+    """Start report_server.py on `port` and wait until it accepts connections."""
+    cmd = [sys.executable, str(Path(__file__).with_name("report_server.py")),
+           "--port", str(port), "--pool-size", str(pool_size)]
+    proc = subprocess.Popen(cmd + (["--db", db] if db else []))
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"report_server.py exited with code {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit(f"report_server.py did not start within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the report API")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, help="stop after this many requests instead")
+    parser.add_argument("--spawn", action="store_true", help="start report_server.py on a free port first")
+    parser.add_argument("--pool-size", type=int, default=4, help="server read connections (with --spawn)")
+    parser.add_argument("--db", help="SQLite file for the spawned server (default: the DB_URL database)")
+    parser.add_argument("--out", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    proc = None
+    url = args.url
+    if args.spawn:
+        port = free_port()
+        proc = spawn_server(port, args.pool_size, args.db)
+        url = f"http://127.0.0.1:{port}"
+    try:
+        result = asyncio.run(run_load(url, args.concurrency, args.duration, args.requests))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    lat = result["latency_ms"]
+    print(f"{result['requests']} requests in {result['seconds']}s over {args.concurrency} connections: "
+          f"{result['requests_per_s']} req/s")
+    print(f"latency p50 {lat['p50']} ms, p90 {lat['p90']} ms, p99 {lat['p99']} ms, max {lat['max']} ms")
+    print("status codes:", result["status"])
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "concurrency": args.concurrency, **result}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Stage-level metrics for the ETL and report scripts: wall time, row counts and DB statement
+counts per stage, plus counters (OMDb requests, cache hits) and peak memory.
+
+    python etl.py --profile metrics.json              # JSON
+    python etl.py --profile metrics.prom --cprofile etl.prof
+    python test_query.py --profile queries.json
+
+Any --profile path not ending in .json is written in the Prometheus text format. Stages
+nest (their times and statement counts are inclusive) and repeat (values accumulate).
+"""
+import re
+import json
+import time
+import cProfile
+from contextlib import contextmanager
+from sqlalchemy import event
+from ingest import peak_memory_mb
+
+PREFIX = "moviepipe"
+
+
+class Metrics:
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.statements = 0
+        self.wall_seconds = None
+
+    def _entry(self, name):
+        return self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "rows": 0, "statements": 0})
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Time a block as stage `name`; rows can be given here or added to the yielded entry."""
+        entry = self._entry(name)
+        statements = self.statements
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["seconds"] += time.perf_counter() - start
+            entry["calls"] += 1
+            entry["statements"] += self.statements - statements
+            if rows:
+                entry["rows"] += rows
+
+    def iter_stage(self, name, chunks):
+        """Yield from `chunks` (e.g. CSV DataFrames), timing each fetch as stage `name`."""
+        it = iter(chunks)
+        while True:
+            with self.stage(name) as entry:
+                try:
+                    chunk = next(it)
+                except StopIteration:
+                    entry["calls"] -= 1
+                    return
+                entry["rows"] += len(chunk)
+            yield chunk
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def watch_engine(self, engine):
+        """Count every statement a SQLAlchemy engine sends (executemany counts once)."""
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before_execute(conn, cursor, statement, parameters, context, executemany):
+            self.statements += 1
+            if executemany:
+                self.count("db_executemany_rows", len(parameters))
+
+    def watch_sqlite(self, con):
+        """Count statements run on a raw sqlite3 connection."""
+        def _trace(sql):
+            self.statements += 1
+        con.set_trace_callback(_trace)
+
+    def snapshot(self):
+        return {
+            "wall_seconds": self.wall_seconds,
+            "db_statements": self.statements,
+            "peak_memory_mb": peak_memory_mb(),
+            "stages": {name: dict(entry, seconds=round(entry["seconds"], 6))
+                       for name, entry in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def to_prometheus(self):
+        snap = self.snapshot()
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+                lines.append(f"{PREFIX}_{name}{label_text} {value}")
+
+        stages = snap["stages"].items()
+        metric("stage_seconds", "gauge", [({"stage": s}, e["seconds"]) for s, e in stages])
+        metric("stage_calls", "gauge", [({"stage": s}, e["calls"]) for s, e in stages])
+        metric("stage_rows", "gauge", [({"stage": s}, e["rows"]) for s, e in stages])
+        metric("stage_db_statements", "gauge", [({"stage": s}, e["statements"]) for s, e in stages])
+        metric("db_statements_total", "counter", [({}, snap["db_statements"])])
+        for name, value in sorted(snap["counters"].items()):
+            metric(re.sub(r"[^a-zA-Z0-9_]", "_", name) + "_total", "counter", [({}, value)])
+        if snap["wall_seconds"] is not None:
+            metric("wall_seconds", "gauge", [({}, round(snap["wall_seconds"], 6))])
+        if snap["peak_memory_mb"] is not None:
+            metric("peak_memory_mb", "gauge", [({}, round(snap["peak_memory_mb"], 1))])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            if str(path).endswith(".json"):
+                json.dump(self.snapshot(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def profiling(path=None, cprofile_path=None, engines=()):
+    """
+    Collect metrics for the enclosed run and write them to `path` on exit; with
+    `cprofile_path` also run cProfile over it and dump the stats there (view with
+    `python -m pstats` or snakeviz). Statement counting is only attached when profiling.
+    """
+    if not path and not cprofile_path:
+        yield metrics
+        return
+    for engine in engines:
+        metrics.watch_engine(engine)
+    profiler = cProfile.Profile() if cprofile_path else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+            print(f"cProfile stats written to {cprofile_path}")
+        metrics.wall_seconds = time.perf_counter() - start
+        if path:
+            metrics.write(path)
+            print(f"Metrics written to {path}")
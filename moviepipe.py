@@ -0,0 +1,113 @@
+"""
+One command for the pipeline's entry points:
+
+    python moviepipe.py etl --incremental                 # etl.py
+    python moviepipe.py enrich --batch-size 200           # enrich_directors.py
+    python moviepipe.py report                            # list reports and their parameters
+    python moviepipe.py report top_movies_filtered genre=Comedy year_from=1990 limit=5
+    python moviepipe.py report top_genres --engine memory
+    python moviepipe.py check csv|data                    # check_csv.py / check_data.py
+    python moviepipe.py serve --port 8080                 # report_server.py
+    python moviepipe.py search query "star wa" --prefix   # search.py
+    python moviepipe.py trends trend genre --since 2000 --bucket year   # rollups.py
+
+Subcommands import their modules only when they run, so --help, check and plain report
+calls never load pandas, NumPy, requests or SQLAlchemy. report runs the SQL straight
+through sqlite3 and prints a text table (or --json); --engine memory and --cache go
+through reports.py and pandas.
+"""
+import sys
+import json
+import argparse
+from importlib import import_module
+from pathlib import Path
+from report_defs import REPORT_DEFS, parse_params, format_table
+
+# subcommand -> (module whose main(argv) gets the rest of the command line, help)
+DELEGATED = {
+    "etl": ("etl", "load movies.csv and ratings.csv into the database"),
+    "enrich": ("enrich_directors", "resumable OMDb director enrichment"),
+    "serve": ("report_server", "serve the reports as a JSON HTTP API"),
+    "search": ("search", "full-text movie search"),
+    "trends": ("rollups", "rating trends from the day/month/year rollups"),
+}
+CHECKS = {"csv": "check_csv", "data": "check_data"}
+
+
+def list_reports():
+    for name, defn in REPORT_DEFS.items():
+        params = " ".join(f"{k}={'' if v is None else v}" for k, v in defn.defaults.items())
+        print(f"{name:22s} {params}")
+
+
+def run_report(args, parser):
+    defn = REPORT_DEFS.get(args.name)
+    if defn is None:
+        parser.error(f"unknown report {args.name!r}; expected one of {', '.join(REPORT_DEFS)}")
+    pairs = [p.partition("=")[::2] for p in args.params]
+    bad = [p for p in args.params if "=" not in p]
+    if bad:
+        parser.error(f"parameters are key=value, got {bad[0]!r}")
+    try:
+        params = parse_params(defn, pairs)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.engine == "sqlite" and not args.cache:
+        from db import sqlite_connect, sqlite_path
+        path = args.db or sqlite_path()
+        if not Path(path).exists():
+            raise SystemExit(f"{path} not found; run python moviepipe.py etl first")
+        con = sqlite_connect(path)
+        try:
+            cur = con.execute(defn.sql, params)
+            columns, rows = [d[0] for d in cur.description], cur.fetchall()
+        finally:
+            con.close()
+        print(json.dumps({"columns": columns, "data": rows}) if args.json else format_table(columns, rows))
+        return
+
+    import reports
+    df = reports.run_report(args.name, args.engine, args.db, cache=args.cache, **params)
+    print(df.to_json(orient="split", index=False) if args.json else df.to_string(index=False))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="moviepipe", description="Movie data pipeline")
+    sub = parser.add_subparsers(dest="command", required=True, metavar="command")
+    # delegated subcommands take no arguments here: everything after them is passed on
+    for name, (_, text) in DELEGATED.items():
+        sub.add_parser(name, help=f"{text} (python moviepipe.py {name} --help)", add_help=False)
+
+    p = sub.add_parser("report", help="run a report; without a name, list them")
+    p.add_argument("name", nargs="?")
+    p.add_argument("params", nargs="*", metavar="key=value", help="override report parameters")
+    p.add_argument("--engine", choices=("sqlite", "memory"), default="sqlite")
+    p.add_argument("--cache", action="store_true", help="use the on-disk result cache (loads pandas)")
+    p.add_argument("--db", help="SQLite file (default: the DB_URL database)")
+    p.add_argument("--json", action="store_true", help='print {"columns": [...], "data": [[...], ...]}')
+
+    p = sub.add_parser("check", help="sanity checks: csv (input files) or data (table row counts)")
+    p.add_argument("what", choices=sorted(CHECKS))
+    # everything after the check's name, --help included, goes to check_csv / check_data
+    p.add_argument("check_args", nargs=argparse.REMAINDER, metavar="options", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.command in DELEGATED:
+        import_module(DELEGATED[args.command][0]).main(rest)
+    elif args.command == "check":
+        import_module(CHECKS[args.what]).main(args.check_args + rest)
+    elif rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    elif args.name is None:
+        list_reports()
+    else:
+        run_report(args, parser)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
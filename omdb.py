@@ -0,0 +1,207 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from omdb_cache import utc_day
+
+OMDB_URL = os.environ.get("OMDB_URL", "http://www.omdbapi.com/")
+OMDB_RPS = float(os.environ.get("OMDB_RPS", "10"))
+OMDB_DAILY_QUOTA = int(os.environ.get("OMDB_DAILY_QUOTA", "100000"))
+OMDB_CONCURRENCY = 8
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class OmdbError(Exception):
+    pass
+
+
+class QuotaExceeded(OmdbError):
+    pass
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `rate` tokens are added per second up to `capacity`.
+    acquire() blocks until a token is available; try_acquire() never blocks.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DailyUsage:
+    """
+    In-process daily request count, for clients built without a persistent store.
+    omdb_cache.OmdbCache implements the same count_request() against its SQLite file,
+    so the quota holds across runs and between processes sharing the cache.
+    """
+
+    def __init__(self):
+        self.day = None
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def count_request(self, limit):
+        """Count one request against today's usage; False (nothing counted) once `limit` is reached."""
+        with self.lock:
+            day = utc_day()
+            if day != self.day:
+                self.day, self.requests = day, 0
+            if self.requests >= limit:
+                return False
+            self.requests += 1
+            return True
+
+
+def normalize_year(year):
+    """Years come in as int, float (pandas NULL-able columns), str or NaN."""
+    if year is None:
+        return None
+    try:
+        if year != year:
+            return None
+        return int(float(year))
+    except (TypeError, ValueError):
+        return None
+
+
+class OmdbClient:
+    """
+    OMDb lookups over pooled keep-alive sessions (one per worker thread), limited by a
+    global requests-per-second bucket and a daily quota. Pass the OmdbCache as `usage` to
+    count the quota per UTC day in the cache file, so it holds across runs; without one it
+    is only counted in this process. 429 and 5xx responses and 200s without a JSON body
+    are retried with exponential backoff.
+    """
+
+    def __init__(self, api_key, base_url=OMDB_URL, rps=OMDB_RPS, daily_quota=OMDB_DAILY_QUOTA,
+                 concurrency=OMDB_CONCURRENCY, max_retries=MAX_RETRIES, timeout=10, usage=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_bucket = TokenBucket(rps)
+        self.daily_quota = daily_quota
+        self.usage = usage if usage is not None else DailyUsage()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.requests_made = 0
+        self.retries = 0
+
+    def _session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.local.session = session
+        return session
+
+    def get(self, title, year=None):
+        """
+        One OMDb request (plus retries). Returns the JSON dict, or None when OMDb
+        answers Response=False. Raises OmdbError when the request keeps failing.
+        """
+        params = {"apikey": self.api_key, "t": title}
+        year = normalize_year(year)
+        if year is not None:
+            params["y"] = str(year)
+        for attempt in range(self.max_retries + 1):
+            if not self.usage.count_request(self.daily_quota):
+                raise QuotaExceeded(f"OMDb daily quota of {self.daily_quota} requests exhausted")
+            self.rate_bucket.acquire()
+            with self.lock:
+                self.requests_made += 1
+            delay = BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+            try:
+                r = self._session().get(self.base_url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if r.status_code == 200:
+                    try:
+                        j = r.json()
+                    except ValueError:
+                        j = None
+                    if isinstance(j, dict):
+                        if j.get("Response") == "False":
+                            return None
+                        return j
+                    # an HTML error page or truncated body from a proxy; worth another try
+                    error = "HTTP 200 without a JSON object"
+                elif r.status_code not in RETRY_STATUS:
+                    raise OmdbError(f"HTTP {r.status_code}")
+                else:
+                    error = f"HTTP {r.status_code}"
+                    retry_after = r.headers.get("Retry-After")
+                    if retry_after and retry_after.isdigit():
+                        delay = max(delay, float(retry_after))
+            if attempt < self.max_retries:
+                with self.lock:
+                    self.retries += 1
+                time.sleep(delay)
+        raise OmdbError(f"{title}: {error} after {self.max_retries + 1} attempts")
+
+    def lookup(self, title, year=None):
+        """Exact title+year lookup, falling back to title only when the year misses."""
+        data = self.get(title, year)
+        if data is None and normalize_year(year) is not None:
+            data = self.get(title, None)
+        return data
+
+    def lookup_many(self, queries, lookup=None):
+        """
+        Look up (title, year) pairs concurrently with lookup(title, year) (default: self.lookup).
+        Yields (query, data, error) as each lookup completes; data is None for not-found,
+        error is None on success.
+        """
+        queries = list(dict.fromkeys(queries))
+        lookup = lookup or self.lookup
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(lookup, title, year): (title, year) for title, year in queries}
+            for fut in as_completed(futures):
+                query = futures[fut]
+                try:
+                    yield query, fut.result(), None
+                except CancelledError:
+                    continue
+                except QuotaExceeded as e:
+                    for other in futures:
+                        other.cancel()
+                    yield query, None, e
+                except OmdbError as e:
+                    yield query, None, e
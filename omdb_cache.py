@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+OMDB_CACHE_DB = os.environ.get("OMDB_CACHE_DB", "omdb_cache.db")
+LEGACY_JSON_CACHE = Path("omdb_cache.json")
+POSITIVE_TTL = 90 * 86400
+NEGATIVE_TTL = 7 * 86400
+MAX_ENTRIES = 500000
+EVICT_CHECK_EVERY = 1000
+
+
+def utc_day():
+    """Today's date in UTC, the key the OMDb daily quota is counted under."""
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def cache_key(title, year):
+    """Normalized `title|||year` key: whitespace collapsed, case-folded."""
+    title = " ".join(str(title).split()).casefold()
+    return f"{title}|||{year}"
+
+
+class OmdbCache:
+    """
+    Persistent OMDb response cache in a small SQLite file. Every put() is committed
+    immediately, so a crash only loses the lookup in flight. Not-found answers are cached
+    with a shorter TTL than hits, and the least recently used entries are evicted once the
+    cache grows past max_entries.
+    """
+
+    def __init__(self, path=OMDB_CACHE_DB, positive_ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL,
+                 max_entries=MAX_ENTRIES):
+        self.path = str(path)
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS omdb_cache (
+                key TEXT PRIMARY KEY,
+                payload TEXT,
+                found INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self.con.execute("CREATE INDEX IF NOT EXISTS ix_omdb_cache_accessed ON omdb_cache (accessed_at)")
+        self.con.execute("CREATE TABLE IF NOT EXISTS omdb_cache_meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.con.execute("CREATE TABLE IF NOT EXISTS omdb_usage (day TEXT PRIMARY KEY, requests INTEGER NOT NULL)")
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._puts = 0
+
+    def get(self, title, year):
+        """Returns (hit, data). data is None for a cached not-found answer."""
+        key = cache_key(title, year)
+        now = time.time()
+        with self.lock:
+            row = self.con.execute("SELECT payload, found, fetched_at FROM omdb_cache WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            payload, found, fetched_at = row
+            ttl = self.positive_ttl if found else self.negative_ttl
+            if now - fetched_at > ttl:
+                self.expired += 1
+                self.misses += 1
+                return False, None
+            self.con.execute("UPDATE omdb_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return True, (json.loads(payload) if found else None)
+
+    def load(self, key):
+        """Payload of an unexpired hit by cache key (None otherwise); hit/miss counters untouched."""
+        with self.lock:
+            row = self.con.execute("SELECT payload FROM omdb_cache WHERE key = ? AND found = 1 AND fetched_at >= ?",
+                                   (key, time.time() - self.positive_ttl)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def resolved(self):
+        """(key, OMDb Title, OMDb Year) of every unexpired hit, for title_match.TitleIndex."""
+        with self.lock:
+            return self.con.execute(
+                "SELECT key, json_extract(payload, '$.Title'), json_extract(payload, '$.Year') "
+                "FROM omdb_cache WHERE found = 1 AND fetched_at >= ?",
+                (time.time() - self.positive_ttl,)).fetchall()
+
+    def put(self, title, year, data, fetched_at=None):
+        now = time.time()
+        fetched_at = now if fetched_at is None else fetched_at
+        with self.lock:
+            self.con.execute(
+                "INSERT OR REPLACE INTO omdb_cache (key, payload, found, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (cache_key(title, year), json.dumps(data) if data is not None else None,
+                 int(data is not None), fetched_at, now))
+            self._puts += 1
+            if self._puts % EVICT_CHECK_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        count = self.con.execute("SELECT COUNT(*) FROM omdb_cache").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.con.execute("DELETE FROM omdb_cache WHERE key IN "
+                             "(SELECT key FROM omdb_cache ORDER BY accessed_at LIMIT ?)", (excess,))
+            self.evicted += excess
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def count_request(self, limit):
+        """
+        Count one OMDb request against today's (UTC) usage unless `limit` is already
+        reached; returns whether it was counted. One conditional upsert, so processes
+        sharing the file cannot overrun the quota between them.
+        """
+        if limit <= 0:
+            return False
+        with self.lock:
+            cur = self.con.execute(
+                "INSERT INTO omdb_usage (day, requests) VALUES (?, 1) "
+                "ON CONFLICT(day) DO UPDATE SET requests = requests + 1 WHERE requests < ?",
+                (utc_day(), limit))
+        return cur.rowcount == 1
+
+    def __len__(self):
+        with self.lock:
+            return self.con.execute("SELECT COUNT(*) FROM omdb_cache").fetchone()[0]
+
+    def import_json(self, path=LEGACY_JSON_CACHE):
+        """
+        One-time import of the old omdb_cache.json ({"title|||year": data-or-null}).
+        Returns the number of entries imported; 0 if the file is missing or already imported.
+        """
+        path = Path(path)
+        marker = f"imported:{path.resolve()}"
+        if not path.exists():
+            return 0
+        with self.lock:
+            if self.con.execute("SELECT 1 FROM omdb_cache_meta WHERE name = ?", (marker,)).fetchone():
+                return 0
+        legacy = json.loads(path.read_text(encoding="utf-8"))
+        rows = []
+        now = time.time()
+        for key, data in legacy.items():
+            title, _, year = key.partition("|||")
+            year = None if year in ("", "None") else year
+            rows.append((cache_key(title, year), json.dumps(data) if data is not None else None,
+                         int(data is not None), now, now))
+        with self.lock:
+            self.con.execute("BEGIN")
+            self.con.executemany("INSERT OR IGNORE INTO omdb_cache (key, payload, found, fetched_at, accessed_at) "
+                                 "VALUES (?, ?, ?, ?, ?)", rows)
+            self.con.execute("INSERT INTO omdb_cache_meta (name, value) VALUES (?, ?)", (marker, str(now)))
+            self.con.execute("COMMIT")
+            self._evict()
+        return len(rows)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+
+def open_cache(path=OMDB_CACHE_DB, legacy_json=LEGACY_JSON_CACHE):
+    """Open the shared cache, importing the legacy JSON cache on first use."""
+    cache = OmdbCache(path)
+    imported = cache.import_json(legacy_json)
+    if imported:
+        print(f"Imported {imported} entries from {legacy_json} into {path}")
+    return cache
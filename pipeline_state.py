@@ -0,0 +1,145 @@
+import os
+import time
+import uuid
+import hashlib
+import pandas as pd
+from sqlalchemy import Table, Column, Integer, String, Text, Float, MetaData, select
+
+TAIL_WINDOW = 64 * 1024
+
+state_metadata = MetaData()
+
+pipeline_state = Table('pipeline_state', state_metadata,
+    Column('source', String, primary_key=True),
+    Column('path', Text),
+    Column('size', Integer),
+    Column('byte_offset', Integer),
+    Column('tail_checksum', String),
+    Column('file_checksum', String),
+    Column('watermark', Integer),
+    Column('updated_at', Float),
+)
+
+movie_fingerprints = Table('movie_fingerprints', state_metadata,
+    Column('movie_id', Integer, primary_key=True),
+    Column('fingerprint', String, nullable=False),
+)
+
+# Bumped by every load that changes movies, ratings or their links; the report result cache
+# keys on it. The epoch is random per database, so a rebuilt movies.db never reuses a version.
+data_version = Table('data_version', state_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('epoch', String, nullable=False),
+    Column('counter', Integer, nullable=False),
+    Column('updated_at', Float),
+)
+
+def ensure_state_schema(engine):
+    state_metadata.create_all(engine)
+
+def get_data_version(conn):
+    """(epoch, counter) of the loaded data, or None if no versioned load has run yet."""
+    row = conn.execute(select(data_version.c.epoch, data_version.c.counter)
+                       .where(data_version.c.id == 1)).fetchone()
+    return tuple(row) if row else None
+
+def bump_data_version(conn):
+    """Mark the data as changed, invalidating cached report results. Returns the new version."""
+    data_version.create(conn, checkfirst=True)
+    current = get_data_version(conn)
+    if current:
+        version = (current[0], current[1] + 1)
+        conn.execute(data_version.update().where(data_version.c.id == 1)
+                     .values(counter=version[1], updated_at=time.time()))
+    else:
+        version = (uuid.uuid4().hex, 1)
+        conn.execute(data_version.insert().values(id=1, epoch=version[0], counter=version[1],
+                                                  updated_at=time.time()))
+    return version
+
+def get_state(conn, source):
+    row = conn.execute(select(pipeline_state).where(pipeline_state.c.source == source)).mappings().fetchone()
+    return dict(row) if row else None
+
+def save_state(conn, source, **values):
+    values['updated_at'] = time.time()
+    if get_state(conn, source):
+        conn.execute(pipeline_state.update().where(pipeline_state.c.source == source).values(**values))
+    else:
+        conn.execute(pipeline_state.insert().values(source=source, **values))
+
+def file_checksum(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def tail_checksum(path, offset, window=TAIL_WINDOW):
+    """Checksum of the `window` bytes ending at `offset` - cheap proof the loaded prefix is untouched."""
+    start = max(0, offset - window)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+def complete_end(path, size):
+    """Offset just past the last newline, so a partially written trailing line is left for later."""
+    with open(path, 'rb') as f:
+        pos = size
+        while pos > 0:
+            step = min(TAIL_WINDOW, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            i = chunk.rfind(b'\n')
+            if i != -1:
+                return pos - step + i + 1
+            pos -= step
+    return 0
+
+def plan_ratings_load(path, state):
+    """
+    Decide how much of the ratings CSV a run must read, given the saved state (None for a
+    full run). Returns a dict with mode 'unchanged', 'append' or 'full', the byte range
+    [start, end) to read and the watermark to filter on. When the previously loaded prefix
+    is intact only the appended bytes are read; if the file was rewritten the whole file is
+    read but only rows newer than the timestamp watermark are loaded.
+    """
+    size = os.path.getsize(path)
+    end = complete_end(path, size)
+    if state and state.get('byte_offset') and state['byte_offset'] <= size \
+            and tail_checksum(path, state['byte_offset']) == state['tail_checksum']:
+        if state['byte_offset'] >= end:
+            return {'mode': 'unchanged', 'start': state['byte_offset'], 'end': state['byte_offset'],
+                    'watermark': None}
+        return {'mode': 'append', 'start': state['byte_offset'], 'end': end, 'watermark': None}
+    watermark = state.get('watermark') if state else None
+    return {'mode': 'full', 'start': 0, 'end': end, 'watermark': watermark}
+
+def movie_fingerprint(title, year, genres_raw):
+    genres_raw = '' if genres_raw is None or pd.isna(genres_raw) else str(genres_raw)
+    return hashlib.sha1(f"{title}\x1f{year}\x1f{genres_raw}".encode('utf-8')).hexdigest()
+
+def changed_movies(conn, parsed):
+    """
+    parsed: list of (movie_id, title, year, genres_raw). Returns (changed, fingerprints):
+    the entries whose parsed title/year/genres differ from the last load, and the
+    {movie_id: fingerprint} map to store once they are loaded.
+    """
+    known = dict(conn.execute(select(movie_fingerprints.c.movie_id, movie_fingerprints.c.fingerprint)).fetchall())
+    changed = []
+    fingerprints = {}
+    for item in parsed:
+        mid, title, year, genres_raw = item
+        fp = movie_fingerprint(title, year, genres_raw)
+        if known.get(mid) != fp:
+            changed.append(item)
+            fingerprints[mid] = fp
+    return changed, fingerprints
+
+def save_fingerprints(conn, fingerprints):
+    if not fingerprints:
+        return
+    ids = list(fingerprints)
+    for i in range(0, len(ids), 500):
+        conn.execute(movie_fingerprints.delete().where(movie_fingerprints.c.movie_id.in_(ids[i:i + 500])))
+    conn.execute(movie_fingerprints.insert(), [{'movie_id': mid, 'fingerprint': fp} for mid, fp in fingerprints.items()])
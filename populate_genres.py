@@ -1,6 +1,13 @@
-import sqlite3, pandas as pd
+import pandas as pd
+from db import get_engine, sqlite_connect
+from transform import explode_genres, factorize_genres
+from aggregates import ensure_aggregate_schema, ensure_populated, refresh_derived
+from pipeline_state import bump_data_version
+from ranking import refresh as refresh_rankings
+from rollups import sync_links as sync_rollup_links
+from search import rebuild_search
 
-con = sqlite3.connect("movies.db")
+con = sqlite_connect()
 cur = con.cursor()
 
 cur.execute("CREATE TABLE IF NOT EXISTS genres (genre_id INTEGER PRIMARY KEY AUTOINCREMENT, genre_name TEXT UNIQUE)")
@@ -8,18 +15,24 @@ cur.execute("CREATE TABLE IF NOT EXISTS movie_genres (id INTEGER PRIMARY KEY AUT
 
 movies = pd.read_csv("movies.csv")
 
-inserted_links = 0
-for _, row in movies.iterrows():
-    mid = row["movieId"]
-    genres = str(row["genres"]).split("|") if pd.notna(row["genres"]) else []
-    for g in genres:
-        if g and g != "(no genres listed)":
-            cur.execute("INSERT OR IGNORE INTO genres (genre_name) VALUES (?)", (g,))
-            cur.execute("SELECT genre_id FROM genres WHERE genre_name=?", (g,))
-            gid = cur.fetchone()[0]
-            cur.execute("INSERT OR IGNORE INTO movie_genres (movie_id, genre_id) VALUES (?, ?)", (mid, gid))
-            inserted_links += 1
+links, names = factorize_genres(explode_genres(movies))
+cur.executemany("INSERT OR IGNORE INTO genres (genre_name) VALUES (?)", [(g,) for g in names])
+ids = dict(cur.execute("SELECT genre_name, genre_id FROM genres").fetchall())
+code_to_id = [ids[g] for g in names]
+cur.executemany("INSERT OR IGNORE INTO movie_genres (movie_id, genre_id) VALUES (?, ?)",
+                [(mid, code_to_id[code]) for mid, code in zip(links["movie_id"].tolist(), links["genre_code"].tolist())])
+inserted_links = len(links)
 
 con.commit()
 con.close()
-print(f"Done! Populated genres and movie_genres. Inserted links: {inserted_links}")
\ No newline at end of file
+
+engine = get_engine()
+ensure_aggregate_schema(engine)
+with engine.begin() as conn:
+    ensure_populated(conn)
+    refresh_derived(conn)
+    sync_rollup_links(conn)
+    refresh_rankings(conn, full=True, boards=("genres",))
+    rebuild_search(conn)
+    bump_data_version(conn)
+print(f"Done! Populated genres and movie_genres. Inserted links: {inserted_links}")
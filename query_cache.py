@@ -0,0 +1,173 @@
+"""
+On-disk cache of report results. Entries are keyed on the normalized SQL text, its
+parameters and the data version of movies.db (pipeline_state.data_version), which every
+load that changes movies, ratings or their links bumps. A bumped version never matches an
+old key, and the first result stored under it deletes the entries of older versions of
+the same database. The file is capped in bytes and the least recently used entries are
+evicted past the cap.
+
+    python query_cache.py            # entries, size and versions
+    python query_cache.py --clear
+"""
+import os
+import re
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+QUERY_CACHE_DB = os.environ.get("QUERY_CACHE_DB", "query_cache.db")
+MAX_BYTES = int(float(os.environ.get("QUERY_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+# string literals and quoted identifiers are kept as written; everything else is whitespace-folded
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+
+def normalize_sql(sql):
+    """SQL with runs of whitespace collapsed outside quotes and any trailing ';' removed."""
+    parts = _QUOTED.split(sql.strip().rstrip(";").strip())
+    return "".join(part if i % 2 else " ".join(part.split()) for i, part in enumerate(parts))
+
+
+def cache_key(sql, params, version):
+    epoch, counter = version
+    text = json.dumps([normalize_sql(sql), params or {}, epoch, counter], sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def read_data_version(con):
+    """Data version of a raw sqlite3 connection to movies.db, or None if it has none yet."""
+    try:
+        row = con.execute("SELECT epoch, counter FROM data_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:  # table not created yet
+        return None
+    return tuple(row) if row else None
+
+
+class QueryCache:
+    """
+    Pickled DataFrames in a small SQLite file, committed on every put. get() returns None
+    on a miss; results of a database with no data version are never cached.
+    """
+
+    def __init__(self, path=QUERY_CACHE_DB, max_bytes=MAX_BYTES):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS query_cache (
+                key TEXT PRIMARY KEY,
+                epoch TEXT NOT NULL,
+                counter INTEGER NOT NULL,
+                sql TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self.con.execute("CREATE INDEX IF NOT EXISTS ix_query_cache_accessed ON query_cache (accessed_at)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS ix_query_cache_version ON query_cache (epoch, counter)")
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+    def get(self, sql, params, version):
+        if version is None:
+            return None
+        key = cache_key(sql, params, version)
+        with self.lock:
+            row = self.con.execute("SELECT payload FROM query_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.con.execute("UPDATE query_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, sql, params, version, df):
+        if version is None:
+            return
+        payload = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+        epoch, counter = version
+        now = time.time()
+        with self.lock:
+            self.con.execute("BEGIN")
+            self.invalidated += self.con.execute(
+                "DELETE FROM query_cache WHERE epoch = ? AND counter < ?", (epoch, counter)).rowcount
+            self.con.execute(
+                "INSERT OR REPLACE INTO query_cache "
+                "(key, epoch, counter, sql, payload, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (cache_key(sql, params, version), epoch, counter, normalize_sql(sql), payload,
+                 len(payload), now, now))
+            self._evict()
+            self.con.execute("COMMIT")
+
+    def _evict(self):
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+        # walk from the least recently used entry until enough bytes are covered
+        doomed = []
+        for key, size in self.con.execute("SELECT key, size FROM query_cache ORDER BY accessed_at"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.con.executemany("DELETE FROM query_cache WHERE key = ?", doomed)
+        self.evicted += len(doomed)
+
+    def size(self):
+        return self.con.execute("SELECT COALESCE(SUM(size), 0) FROM query_cache").fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            self.con.execute("DELETE FROM query_cache")
+
+    def __len__(self):
+        with self.lock:
+            return self.con.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "evicted": self.evicted,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the report result cache")
+    parser.add_argument("--path", default=QUERY_CACHE_DB)
+    parser.add_argument("--clear", action="store_true", help="delete every cached result")
+    args = parser.parse_args()
+    cache = QueryCache(args.path)
+    if args.clear:
+        cache.clear()
+    with cache.lock:
+        rows = cache.con.execute("SELECT epoch, counter, COUNT(*), SUM(size) FROM query_cache "
+                                 "GROUP BY epoch, counter ORDER BY MAX(accessed_at) DESC").fetchall()
+    print(f"{args.path}: {len(cache)} entries, {cache.size() / 1024:.1f} KiB of {cache.max_bytes / 1024**2:.0f} MiB")
+    for epoch, counter, count, size in rows:
+        print(f"  version {epoch[:8]}.{counter}: {count} entries, {size / 1024:.1f} KiB")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Bayesian-weighted leaderboards for movies, genres and directors, plus time-window rankings.
+
+A score shrinks an item's average toward the board's global mean:
+
+    score = (prior_weight * global_mean + rating_sum) / (prior_weight + rating_count)
+
+so a movie with three 5-star ratings no longer outranks one with thousands of 4.5s, and no
+count cutoff is needed. prior_weight defaults to the mean rating count per item
+(RANKING_PRIOR_WEIGHT or --prior-weight fixes it).
+
+Each board keeps a pool of its best POOL_FACTOR * k items in leaderboard_entries, scored
+with the mean and weight fixed at its last full build. Every item outside the pool scores
+at most the pool's floor, so after a load only the items whose ratings changed (logged in
+movie_stats_changes by aggregates.apply_staged_deltas) are re-scored and merged in. A board
+is rebuilt in full when the global mean has drifted by more than MEAN_TOLERANCE, when too
+many items changed, or when fewer than k items stay above the floor.
+
+    python ranking.py show movies --k 10
+    python ranking.py window movies --days 30
+    python ranking.py refresh --full --prior-weight 25
+"""
+import os
+import time
+import heapq
+import argparse
+import pandas as pd
+from sqlalchemy import Table, Column, Integer, Float, String, MetaData, text
+from aggregates import movie_stats_changes
+from db import db_url, get_engine
+
+K = 10
+PRIOR_WEIGHT = float(os.environ["RANKING_PRIOR_WEIGHT"]) if os.environ.get("RANKING_PRIOR_WEIGHT") else None
+POOL_FACTOR = 4
+MEAN_TOLERANCE = 0.01
+# re-scoring more than this fraction of a board's items is done as a full rebuild
+INCREMENTAL_FRACTION = 0.1
+
+ranking_metadata = MetaData()
+
+leaderboards = Table('leaderboards', ranking_metadata,
+    Column('board', String, primary_key=True),
+    Column('global_mean', Float, nullable=False),
+    Column('prior_weight', Float, nullable=False),
+    Column('floor', Float),
+    Column('pool_size', Integer, nullable=False),
+    Column('built_at', Float),
+    Column('refreshed_at', Float),
+)
+
+leaderboard_entries = Table('leaderboard_entries', ranking_metadata,
+    Column('board', String, primary_key=True),
+    Column('item_id', Integer, primary_key=True),
+    Column('score', Float, nullable=False),
+    Column('rating_count', Integer, nullable=False),
+    Column('avg_rating', Float, nullable=False),
+)
+
+# board -> (stats table, id column, name table, name column, movie link table)
+BOARDS = {
+    'movies': ('movie_rating_stats', 'movie_id', 'movies', 'title', None),
+    'genres': ('genre_rating_stats', 'genre_id', 'genres', 'genre_name', 'movie_genres'),
+    'directors': ('director_rating_stats', 'director_id', 'directors', 'director_name', 'movie_directors'),
+}
+
+
+def ensure_ranking_schema(bind):
+    movie_stats_changes.create(bind, checkfirst=True)
+    ranking_metadata.create_all(bind)
+
+
+def bayes_score(rating_sum, rating_count, global_mean, prior_weight):
+    return (prior_weight * global_mean + rating_sum) / (prior_weight + rating_count)
+
+
+def board_prior(conn, board, prior_weight=None):
+    """(global mean, prior weight) of a board's current stats; None if it has no ratings."""
+    stats, _, _, _, _ = BOARDS[board]
+    total, count, items = conn.execute(text(
+        f"SELECT SUM(rating_sum), SUM(rating_count), COUNT(*) FROM {stats} WHERE rating_count > 0")).fetchone()
+    if not count:
+        return None
+    return total / count, (prior_weight if prior_weight is not None else count / items)
+
+
+def _scored(rows, mean, weight):
+    """(score, -item_id, item_id, count, avg) tuples: the heap order ranks ties by id."""
+    return [(bayes_score(s, n, mean, weight), -item, item, n, s / n) for item, s, n in rows if n]
+
+
+def _write_pool(conn, board, pool, meta):
+    conn.execute(leaderboard_entries.delete().where(leaderboard_entries.c.board == board))
+    if pool:
+        conn.execute(leaderboard_entries.insert(), [
+            {'board': board, 'item_id': item, 'score': score, 'rating_count': n, 'avg_rating': avg}
+            for score, _, item, n, avg in pool])
+    conn.execute(leaderboards.delete().where(leaderboards.c.board == board))
+    conn.execute(leaderboards.insert().values(board=board, refreshed_at=time.time(), **meta))
+
+
+def rebuild_board(conn, board, k=K, prior_weight=PRIOR_WEIGHT):
+    """Score every item of a board and keep the best POOL_FACTOR * k."""
+    stats, key, _, _, _ = BOARDS[board]
+    prior = board_prior(conn, board, prior_weight)
+    pool_size = POOL_FACTOR * k
+    if prior is None:
+        pool, prior = [], (0.0, prior_weight or 0.0)
+    else:
+        mean, weight = prior
+        rows = conn.execute(text(f"""
+            SELECT {key}, rating_sum, rating_count FROM {stats} WHERE rating_count > 0
+            ORDER BY (:w * :m + rating_sum) / (:w + rating_count) DESC, {key}
+            LIMIT :pool"""), {'w': weight, 'm': mean, 'pool': pool_size}).fetchall()
+        pool = _scored(rows, mean, weight)
+    now = time.time()
+    _write_pool(conn, board, pool, {
+        'global_mean': prior[0], 'prior_weight': prior[1], 'pool_size': pool_size, 'built_at': now,
+        # with fewer items than the pool holds, every item is in it
+        'floor': pool[-1][0] if len(pool) == pool_size else None,
+    })
+    return len(pool)
+
+
+def changed_items(conn, board):
+    """Ids of a board's items touched by the logged movie changes."""
+    _, key, _, _, link = BOARDS[board]
+    if link is None:
+        sql = "SELECT movie_id FROM movie_stats_changes"
+    else:
+        sql = f"SELECT DISTINCT {key} FROM {link} WHERE movie_id IN (SELECT movie_id FROM movie_stats_changes)"
+    return [row[0] for row in conn.execute(text(sql))]
+
+
+def update_board(conn, board, meta, ids, k=K):
+    """
+    Re-score `ids` with the board's stored prior and merge them into its pool. Returns
+    False (nothing written) when the pool cannot guarantee an exact top k any more.
+    """
+    stats, key, _, _, _ = BOARDS[board]
+    mean, weight, floor, pool_size = meta['global_mean'], meta['prior_weight'], meta['floor'], meta['pool_size']
+    if pool_size < k:
+        return False
+    changed = set(ids)
+    rows = []
+    id_list = list(changed)
+    for i in range(0, len(id_list), 500):
+        chunk = id_list[i:i + 500]
+        rows += conn.execute(text(f"SELECT {key}, rating_sum, rating_count FROM {stats} WHERE {key} IN "
+                                  f"({', '.join(str(int(x)) for x in chunk)})")).fetchall()
+    current = conn.execute(text(
+        "SELECT item_id, score, rating_count, avg_rating FROM leaderboard_entries WHERE board = :b"),
+        {'b': board}).fetchall()
+    candidates = [(score, -item, item, n, avg) for item, score, n, avg in current if item not in changed]
+    candidates += _scored(rows, mean, weight)
+    if floor is not None:
+        # outside the pool nothing scores above the floor, so only entries at or above it are exact
+        candidates = [c for c in candidates if c[0] >= floor]
+        if len(candidates) < k:
+            return False
+    pool = heapq.nlargest(pool_size, candidates)
+    if len(candidates) > pool_size:
+        floor = pool[-1][0]
+    _write_pool(conn, board, pool, {
+        'global_mean': mean, 'prior_weight': weight, 'pool_size': pool_size,
+        'built_at': meta['built_at'], 'floor': floor,
+    })
+    return True
+
+
+def refresh(conn, full=False, boards=tuple(BOARDS), k=K, prior_weight=PRIOR_WEIGHT):
+    """
+    Bring the leaderboards up to date after a load (incrementally where possible) and
+    clear the change log once every board has consumed it. Returns {board: mode}.
+    """
+    ensure_ranking_schema(conn)
+    done = {}
+    for board in boards:
+        meta = conn.execute(leaderboards.select().where(leaderboards.c.board == board)).mappings().fetchone()
+        done[board] = 'full'
+        if not full and meta is not None and meta['pool_size'] >= POOL_FACTOR * k \
+                and prior_weight in (None, meta['prior_weight']):
+            prior = board_prior(conn, board, prior_weight)
+            ids = changed_items(conn, board)
+            items = conn.execute(text(f"SELECT COUNT(*) FROM {BOARDS[board][0]}")).scalar()
+            if prior is not None and abs(prior[0] - meta['global_mean']) <= MEAN_TOLERANCE \
+                    and len(ids) <= max(INCREMENTAL_FRACTION * items, meta['pool_size']):
+                if not ids:
+                    done[board] = 'unchanged'
+                elif update_board(conn, board, dict(meta), ids, k):
+                    done[board] = 'incremental'
+        if done[board] == 'full':
+            rebuild_board(conn, board, k, prior_weight)
+    if set(boards) == set(BOARDS):
+        conn.execute(movie_stats_changes.delete())
+    return done
+
+
+def leaderboard(conn, board, k=K):
+    """Top k of a stored board (built on first use)."""
+    _, key, names, name_col, _ = BOARDS[board]
+    ensure_ranking_schema(conn)
+    meta = conn.execute(leaderboards.select().where(leaderboards.c.board == board)).mappings().fetchone()
+    if meta is None or meta['pool_size'] < k:
+        refresh(conn, boards=(board,), k=k)
+    return pd.read_sql_query(text(f"""
+        SELECT e.item_id AS {key}, n.{name_col}, ROUND(e.score, 3) AS score,
+               ROUND(e.avg_rating, 3) AS avg_rating, e.rating_count
+        FROM leaderboard_entries e JOIN {names} n ON n.{key} = e.item_id
+        WHERE e.board = :board
+        ORDER BY e.score DESC, e.item_id
+        LIMIT :k"""), conn, params={'board': board, 'k': k})
+
+
+def window_leaderboard(conn, board, days, k=K, until=None, prior_weight=None):
+    """
+    Bayesian top k over the ratings with timestamp in (until - days, until]; until defaults
+    to the newest rating. Reads only the window through ix_ratings_timestamp, shrinking
+    toward the window's own mean (prior_weight: the window's mean count per item).
+    """
+    _, key, names, name_col, link = BOARDS[board]
+    if until is None:
+        until = conn.execute(text("SELECT MAX(timestamp) FROM ratings")).scalar() or 0
+    source = ("SELECT movie_id AS item_id, rating FROM ratings WHERE timestamp > :since AND timestamp <= :until"
+              if link is None else
+              f"SELECT l.{key} AS item_id, r.rating FROM ratings r JOIN {link} l ON l.movie_id = r.movie_id "
+              "WHERE r.timestamp > :since AND r.timestamp <= :until")
+    return pd.read_sql_query(text(f"""
+        WITH w AS (SELECT item_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count
+                   FROM ({source}) GROUP BY item_id),
+             p AS (SELECT SUM(rating_sum) * 1.0 / SUM(rating_count) AS mean,
+                          COALESCE(:weight, SUM(rating_count) * 1.0 / COUNT(*)) AS weight FROM w)
+        SELECT w.item_id AS {key}, n.{name_col},
+               ROUND((p.weight * p.mean + w.rating_sum) / (p.weight + w.rating_count), 3) AS score,
+               ROUND(w.rating_sum / w.rating_count, 3) AS avg_rating, w.rating_count
+        FROM w CROSS JOIN p JOIN {names} n ON n.{key} = w.item_id
+        ORDER BY (p.weight * p.mean + w.rating_sum) / (p.weight + w.rating_count) DESC, w.item_id
+        LIMIT :k"""), conn, params={'since': until - days * 86400, 'until': until, 'weight': prior_weight, 'k': k})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bayesian leaderboards and time-window rankings")
+    parser.add_argument("--db", help="SQLite file or database URL (default: DB_URL)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="print a stored leaderboard")
+    show.add_argument("board", choices=BOARDS)
+    show.add_argument("--k", type=int, default=K)
+    win = sub.add_parser("window", help="rank by the ratings of the last --days days")
+    win.add_argument("board", choices=BOARDS)
+    win.add_argument("--days", type=float, default=30)
+    win.add_argument("--until", type=int, help="window end as a Unix timestamp (default: newest rating)")
+    win.add_argument("--k", type=int, default=K)
+    win.add_argument("--prior-weight", type=float)
+    ref = sub.add_parser("refresh", help="update the stored leaderboards")
+    ref.add_argument("--full", action="store_true", help="rebuild instead of merging changed items")
+    ref.add_argument("--k", type=int, default=K)
+    ref.add_argument("--prior-weight", type=float, default=PRIOR_WEIGHT,
+                     help="default: mean rating count per item")
+    args = parser.parse_args()
+
+    engine = get_engine(db_url(args.db))
+    with engine.begin() as conn:
+        if args.command == "refresh":
+            start = time.perf_counter()
+            modes = refresh(conn, args.full, k=args.k, prior_weight=args.prior_weight)
+            print(f"Leaderboards refreshed in {time.perf_counter() - start:.3f}s: {modes}")
+            return
+        if args.command == "show":
+            df = leaderboard(conn, args.board, args.k)
+        else:
+            df = window_leaderboard(conn, args.board, args.days, args.k, args.until, args.prior_weight)
+    print(df.to_string(index=False) if not df.empty else "No rated items.")
+
+
+if __name__ == "__main__":
+    main()
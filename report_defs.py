@@ -0,0 +1,109 @@
+"""
+SQL and default parameters of every report, parameter parsing and plain-text output.
+Only the standard library is imported here, so moviepipe can run a report straight
+through sqlite3 without loading NumPy or pandas; reports.py attaches the memory-engine
+implementation of each one.
+"""
+from collections import namedtuple
+
+ReportDef = namedtuple("ReportDef", "name sql defaults")
+REPORT_DEFS = {}
+STR_PARAMS = {"genre"}
+
+
+def define(name, sql, **defaults):
+    """Register a report's SQL (with :named parameters) and its default parameters."""
+    REPORT_DEFS[name] = ReportDef(name, sql, defaults)
+
+
+def parse_params(defn, pairs):
+    """
+    The report's defaults overridden by (key, value) string pairs, e.g. from a query string
+    or key=value arguments. Integers are converted; ValueError names any bad parameter.
+    """
+    params = dict(defn.defaults)
+    for key, value in pairs:
+        if key not in defn.defaults:
+            raise ValueError(f"unknown parameter {key!r} for {defn.name}; expected one of {sorted(defn.defaults)}")
+        if key in STR_PARAMS:
+            params[key] = value or None
+            continue
+        try:
+            params[key] = int(value)
+        except ValueError:
+            raise ValueError(f"{key} must be an integer, got {value!r}") from None
+    return params
+
+
+def format_table(columns, rows):
+    """Plain-text table of a small result (like DataFrame.to_string(index=False), without pandas)."""
+    cells = [[str(c) for c in columns]] + [["NULL" if v is None else str(v) for v in row] for row in rows]
+    widths = [max(len(r[i]) for r in cells) for i in range(len(columns))]
+    return "\n".join(" ".join(v.rjust(w) for v, w in zip(r, widths)) for r in cells)
+
+
+define("top_movies", """
+    SELECT m.title, ROUND(s.avg_rating, :digits) AS avg_rating, s.rating_count AS cnt
+    FROM movie_rating_stats s
+    JOIN movies m ON m.movie_id = s.movie_id
+    WHERE s.rating_count >= :min_count
+    ORDER BY avg_rating DESC, cnt DESC, s.movie_id
+    LIMIT :limit""", min_count=10, digits=2, limit=10)
+
+define("top_movies_filtered", """
+    SELECT m.title, ROUND(s.avg_rating, :digits) AS avg_rating, s.rating_count AS cnt
+    FROM movie_rating_stats s
+    JOIN movies m ON m.movie_id = s.movie_id
+    WHERE s.rating_count >= :min_count
+      AND (:year_from IS NULL OR m.year >= :year_from)
+      AND (:year_to IS NULL OR m.year <= :year_to)
+      AND (:genre IS NULL OR s.movie_id IN (
+            SELECT mg.movie_id FROM movie_genres mg
+            JOIN genres g ON g.genre_id = mg.genre_id
+            WHERE g.genre_name = :genre))
+    ORDER BY avg_rating DESC, cnt DESC, s.movie_id
+    LIMIT :limit""", min_count=10, digits=2, limit=10, genre=None, year_from=None, year_to=None)
+
+define("top_genres", """
+    SELECT g.genre_name, ROUND(s.avg_rating, :digits) AS avg_rating, s.rating_count AS cnt
+    FROM genre_rating_stats s
+    JOIN genres g ON g.genre_id = s.genre_id
+    WHERE s.rating_count >= :min_count
+    ORDER BY avg_rating DESC, cnt DESC, s.genre_id
+    LIMIT :limit""", min_count=50, digits=3, limit=5)
+
+define("top_directors", """
+    SELECT d.director_name, ROUND(s.avg_rating, :digits) AS avg_rating, s.movie_count
+    FROM director_rating_stats s
+    JOIN directors d ON d.director_id = s.director_id
+    WHERE s.movie_count >= :min_movies
+    ORDER BY avg_rating DESC, s.movie_count DESC, s.director_id
+    LIMIT :limit""", min_movies=3, digits=2, limit=5)
+
+define("prolific_directors", """
+    SELECT d.director_name, COUNT(md.movie_id) AS movie_count
+    FROM directors d
+    JOIN movie_directors md ON d.director_id = md.director_id
+    GROUP BY d.director_id
+    ORDER BY movie_count DESC, d.director_id
+    LIMIT :limit""", limit=5)
+
+define("ratings_by_year", """
+    SELECT year, ROUND(avg_rating, :digits) AS avg_rating, rating_count AS cnt
+    FROM year_rating_stats
+    ORDER BY year""", digits=3)
+
+define("movies_per_year", """
+    SELECT year, COUNT(*) AS movie_count
+    FROM movies
+    WHERE year IS NOT NULL
+    GROUP BY year
+    ORDER BY year DESC
+    LIMIT :limit""", limit=10)
+
+define("top_users", """
+    SELECT user_id, rating_count AS ratings_count
+    FROM user_rating_stats
+    ORDER BY ratings_count DESC, user_id
+    LIMIT :limit""", limit=10)
+
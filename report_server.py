@@ -0,0 +1,251 @@
+"""
+Long-running JSON API over the report definitions (report_defs.py), so clients skip the
+per-script Python, pandas and connection startup of the one-shot report scripts.
+
+    python report_server.py --port 8080 --pool-size 4
+    curl 'http://127.0.0.1:8080/reports/top_movies_filtered?genre=Comedy&year_from=1990&limit=5'
+
+GET /reports lists every report with its parameters and defaults; GET /reports/<name> runs
+one with the defaults overridden by the query string (min_count, limit, genre, year_from,
+year_to, ...); GET /search?q=star+wa&prefix=1 runs a ranked full-text search (search.py;
+also phrase=1, fields=title,directors and limit); GET /trends/<movie|genre|director>?since=2000
+&until=2015&bucket=year answers a trend from the time rollups (rollups.py; also ids=1,2 and
+top); GET /health shows the pool state. Queries run on a fixed pool of read-only SQLite
+connections in WAL mode, so an ETL run can keep writing while the API serves. At most
+--pool-size queries run at once and up to --max-pending more wait for a connection; beyond
+that the server answers 503. Every report is one fixed SQL text with bound parameters, so
+each connection prepares it once and reuses it from its statement cache.
+"""
+import json
+import time
+import asyncio
+import argparse
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl, unquote
+from db import sqlite_connect, sqlite_path
+from db_profile import PRAGMAS
+from report_defs import REPORT_DEFS, parse_params
+from search import SEARCH_SQL, LIMIT as SEARCH_LIMIT, search_params
+from rollups import trend_query, TOP as TREND_TOP
+
+POOL_SIZE = 4
+MAX_PENDING = 64
+MAX_LIMIT = 1000
+STATEMENT_CACHE = 256
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def open_read_connection(path):
+    """Read-only connection with the read pragma profile (journal_mode is set once by ReadPool)."""
+    con = sqlite_connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False,
+                         cached_statements=STATEMENT_CACHE)
+    for name, value in PRAGMAS["read"].items():
+        if name != "journal_mode":
+            con.execute(f"PRAGMA {name} = {value}")
+    return con
+
+
+def fetch(con, sql, params):
+    cur = con.execute(sql, params)
+    try:
+        return [d[0] for d in cur.description], cur.fetchall()
+    finally:
+        cur.close()
+
+
+class ReadPool:
+    """
+    `size` read-only connections handed out through an asyncio queue; queries run on a
+    thread pool of the same size, so the event loop never blocks on SQLite.
+    """
+
+    def __init__(self, db=None, size=POOL_SIZE, max_pending=MAX_PENDING):
+        path = db or sqlite_path()
+        # WAL is a property of the file; switch once so readers never block the writer
+        with closing(sqlite_connect(path)) as con:
+            con.execute("PRAGMA journal_mode = WAL")
+        self.size = size
+        self.max_pending = max_pending
+        self.waiting = 0
+        self.idle = asyncio.Queue()
+        self.connections = [open_read_connection(path) for _ in range(size)]
+        for con in self.connections:
+            self.idle.put_nowait(con)
+        self.executor = ThreadPoolExecutor(size, thread_name_prefix="report-query")
+
+    async def run(self, sql, params):
+        """(columns, rows) of one query; HttpError(503) when too many requests are already queued."""
+        if self.waiting >= self.max_pending:
+            raise HttpError(503, "server busy, retry later")
+        self.waiting += 1
+        try:
+            con = await self.idle.get()
+        finally:
+            self.waiting -= 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fetch, con, sql, params)
+        finally:
+            self.idle.put_nowait(con)
+
+    def stats(self):
+        return {"pool_size": self.size, "busy": self.size - self.idle.qsize(), "waiting": self.waiting}
+
+    def close(self):
+        self.executor.shutdown()
+        for con in self.connections:
+            con.close()
+
+
+class ReportServer:
+    def __init__(self, pool):
+        self.pool = pool
+        self.served = 0
+
+    async def respond(self, method, target):
+        """(status, payload) for one request."""
+        if method != "GET":
+            raise HttpError(405, "only GET is supported")
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        if parts == ["health"]:
+            return 200, {"status": "ok", "served": self.served, **self.pool.stats()}
+        if parts == ["reports"]:
+            return 200, {name: {"params": rep.defaults} for name, rep in REPORT_DEFS.items()}
+        if len(parts) == 2 and parts[0] == "reports":
+            rep = REPORT_DEFS.get(parts[1])
+            if rep is None:
+                raise HttpError(404, f"unknown report {parts[1]!r}; expected one of {list(REPORT_DEFS)}")
+            try:
+                params = parse_params(rep, parse_qsl(url.query, keep_blank_values=True))
+            except ValueError as e:
+                raise HttpError(400, str(e)) from None
+            if not 0 <= params.get("limit", 0) <= MAX_LIMIT:
+                raise HttpError(400, f"limit must be between 0 and {MAX_LIMIT}")
+            start = time.perf_counter()
+            columns, rows = await self.pool.run(rep.sql, params)
+            return 200, {"report": rep.name, "params": params, "columns": columns, "rows": rows,
+                         "ms": round((time.perf_counter() - start) * 1000, 3)}
+        if parts == ["search"]:
+            query = dict(parse_qsl(url.query))
+            flag = lambda name: query.get(name, "") not in ("", "0", "false")
+            try:
+                limit = int(query.get("limit", SEARCH_LIMIT))
+                params = search_params(query.get("q", ""), limit, flag("prefix"), flag("phrase"),
+                                       query["fields"].split(",") if query.get("fields") else None)
+            except ValueError as e:
+                raise HttpError(400, str(e)) from None
+            if not 0 <= limit <= MAX_LIMIT:
+                raise HttpError(400, f"limit must be between 0 and {MAX_LIMIT}")
+            start = time.perf_counter()
+            columns, rows = await self.pool.run(SEARCH_SQL, params)
+            return 200, {"query": params[0], "columns": columns, "rows": rows,
+                         "ms": round((time.perf_counter() - start) * 1000, 3)}
+        if len(parts) == 2 and parts[0] == "trends":
+            query = dict(parse_qsl(url.query))
+            try:
+                top = int(query.get("top", TREND_TOP))
+                ids = [int(i) for i in query["ids"].split(",")] if query.get("ids") else None
+                sql, params = trend_query(parts[1], query.get("since"), query.get("until"),
+                                          query.get("bucket", "month"), ids, top)
+            except ValueError as e:
+                raise HttpError(400, str(e)) from None
+            if not 0 <= top <= MAX_LIMIT:
+                raise HttpError(400, f"top must be between 0 and {MAX_LIMIT}")
+            start = time.perf_counter()
+            columns, rows = await self.pool.run(sql, params)
+            return 200, {"level": parts[1], "columns": columns, "rows": rows,
+                         "ms": round((time.perf_counter() - start) * 1000, 3)}
+        raise HttpError(404, f"no route for {url.path}")
+
+    async def handle(self, reader, writer):
+        """One client connection; HTTP/1.1 requests are served until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length > 0:
+                    await reader.readexactly(length)
+
+                parts = request_line.decode("latin-1").split()
+                # without a valid length the next request cannot be found, so the connection closes
+                keep_alive = (length >= 0 and len(parts) == 3 and parts[2] == "HTTP/1.1"
+                              and headers.get("connection", "").lower() != "close")
+                try:
+                    if length < 0:
+                        raise HttpError(400, "malformed Content-Length header")
+                    if len(parts) != 3:
+                        raise HttpError(400, "malformed request line")
+                    status, payload = await self.respond(parts[0], parts[1])
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except sqlite3.Error as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                self.served += 1
+
+                body = json.dumps(payload).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                             + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host="127.0.0.1", port=8080, db=None, pool_size=POOL_SIZE, max_pending=MAX_PENDING):
+    pool = ReadPool(db, pool_size, max_pending)
+    server = await asyncio.start_server(ReportServer(pool).handle, host, port)
+    print(f"Report API listening on http://{host}:{server.sockets[0].getsockname()[1]}/ "
+          f"({pool_size} read connections, {len(REPORT_DEFS)} reports)", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the reports as a JSON HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db", help="SQLite file (default: the DB_URL database)")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE,
+                        help="read connections, i.e. queries running at once")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="requests allowed to wait for a connection before answering 503")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.db, args.pool_size, args.max_pending))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+"""
+Report registry with two engines: "sqlite" runs each report's SQL against movies.db,
+"memory" loads ratings once into compact NumPy arrays (int32 ids, float32 ratings) with
+CSR movie->genre / movie->director maps and answers the same reports with bincount and
+lexsort. Both return identical DataFrames: ties are broken by id in both, and ROUND()
+is reproduced exactly (sql_round). Sums are exact because MovieLens ratings are halves.
+
+    python reports.py --engine memory                  # every report
+    python reports.py --engine memory --repeat 50 top_movies
+    python reports.py --check                          # compare both engines
+    python reports.py --sql queries.sql                # ad-hoc SQL file, one result per statement
+
+SQLite results are served from the on-disk result cache (query_cache.py) until the next
+load changes the data; pass --no-cache to always query.
+"""
+import time
+import argparse
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+import pandas as pd
+from db import sqlite_connect
+from report_defs import REPORT_DEFS
+from query_cache import QueryCache, read_data_version
+
+DB = None  # the SQLite file named by DB_URL
+ENGINES = ("sqlite", "memory")
+
+Report = namedtuple("Report", "name sql memory defaults")
+REPORTS = {}
+
+
+def report(name):
+    """Register the memory implementation of report `name` (SQL and defaults: report_defs.py)."""
+    def register(fn):
+        defn = REPORT_DEFS[name]
+        REPORTS[name] = Report(name, defn.sql, fn, defn.defaults)
+        return fn
+    return register
+
+
+def sql_round(values, digits):
+    """
+    SQLite's ROUND(x, digits): half away from zero, applied to x printed with 15
+    significant digits, so 2.135 (stored as 2.13499999...) becomes 2.14.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10.0 ** digits
+    scaled = np.abs(values) * scale
+    out = np.sign(values) * np.floor(scaled + 0.5) / scale
+    # only values within a hair of a .5 boundary can differ from the decimal rule
+    quantum = Decimal(1).scaleb(-digits)
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        out[i] = float(Decimal("%.15g" % values[i]).quantize(quantum, ROUND_HALF_UP))
+    return out
+
+
+def _csr(n_rows, row_idx, values):
+    """(indptr, indices) grouping `values` by row index, like a CSR sparse matrix."""
+    order = np.argsort(row_idx, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_idx, minlength=n_rows), out=indptr[1:])
+    return indptr, values[order].astype(np.int32)
+
+
+class SqliteEngine:
+    """SQL against movies.db, with results read from / stored in `cache` (a QueryCache) if given."""
+    name = "sqlite"
+
+    def __init__(self, db=DB, cache=None):
+        self.con = sqlite_connect(db)
+        self.cache = cache
+
+    def run(self, rep, params):
+        return self.query(rep.sql, params)
+
+    def query(self, sql, params=None):
+        if self.cache is None:
+            return pd.read_sql_query(sql, self.con, params=params)
+        version = read_data_version(self.con)
+        df = self.cache.get(sql, params, version)
+        if df is None:
+            df = pd.read_sql_query(sql, self.con, params=params)
+            self.cache.put(sql, params, version, df)
+        return df
+
+    def close(self):
+        self.con.close()
+
+
+class MemoryEngine:
+    """
+    Columnar copy of the rating data. Per-movie sums and counts are computed on first use
+    and reused, so repeated reports only touch per-movie / per-group arrays.
+    """
+    name = "memory"
+
+    def __init__(self, movies, ratings, movie_genres, genres, movie_directors, directors):
+        """
+        Each argument maps column name -> array-like (a DataFrame or Snapshot.frame()).
+        Arrays already in the compact dtypes (e.g. memory-mapped snapshot columns) are used
+        without copying.
+        """
+        ids = [np.asarray(movies["movie_id"]), np.asarray(ratings["movie_id"]),
+               np.asarray(movie_genres["movie_id"]), np.asarray(movie_directors["movie_id"])]
+        # every movie id seen anywhere, so ratings/links for ids missing from `movies` still count
+        self.movie_ids = np.unique(np.concatenate(ids)).astype(np.int32)
+        n = len(self.movie_ids)
+        pos = np.searchsorted(self.movie_ids, ids[0])
+        self.in_movies = np.zeros(n, dtype=bool)
+        self.in_movies[pos] = True
+        self.title = np.empty(n, dtype=object)
+        self.title[pos] = np.asarray(movies["title"], dtype=object)
+        year = pd.array(movies["year"], dtype="Int64")
+        self.has_year = np.zeros(n, dtype=bool)
+        self.has_year[pos] = ~np.asarray(year.isna())
+        self.year = np.zeros(n, dtype=np.int32)
+        self.year[pos] = year.fillna(0).to_numpy(dtype=np.int64)
+
+        self.rating_user = np.asarray(ratings["user_id"], dtype=np.int32)
+        self.rating_movie = np.searchsorted(self.movie_ids, ids[1]).astype(np.int32)
+        self.rating_value = np.asarray(ratings["rating"], dtype=np.float32)
+
+        self.genre_ids = np.asarray(genres["genre_id"], dtype=np.int64)
+        self.genre_names = np.asarray(genres["genre_name"], dtype=object)
+        self.genre_indptr, self.genre_indices = _csr(
+            n, np.searchsorted(self.movie_ids, ids[2]),
+            np.searchsorted(self.genre_ids, np.asarray(movie_genres["genre_id"])))
+        self.director_ids = np.asarray(directors["director_id"], dtype=np.int64)
+        self.director_names = np.asarray(directors["director_name"], dtype=object)
+        self.director_indptr, self.director_indices = _csr(
+            n, np.searchsorted(self.movie_ids, ids[3]),
+            np.searchsorted(self.director_ids, np.asarray(movie_directors["director_id"])))
+        self._cache = {}
+
+    @classmethod
+    def from_sqlite(cls, db=DB, chunk_size=1_000_000):
+        con = sqlite_connect(db)
+        try:
+            parts = pd.read_sql_query("SELECT user_id, movie_id, rating FROM ratings", con, chunksize=chunk_size)
+            ratings = pd.concat([p.astype({"user_id": "int32", "movie_id": "int32", "rating": "float32"})
+                                 for p in parts], ignore_index=True)
+            if ratings.empty:
+                ratings = pd.DataFrame({"user_id": np.empty(0, np.int32), "movie_id": np.empty(0, np.int32),
+                                        "rating": np.empty(0, np.float32)})
+            movies = pd.read_sql_query("SELECT movie_id, title, year FROM movies", con)
+            frames = [pd.read_sql_query(f"SELECT * FROM {t}", con).astype({c: "int64" for c in cols})
+                      for t, cols in (("movie_genres", ("movie_id", "genre_id")),
+                                      ("movie_directors", ("movie_id", "director_id")))]
+            genres = pd.read_sql_query("SELECT genre_id, genre_name FROM genres ORDER BY genre_id", con)
+            directors = pd.read_sql_query("SELECT director_id, director_name FROM directors ORDER BY director_id", con)
+        finally:
+            con.close()
+        return cls(movies, ratings, frames[0], genres, frames[1], directors)
+
+    @classmethod
+    def from_snapshot(cls, path=None):
+        """Build from a snapshot written by snapshot.py (default: the CURRENT one)."""
+        from snapshot import Snapshot
+        snap = Snapshot(path)
+        return cls(snap.frame("movies", ["movie_id", "title", "year"]),
+                   snap.frame("ratings", ["user_id", "movie_id", "rating"]),
+                   snap.frame("movie_genres"), snap.frame("genres"),
+                   snap.frame("movie_directors"), snap.frame("directors"))
+
+    def run(self, rep, params):
+        return rep.memory(self, **params)
+
+    def close(self):
+        pass
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def movie_stats(self):
+        """(rating_sum, rating_count) per movie index."""
+        def compute():
+            n = len(self.movie_ids)
+            return (np.bincount(self.rating_movie, weights=self.rating_value, minlength=n),
+                    np.bincount(self.rating_movie, minlength=n))
+        return self._cached("movie", compute)
+
+    def user_stats(self):
+        """(user_ids, rating_count) for every user with ratings."""
+        return self._cached("user", lambda: np.unique(self.rating_user, return_counts=True))
+
+    def group_stats(self, kind):
+        """(rating_sum, rating_count, rated movie count) per genre or director index."""
+        def compute():
+            indptr = getattr(self, f"{kind}_indptr")
+            indices = getattr(self, f"{kind}_indices")
+            n_groups = len(getattr(self, f"{kind}_ids"))
+            s, c = self.movie_stats()
+            link_movie = np.repeat(np.arange(len(self.movie_ids)), np.diff(indptr))
+            rated = c[link_movie] > 0
+            return (np.bincount(indices, weights=s[link_movie], minlength=n_groups),
+                    np.bincount(indices, weights=c[link_movie], minlength=n_groups).astype(np.int64),
+                    np.bincount(indices[rated], minlength=n_groups))
+        return self._cached(kind, compute)
+
+
+def _frame(**columns):
+    return pd.DataFrame(columns)
+
+
+@report("top_movies")
+def top_movies(mem, min_count, digits, limit):
+    s, c = mem.movie_stats()
+    idx = np.flatnonzero(mem.in_movies & (c >= max(min_count, 1)))
+    avg = sql_round(s[idx] / c[idx], digits)
+    order = np.lexsort((mem.movie_ids[idx], -c[idx], -avg))[:limit]
+    return _frame(title=mem.title[idx[order]], avg_rating=avg[order], cnt=c[idx[order]].astype(np.int64))
+
+
+@report("top_movies_filtered")
+def top_movies_filtered(mem, min_count, digits, limit, genre, year_from, year_to):
+    s, c = mem.movie_stats()
+    keep = mem.in_movies & (c >= max(min_count, 1))
+    if year_from is not None:
+        keep &= mem.has_year & (mem.year >= year_from)
+    if year_to is not None:
+        keep &= mem.has_year & (mem.year <= year_to)
+    if genre is not None:
+        link_movie = np.repeat(np.arange(len(mem.movie_ids)), np.diff(mem.genre_indptr))
+        in_genre = np.zeros(len(mem.movie_ids), dtype=bool)
+        in_genre[link_movie[np.isin(mem.genre_indices, np.flatnonzero(mem.genre_names == genre))]] = True
+        keep &= in_genre
+    idx = np.flatnonzero(keep)
+    avg = sql_round(s[idx] / c[idx], digits)
+    order = np.lexsort((mem.movie_ids[idx], -c[idx], -avg))[:limit]
+    return _frame(title=mem.title[idx[order]], avg_rating=avg[order], cnt=c[idx[order]].astype(np.int64))
+
+
+def _rated_groups(mem, kind, min_count, digits, limit, count_col):
+    s, c, movie_count = mem.group_stats(kind)
+    counts = c if count_col == "cnt" else movie_count
+    idx = np.flatnonzero((c > 0) & (counts >= min_count))
+    avg = sql_round(s[idx] / c[idx], digits)
+    ids = getattr(mem, f"{kind}_ids")[idx]
+    order = np.lexsort((ids, -counts[idx], -avg))[:limit]
+    names = getattr(mem, f"{kind}_names")[idx[order]]
+    return _frame(**{f"{kind}_name": names, "avg_rating": avg[order],
+                     count_col: counts[idx[order]].astype(np.int64)})
+
+
+@report("top_genres")
+def top_genres(mem, min_count, digits, limit):
+    return _rated_groups(mem, "genre", min_count, digits, limit, "cnt")
+
+
+@report("top_directors")
+def top_directors(mem, min_movies, digits, limit):
+    return _rated_groups(mem, "director", min_movies, digits, limit, "movie_count")
+
+
+@report("prolific_directors")
+def prolific_directors(mem, limit):
+    counts = np.bincount(mem.director_indices, minlength=len(mem.director_ids))
+    idx = np.flatnonzero(counts)
+    order = np.lexsort((mem.director_ids[idx], -counts[idx]))[:limit]
+    return _frame(director_name=mem.director_names[idx[order]], movie_count=counts[idx[order]].astype(np.int64))
+
+
+@report("ratings_by_year")
+def ratings_by_year(mem, digits):
+    s, c = mem.movie_stats()
+    rated = np.flatnonzero(mem.in_movies & mem.has_year & (c > 0))
+    years, inverse = np.unique(mem.year[rated], return_inverse=True)
+    sums = np.bincount(inverse, weights=s[rated], minlength=len(years))
+    counts = np.bincount(inverse, weights=c[rated], minlength=len(years)).astype(np.int64)
+    return _frame(year=years.astype(np.int64), avg_rating=sql_round(sums / counts, digits), cnt=counts)
+
+
+@report("movies_per_year")
+def movies_per_year(mem, limit):
+    years, counts = np.unique(mem.year[mem.in_movies & mem.has_year], return_counts=True)
+    return _frame(year=years[::-1][:limit].astype(np.int64), movie_count=counts[::-1][:limit].astype(np.int64))
+
+
+@report("top_users")
+def top_users(mem, limit):
+    users, counts = mem.user_stats()
+    order = np.lexsort((users, -counts))[:limit]
+    return _frame(user_id=users[order].astype(np.int64), ratings_count=counts[order].astype(np.int64))
+
+
+_engines = {}
+
+
+def open_engine(kind="sqlite", db=DB, snapshot=None, cache=None):
+    """
+    An engine of the given kind. Memory engines are built once per database (or snapshot
+    directory, when one is given) and reused. `cache` (a QueryCache) only applies to sqlite:
+    the memory engine already answers from its own per-movie aggregates.
+    """
+    if kind == "sqlite":
+        return SqliteEngine(db, cache)
+    if kind != "memory":
+        raise ValueError(f"unknown engine {kind!r}; expected one of {ENGINES}")
+    key = ("snapshot", snapshot) if snapshot else ("db", db)
+    if key not in _engines:
+        _engines[key] = MemoryEngine.from_snapshot(snapshot) if snapshot else MemoryEngine.from_sqlite(db)
+    return _engines[key]
+
+
+def run_report(name, engine="sqlite", db=DB, cache=False, **params):
+    """
+    Run report `name` with its defaults overridden by params. engine: kind or engine object;
+    cache: True to use the default result cache, or a QueryCache.
+    """
+    rep = REPORTS[name]
+    own_cache = cache is True
+    cache = QueryCache() if own_cache else (None if cache is False else cache)
+    eng = open_engine(engine, db, cache=cache) if isinstance(engine, str) else engine
+    try:
+        return eng.run(rep, {**rep.defaults, **params})
+    finally:
+        if isinstance(engine, str):
+            eng.close()
+        if own_cache:
+            cache.close()
+
+
+def sql_statements(path):
+    """The non-empty ';'-separated statements of a SQL file such as queries.sql."""
+    with open(path, encoding="utf-8") as f:
+        return [stmt for stmt in (s.strip() for s in f.read().split(";")) if stmt]
+
+
+def add_engine_argument(parser):
+    parser.add_argument("--engine", choices=ENGINES, default="sqlite",
+                        help="sqlite: SQL against movies.db; memory: vectorized over in-memory arrays")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="bypass the on-disk result cache for the sqlite engine")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run reports on either engine")
+    parser.add_argument("names", nargs="*", help=f"reports to run (default all: {', '.join(REPORTS)})")
+    parser.add_argument("--db", default=DB, help="SQLite file (default: the DB_URL database)")
+    add_engine_argument(parser)
+    parser.add_argument("--snapshot", help="build the memory engine from this snapshot directory")
+    parser.add_argument("--repeat", type=int, default=1, help="run each report this many times and time it")
+    parser.add_argument("--check", action="store_true", help="verify both engines return identical results")
+    parser.add_argument("--sql", metavar="FILE", help="run the statements of this SQL file (sqlite engine)")
+    args = parser.parse_args()
+    names = args.names or list(REPORTS)
+
+    if args.check:
+        sql, mem = SqliteEngine(args.db), open_engine("memory", args.db, args.snapshot)
+        mismatched = 0
+        for name in names:
+            rep = REPORTS[name]
+            a, b = sql.run(rep, rep.defaults), mem.run(rep, rep.defaults)
+            # empty SQL results come back with object dtypes, so compare those by columns only
+            same = a.equals(b) or (a.empty and b.empty and list(a.columns) == list(b.columns))
+            mismatched += not same
+            print(f"{name:20s} {'match' if same else 'MISMATCH'} ({len(a)} rows)")
+            if not same:
+                print(a, b, sep="\n")
+        sql.close()
+        raise SystemExit(1 if mismatched else 0)
+
+    cache = QueryCache() if args.cache else None
+    if args.sql:
+        eng = SqliteEngine(args.db, cache)
+        for i, stmt in enumerate(sql_statements(args.sql), 1):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                df = eng.query(stmt)
+            per_run = (time.perf_counter() - start) / args.repeat
+            print(f"\n{args.sql} #{i} ({per_run * 1000:.2f} ms/run)")
+            print(df.to_string(index=False))
+    else:
+        start = time.perf_counter()
+        eng = open_engine(args.engine, args.db, args.snapshot, cache)
+        print(f"{args.engine} engine ready in {time.perf_counter() - start:.3f}s")
+        for name in names:
+            rep = REPORTS[name]
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                df = eng.run(rep, rep.defaults)
+            per_run = (time.perf_counter() - start) / args.repeat
+            print(f"\n{name} ({per_run * 1000:.2f} ms/run)")
+            print(df.to_string(index=False))
+    eng.close()
+    if cache is not None:
+        print("\nresult cache:", cache.stats())
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
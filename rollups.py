@@ -0,0 +1,403 @@
+"""
+Time-partitioned rating rollups for trend queries: rating sums and counts per UTC day,
+month and year for every movie (movie_rollup_day / _month / _year, keyed by (period,
+movie_id)) and, derived from those, for every genre and director.
+
+    python rollups.py trend genre --since 2000 --until 2015 --bucket year
+    python rollups.py trend director --ids 12,40 --since 2010-03-15 --until 2018-06-30
+    python rollups.py trend movie --since 2017-06 --bucket total --top 20 --scan
+    python rollups.py rebuild
+    python rollups.py bench --repeat 20
+
+Periods are integers: 20150314 (day), 201503 (month), 2015 (year). aggregates.load_rating_batch
+folds every staged batch in before merging it into `ratings`: a new rating adds to the
+periods of its timestamp, a changed one also takes the stored rating out of the periods of
+its old timestamp. Genre and director rollups follow the links recorded in
+genre_rollup_links / director_rollup_links; sync_links() adds a movie's whole history to a
+newly linked genre or director (and takes it out of an unlinked one), so loaders call it
+after linking movies. Ratings without a timestamp are left out. Rollups are SQLite-only,
+like the search index; on other backends the maintenance functions do nothing.
+
+A trend query covers its window with the coarsest periods that fit: whole years, then
+whole months, then the days left at the edges. A 15-year yearly trend reads about 15 rows
+per genre instead of every rating in those years.
+"""
+import time
+import json
+import calendar
+import argparse
+from datetime import date, timedelta
+from sqlalchemy import Table, Column, Integer, Float, MetaData, Index, text
+from db import db_url, get_engine
+
+# grain -> divisor that turns a yyyymmdd day into the grain's period
+GRAINS = {"day": 1, "month": 100, "year": 10000}
+BUCKETS = (*GRAINS, "total")
+TOP = 10
+# level -> (id column, name table, name column, movie link table)
+LEVELS = {
+    "movie": ("movie_id", "movies", "title", None),
+    "genre": ("genre_id", "genres", "genre_name", "movie_genres"),
+    "director": ("director_id", "directors", "director_name", "movie_directors"),
+}
+# yyyymmdd of a day number (Unix time // 86400)
+DAY_SQL = "CAST(strftime('%Y%m%d', ({}) * 86400, 'unixepoch') AS INTEGER)"
+# strftime format of a bucket's period, for the ratings scan
+FORMATS = {"day": "%Y%m%d", "month": "%Y%m", "year": "%Y"}
+
+rollup_metadata = MetaData()
+
+for _level, (_key, _, _, _link) in LEVELS.items():
+    for _grain in GRAINS:
+        Table(f"{_level}_rollup_{_grain}", rollup_metadata,
+              Column('period', Integer, primary_key=True),
+              Column(_key, Integer, primary_key=True),
+              Column('rating_sum', Float, nullable=False),
+              Column('rating_count', Integer, nullable=False),
+              Index(f"ix_{_level}_rollup_{_grain}_{_key}", _key, 'period'),
+              sqlite_with_rowid=False)
+    if _link is not None:
+        # the links the genre/director rollups currently include (see sync_links)
+        Table(f"{_level}_rollup_links", rollup_metadata,
+              Column('movie_id', Integer, primary_key=True),
+              Column(_key, Integer, primary_key=True),
+              sqlite_with_rowid=False)
+
+
+def _supported(bind):
+    return bind.dialect.name == "sqlite"
+
+
+def ensure_rollup_schema(bind):
+    if _supported(bind):
+        rollup_metadata.create_all(bind)
+
+
+def _fold(conn, source):
+    """
+    Add the rows of `source` (day, movie_id, rating_sum, rating_count; negative for
+    removals) to every movie rollup, and through the recorded links to the genre and
+    director rollups.
+    """
+    for level, (key, _, _, link) in LEVELS.items():
+        item, join = ("d", "") if link is None else \
+            ("l", f"JOIN {level}_rollup_links l ON l.movie_id = d.movie_id")
+        for grain, div in GRAINS.items():
+            table = f"{level}_rollup_{grain}"
+            period = "d.day" if div == 1 else f"d.day / {div}"  # plain column: grouped in key order, no sort
+            conn.execute(text(f"""
+                INSERT INTO {table} (period, {key}, rating_sum, rating_count)
+                SELECT {period}, {item}.{key}, SUM(d.rating_sum), SUM(d.rating_count)
+                FROM {source} d {join}
+                GROUP BY 1, 2
+                ON CONFLICT(period, {key}) DO UPDATE SET
+                    rating_sum = {table}.rating_sum + excluded.rating_sum,
+                    rating_count = {table}.rating_count + excluded.rating_count"""))
+
+
+def apply_staged_rollups(conn):
+    """
+    Fold the staged batch (aggregates.stage_ratings) into the rollups. Must run before the
+    batch is merged into `ratings`, while the stored ratings of re-rated pairs are still there.
+    """
+    if not _supported(conn):
+        return
+    conn.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS staged_rollup_deltas ("
+        "day INTEGER NOT NULL, movie_id INTEGER NOT NULL, rating_sum REAL NOT NULL, "
+        "rating_count INTEGER NOT NULL, PRIMARY KEY (day, movie_id))"))
+    conn.execute(text("DELETE FROM staged_rollup_deltas"))
+    # a plain LEFT JOIN, as in apply_staged_deltas: filtering it on r would let SQLite turn it
+    # into an inner join and build a Bloom filter over all of `ratings` for every batch
+    conn.execute(text(f"""
+        WITH j AS MATERIALIZED (
+            SELECT s.movie_id, s.rating, s.timestamp, r.rating AS old_rating, r.timestamp AS old_timestamp
+            FROM staged_ratings s LEFT JOIN ratings r ON r.user_id = s.user_id AND r.movie_id = s.movie_id)
+        INSERT INTO staged_rollup_deltas (day, movie_id, rating_sum, rating_count)
+        SELECT {DAY_SQL.format('d')}, movie_id, SUM(rating), SUM(n) FROM (
+            SELECT timestamp / 86400 AS d, movie_id, rating, 1 AS n FROM j WHERE timestamp IS NOT NULL
+            UNION ALL
+            SELECT old_timestamp / 86400, movie_id, -old_rating, -1 FROM j WHERE old_timestamp IS NOT NULL)
+        GROUP BY d, movie_id
+        HAVING SUM(n) != 0 OR SUM(rating) != 0"""))
+    _fold(conn, "staged_rollup_deltas")
+
+
+def sync_links(conn):
+    """
+    Bring the genre and director rollups in line with movie_genres / movie_directors: a new
+    link adds the movie's rollups to the genre or director, a removed one takes them out.
+    Costs one diff of the link tables plus the history of the changed movies.
+    """
+    if not _supported(conn):
+        return 0
+    changed = 0
+    for level, (key, _, _, link) in LEVELS.items():
+        if link is None:
+            continue
+        mirror = f"{level}_rollup_links"
+        conn.execute(text(
+            f"CREATE TEMP TABLE IF NOT EXISTS changed_{mirror} ("
+            f"movie_id INTEGER NOT NULL, {key} INTEGER NOT NULL, sign INTEGER NOT NULL)"))
+        conn.execute(text(f"DELETE FROM changed_{mirror}"))
+        n = conn.execute(text(f"""
+            INSERT INTO changed_{mirror} (movie_id, {key}, sign)
+            SELECT movie_id, {key}, 1 FROM (SELECT movie_id, {key} FROM {link}
+                                            EXCEPT SELECT movie_id, {key} FROM {mirror})
+            UNION ALL
+            SELECT movie_id, {key}, -1 FROM (SELECT movie_id, {key} FROM {mirror}
+                                             EXCEPT SELECT movie_id, {key} FROM {link})""")).rowcount
+        if not n:
+            continue
+        changed += n
+        for grain in GRAINS:
+            table = f"{level}_rollup_{grain}"
+            conn.execute(text(f"""
+                INSERT INTO {table} (period, {key}, rating_sum, rating_count)
+                SELECT r.period, c.{key}, SUM(c.sign * r.rating_sum), SUM(c.sign * r.rating_count)
+                FROM changed_{mirror} c JOIN movie_rollup_{grain} r ON r.movie_id = c.movie_id
+                GROUP BY 1, 2
+                ON CONFLICT(period, {key}) DO UPDATE SET
+                    rating_sum = {table}.rating_sum + excluded.rating_sum,
+                    rating_count = {table}.rating_count + excluded.rating_count"""))
+        conn.execute(text(f"DELETE FROM {mirror} WHERE (movie_id, {key}) IN "
+                          f"(SELECT movie_id, {key} FROM changed_{mirror} WHERE sign < 0)"))
+        conn.execute(text(f"INSERT INTO {mirror} (movie_id, {key}) "
+                          f"SELECT movie_id, {key} FROM changed_{mirror} WHERE sign > 0"))
+    return changed
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup from `ratings` and the current links."""
+    if not _supported(conn):
+        return
+    for table in rollup_metadata.sorted_tables:
+        conn.execute(text(f"DELETE FROM {table.name}"))
+    # group by day number first, so strftime runs once per (day, movie) instead of per rating
+    conn.execute(text(f"""
+        INSERT INTO movie_rollup_day (period, movie_id, rating_sum, rating_count)
+        SELECT {DAY_SQL.format('d')}, movie_id, s, n FROM (
+            SELECT timestamp / 86400 AS d, movie_id, SUM(rating) AS s, COUNT(*) AS n
+            FROM ratings WHERE timestamp IS NOT NULL GROUP BY d, movie_id)"""))
+    for finer, grain in (("day", "month"), ("month", "year")):
+        conn.execute(text(f"""
+            INSERT INTO movie_rollup_{grain} (period, movie_id, rating_sum, rating_count)
+            SELECT period / 100, movie_id, SUM(rating_sum), SUM(rating_count)
+            FROM movie_rollup_{finer} GROUP BY 1, 2"""))
+    for level, (key, _, _, link) in LEVELS.items():
+        if link is None:
+            continue
+        conn.execute(text(f"INSERT INTO {level}_rollup_links (movie_id, {key}) "
+                          f"SELECT DISTINCT movie_id, {key} FROM {link}"))
+        for grain in GRAINS:
+            conn.execute(text(f"""
+                INSERT INTO {level}_rollup_{grain} (period, {key}, rating_sum, rating_count)
+                SELECT r.period, l.{key}, SUM(r.rating_sum), SUM(r.rating_count)
+                FROM movie_rollup_{grain} r JOIN {level}_rollup_links l ON l.movie_id = r.movie_id
+                GROUP BY 1, 2"""))
+
+
+def ensure_rollups(conn):
+    """Backfill the rollups once for a database whose ratings predate them."""
+    if not _supported(conn):
+        return
+    empty = conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM movie_rollup_year)")).scalar()
+    if empty and conn.execute(text("SELECT EXISTS (SELECT 1 FROM ratings WHERE timestamp IS NOT NULL)")).scalar():
+        rebuild_rollups(conn)
+
+
+def parse_day(value, end=False):
+    """date of 'YYYY-MM-DD', 'YYYY-MM' or 'YYYY'; with end=True the last day of a month or year."""
+    if isinstance(value, date):
+        return value
+    parts = [int(p) for p in str(value).split("-")]
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"expected YYYY, YYYY-MM or YYYY-MM-DD, got {value!r}")
+    year, month, day = (parts + [None, None])[:3]
+    if month is None:
+        month = 12 if end else 1
+    if day is None:
+        day = calendar.monthrange(year, month)[1] if end else 1
+    return date(year, month, day)
+
+
+def _yyyymmdd(d):
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def cover(first, last, coarsest="year"):
+    """
+    (grain, first period, last period) ranges that together cover the days first..last
+    exactly: whole years, then whole months, then single days, none coarser than `coarsest`.
+    """
+    allowed = list(GRAINS)[:list(GRAINS).index(coarsest) + 1]
+    units = []
+    d = first
+    while d <= last:
+        month_end = d.replace(day=calendar.monthrange(d.year, d.month)[1])
+        if "year" in allowed and (d.month, d.day) == (1, 1) and d.replace(month=12, day=31) <= last:
+            units.append(("year", d.year))
+            d = d.replace(year=d.year + 1)
+        elif "month" in allowed and d.day == 1 and month_end <= last:
+            units.append(("month", d.year * 100 + d.month))
+            d = month_end + timedelta(days=1)
+        else:
+            units.append(("day", _yyyymmdd(d)))
+            d += timedelta(days=1)
+    ranges = []
+    for grain, period in units:
+        if ranges and ranges[-1][0] == grain:
+            ranges[-1][2] = period
+        else:
+            ranges.append([grain, period, period])
+    return [tuple(r) for r in ranges]
+
+
+def _epoch(d):
+    return calendar.timegm(d.timetuple())
+
+
+def trend_query(level, since=None, until=None, bucket="month", ids=None, top=TOP, scan=False):
+    """
+    (sql, params) of a trend: one row (bucket, id, name, rating_count, avg_rating) per item and
+    bucket of the days since..until (dates or 'YYYY[-MM[-DD]]' strings; default from
+    1970 to today). bucket is day, month, year (labelled yyyymmdd, yyyymm, yyyy) or total
+    (the whole window, labelled with its first day). The items are `ids`, or else the `top`
+    with the most ratings in the window. scan=True reads `ratings` instead of the rollups.
+    """
+    if level not in LEVELS:
+        raise ValueError(f"unknown level {level!r}; expected one of {list(LEVELS)}")
+    if bucket not in BUCKETS:
+        raise ValueError(f"unknown bucket {bucket!r}; expected one of {list(BUCKETS)}")
+    since = parse_day(since or "1970")
+    until = parse_day(until, end=True) if until else date.today()
+    if since > until:
+        raise ValueError(f"empty window: {since} is after {until}")
+    key, names, name_col, link = LEVELS[level]
+    params = {"label": _yyyymmdd(since), "top": -1 if ids else top}
+    where = ""
+    if ids:
+        params["ids"] = json.dumps([int(i) for i in ids])
+        where = f" AND {key} IN (SELECT value FROM json_each(:ids))"
+
+    if scan:
+        params.update(start=_epoch(since), end=_epoch(until + timedelta(days=1)))
+        label = ":label" if bucket == "total" else \
+            f"CAST(strftime('{FORMATS[bucket]}', r.timestamp, 'unixepoch') AS INTEGER)"
+        join = "" if link is None else f"JOIN {link} USING (movie_id)"
+        source = (f"SELECT {label} AS bucket, {key} AS item_id, r.rating AS rating_sum, 1 AS rating_count "
+                  f"FROM ratings r {join} WHERE r.timestamp >= :start AND r.timestamp < :end{where}")
+    else:
+        pieces = []
+        for i, (grain, lo, hi) in enumerate(cover(since, until, "year" if bucket == "total" else bucket)):
+            params[f"lo{i}"], params[f"hi{i}"] = lo, hi
+            div = 1 if bucket == "total" else GRAINS[bucket] // GRAINS[grain]
+            label = ":label" if bucket == "total" else "period" if div == 1 else f"period / {div}"
+            pieces.append(f"SELECT {label} AS bucket, {key} AS item_id, rating_sum, rating_count "
+                          f"FROM {level}_rollup_{grain} WHERE period BETWEEN :lo{i} AND :hi{i}{where}")
+        source = "\n            UNION ALL ".join(pieces)
+    sql = f"""
+        WITH t AS ({source}),
+             items AS (SELECT item_id FROM t GROUP BY item_id HAVING SUM(rating_count) > 0
+                       ORDER BY SUM(rating_count) DESC, item_id LIMIT :top)
+        SELECT t.bucket, t.item_id AS {key}, n.{name_col}, SUM(t.rating_count) AS rating_count,
+               ROUND(SUM(t.rating_sum) / SUM(t.rating_count), 3) AS avg_rating
+        FROM t JOIN items USING (item_id) JOIN {names} n ON n.{key} = t.item_id
+        GROUP BY t.bucket, t.item_id HAVING SUM(t.rating_count) > 0
+        ORDER BY t.item_id, t.bucket"""
+    return sql, params
+
+
+def trend(conn, level, since=None, until=None, bucket="month", ids=None, top=TOP, scan=False):
+    """Rows of trend_query on a SQLAlchemy connection; columns as listed there."""
+    sql, params = trend_query(level, since, until, bucket, ids, top, scan)
+    return conn.execute(text(sql), params).fetchall()
+
+
+def _median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def bench(conn, repeat=10):
+    """Median latency of typical dashboard trends from the rollups vs. scanning `ratings`."""
+    first, last = conn.execute(text(
+        "SELECT MIN(timestamp), MAX(timestamp) FROM ratings WHERE timestamp IS NOT NULL")).one()
+    if first is None:
+        print("No timestamped ratings.")
+        return
+    first, last = (date(*time.gmtime(t)[:3]) for t in (first, last))
+    n = conn.execute(text("SELECT COUNT(*) FROM ratings")).scalar()
+    director = conn.execute(text(
+        "SELECT director_id FROM director_rollup_year GROUP BY director_id ORDER BY SUM(rating_count) DESC LIMIT 1")).scalar()
+    mid = first + (last - first) / 2
+    cases = [
+        ("genres by year, all history", dict(level="genre", bucket="year")),
+        ("genres by month, all history", dict(level="genre", bucket="month")),
+        ("top movies, last 365 days", dict(level="movie", bucket="total", since=last - timedelta(days=364))),
+        ("one director by month", dict(level="director", bucket="month", ids=[director] if director else None)),
+        ("genres by day, 90 days", dict(level="genre", bucket="day", since=mid, until=mid + timedelta(days=89))),
+    ]
+    print(f"{n:,} ratings from {first} to {last}; median of {repeat} runs")
+    for name, case in cases:
+        case.setdefault("since", first)
+        case.setdefault("until", last)
+        rows = trend(conn, **case)
+        if rows != trend(conn, scan=True, **case):
+            print(f"{name}: rollups and scan disagree")
+        rollup = _median_ms(lambda: trend(conn, **case), repeat)
+        scan = _median_ms(lambda: trend(conn, scan=True, **case), max(1, repeat // 5))
+        print(f"{name:30s} rollups {rollup:9.2f} ms  scan {scan:10.2f} ms  ({len(rows)} rows)")
+
+
+def main(argv=None):
+    from report_defs import format_table
+    parser = argparse.ArgumentParser(description="Rating trends from the day/month/year rollups")
+    parser.add_argument("--db", help="SQLite file or database URL (default: DB_URL)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    tr = sub.add_parser("trend", help="rating count and average per item and period")
+    tr.add_argument("level", choices=LEVELS)
+    tr.add_argument("--since", help="first day: YYYY, YYYY-MM or YYYY-MM-DD (default: 1970)")
+    tr.add_argument("--until", help="last day, same forms (default: today)")
+    tr.add_argument("--bucket", choices=BUCKETS, default="month")
+    tr.add_argument("--ids", help="comma-separated item ids (default: the --top most rated)")
+    tr.add_argument("--top", type=int, default=TOP)
+    tr.add_argument("--scan", action="store_true", help="scan ratings instead (for comparison)")
+    sub.add_parser("rebuild", help="recompute every rollup from the ratings")
+    b = sub.add_parser("bench", help="rollup vs. ratings-scan trend latency")
+    b.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    engine = get_engine(db_url(args.db))
+    if not _supported(engine):
+        raise SystemExit("rating rollups need SQLite")
+    ensure_rollup_schema(engine)
+    with engine.begin() as conn:
+        if args.command == "rebuild":
+            start = time.perf_counter()
+            rebuild_rollups(conn)
+            rows = conn.execute(text("SELECT COUNT(*) FROM movie_rollup_day")).scalar()
+            print(f"Rebuilt rollups in {time.perf_counter() - start:.2f}s ({rows:,} movie-days)")
+            return
+        ensure_rollups(conn)
+        if args.command == "bench":
+            bench(conn, args.repeat)
+            return
+        try:
+            ids = [int(i) for i in args.ids.split(",")] if args.ids else None
+            sql, params = trend_query(args.level, args.since, args.until, args.bucket, ids, args.top, args.scan)
+        except ValueError as e:
+            parser.error(str(e))
+        start = time.perf_counter()
+        cur = conn.execute(text(sql), params)
+        columns, rows = list(cur.keys()), cur.fetchall()
+    print(format_table(columns, rows) if rows else "No ratings in that window.")
+    print(f"({len(rows)} rows in {(time.perf_counter() - start) * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
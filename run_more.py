@@ -1,11 +1,7 @@
-import sqlite3, pandas as pd
-con = sqlite3.connect("movies.db")
-q = """
-SELECT user_id, COUNT(*) AS ratings_count
-FROM ratings
-GROUP BY user_id
-ORDER BY ratings_count DESC
-LIMIT 10;
-"""
-print(pd.read_sql_query(q, con))
-con.close()
\ No newline at end of file
+import argparse
+from reports import run_report, add_engine_argument
+
+parser = argparse.ArgumentParser(description="Most active users")
+add_engine_argument(parser)
+args = parser.parse_args()
+print(run_report("top_users", args.engine, cache=args.cache, limit=10))
@@ -1,21 +1,9 @@
-import sqlite3
-import pandas as pd
+import argparse
+from reports import run_report, add_engine_argument
 
-con = sqlite3.connect("movies.db")
+parser = argparse.ArgumentParser(description="Top rated movies")
+add_engine_argument(parser)
+args = parser.parse_args()
 
-query = """
-SELECT m.title,
-       ROUND(AVG(r.rating), 2) AS avg_rating,
-       COUNT(*) AS cnt
-FROM movies m
-JOIN ratings r ON m.movie_id = r.movie_id
-GROUP BY m.movie_id
-HAVING cnt >= 10
-ORDER BY avg_rating DESC
-LIMIT 10;
-"""
-
-df = pd.read_sql_query(query, con)
+df = run_report("top_movies", args.engine, cache=args.cache, min_count=10, digits=2, limit=10)
 print(df)
-
-con.close()
\ No newline at end of file
@@ -1,18 +1,9 @@
-import sqlite3, pandas as pd
+import argparse
+from reports import run_report, add_engine_argument
 
-con = sqlite3.connect("movies.db")
+parser = argparse.ArgumentParser(description="Movies per release year")
+add_engine_argument(parser)
+args = parser.parse_args()
 
-
-query = """
-SELECT year, COUNT(*) AS movie_count
-FROM movies
-WHERE year IS NOT NULL
-GROUP BY year
-ORDER BY year DESC
-LIMIT 10;
-"""
-
-df = pd.read_sql_query(query, con)
+df = run_report("movies_per_year", args.engine, cache=args.cache, limit=10)
 print(df)
-
-con.close()
\ No newline at end of file
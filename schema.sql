@@ -46,4 +46,11 @@ CREATE TABLE IF NOT EXISTS ratings (
     timestamp INTEGER,
     FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE,
     UNIQUE (user_id, movie_id)
-);
\ No newline at end of file
+);
+
+-- secondary indexes for the report joins; keep in sync with db_profile.INDEXES
+CREATE INDEX IF NOT EXISTS ix_ratings_movie_rating ON ratings (movie_id, rating);
+CREATE INDEX IF NOT EXISTS ix_ratings_timestamp ON ratings (timestamp, movie_id, rating);
+CREATE INDEX IF NOT EXISTS ix_movie_genres_genre ON movie_genres (genre_id, movie_id);
+CREATE INDEX IF NOT EXISTS ix_movie_directors_director ON movie_directors (director_id, movie_id);
+CREATE INDEX IF NOT EXISTS ix_movies_year ON movies (year, movie_id);
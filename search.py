@@ -0,0 +1,238 @@
+"""
+Full-text movie search: an SQLite FTS5 index (movie_search) over title, OMDb plot, genre
+names and director names, ranked with bm25.
+
+    python search.py query "toy story"                 # all words, best matches first
+    python search.py query "star wa" --prefix          # type-ahead: every word is a prefix
+    python search.py query "the empire strikes" --phrase --title-only
+    python search.py rebuild                           # re-index every movie
+    python search.py bench --copies 100                # FTS vs LIKE latency (p50/p99)
+
+The loaders keep the index in sync: etl.py re-indexes each movie batch it upserts (two
+statements per batch whatever its size), enrich_directors.py the movies it links, and
+full loads (load_direct.py, populate_genres.py, snapshot restore) rebuild it. Functions
+that write take either a sqlite3 or a SQLAlchemy connection, and do nothing on other
+backends, which have no FTS5.
+"""
+import re
+import json
+import time
+import random
+import sqlite3
+import argparse
+from db import sqlite_connect
+
+DB = None  # the SQLite file named by DB_URL
+# bm25 weight per indexed column: a title hit outranks a director, genre or plot hit
+WEIGHTS = {"title": 10.0, "plot": 1.0, "genres": 2.0, "directors": 5.0}
+LIMIT = 10
+
+SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS movie_search USING fts5(
+    {', '.join(WEIGHTS)},
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)"""
+
+# rowid = movie_id; ? is a JSON array of movie ids (json_each), or the whole table when absent
+INDEX_SQL = """
+    INSERT INTO movie_search (rowid, title, plot, genres, directors)
+    SELECT m.movie_id, m.title, m.plot,
+           (SELECT group_concat(g.genre_name, ' ') FROM movie_genres mg
+            JOIN genres g ON g.genre_id = mg.genre_id WHERE mg.movie_id = m.movie_id),
+           (SELECT group_concat(d.director_name, ', ') FROM movie_directors md
+            JOIN directors d ON d.director_id = md.director_id WHERE md.movie_id = m.movie_id)
+    FROM movies m"""
+IDS = "(SELECT value FROM json_each(?))"
+
+
+def _execute(conn, sql, params=()):
+    """Run plain SQL on a sqlite3 connection or through a SQLAlchemy connection's driver."""
+    run = getattr(conn, "exec_driver_sql", None) or conn.execute
+    return run(sql, params)
+
+
+def _supported(conn):
+    return isinstance(conn, sqlite3.Connection) or conn.dialect.name == "sqlite"
+
+
+def ensure_search_index(conn):
+    """Create movie_search if needed, indexing the existing movies when it is new."""
+    if not _supported(conn):
+        return
+    exists = _execute(conn, "SELECT 1 FROM sqlite_master WHERE name = 'movie_search'").fetchone()
+    _execute(conn, SCHEMA)
+    if not exists:
+        rebuild_search(conn)
+
+
+def rebuild_search(conn):
+    """Re-index every movie. Returns the number of indexed movies."""
+    if not _supported(conn):
+        return 0
+    _execute(conn, SCHEMA)
+    _execute(conn, "DELETE FROM movie_search")
+    return _execute(conn, INDEX_SQL).rowcount
+
+
+def sync_search(conn, movie_ids):
+    """Re-index the given movies (new or changed title, plot, genres or directors)."""
+    movie_ids = [int(m) for m in movie_ids]
+    if not movie_ids or not _supported(conn):
+        return 0
+    ids = json.dumps(movie_ids)
+    _execute(conn, f"DELETE FROM movie_search WHERE rowid IN {IDS}", (ids,))
+    return _execute(conn, f"{INDEX_SQL} WHERE m.movie_id IN {IDS}", (ids,)).rowcount
+
+
+def build_query(text, prefix=False, phrase=False, fields=None):
+    """
+    FTS5 query for free text: every word must match (as one phrase with phrase=True),
+    each word is a prefix with prefix=True, and fields restricts the match to those
+    columns. Words are quoted, so FTS5 operators in the input are matched literally.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        raise ValueError(f"nothing to search for in {text!r}")
+    star = " *" if prefix else ""
+    if phrase:
+        expr = f'"{" ".join(words)}"{star}'
+    else:
+        expr = " ".join(f'"{w}"{star}' for w in words)
+    if fields:
+        unknown = set(fields) - set(WEIGHTS)
+        if unknown:
+            raise ValueError(f"unknown search fields {sorted(unknown)}; expected some of {list(WEIGHTS)}")
+        expr = f"{{{' '.join(fields)}}} : ({expr})"
+    return expr
+
+
+_WEIGHTS_SQL = ", ".join(str(w) for w in WEIGHTS.values())
+SEARCH_SQL = f"""
+    SELECT s.rowid AS movie_id, m.title, m.year, round(bm25(movie_search, {_WEIGHTS_SQL}), 3) AS score,
+           snippet(movie_search, 1, '[', ']', '...', 10) AS snippet
+    FROM movie_search s JOIN movies m ON m.movie_id = s.rowid
+    WHERE movie_search MATCH ?
+    ORDER BY bm25(movie_search, {_WEIGHTS_SQL})
+    LIMIT ?"""
+
+
+def search_params(text, limit=LIMIT, prefix=False, phrase=False, fields=None):
+    """Bound parameters of SEARCH_SQL; ValueError for empty text or unknown fields."""
+    return build_query(text, prefix, phrase, fields), limit
+
+
+def search(con, text, limit=LIMIT, prefix=False, phrase=False, fields=None):
+    """
+    Best bm25 matches for `text` as (movie_id, title, year, score, snippet) tuples; lower
+    scores are better matches. snippet highlights the plot match with [brackets].
+    """
+    return con.execute(SEARCH_SQL, search_params(text, limit, prefix, phrase, fields)).fetchall()
+
+
+def like_search(con, text, limit=LIMIT):
+    """The LIKE scan search replaces: substring match on title, shortest title first."""
+    return con.execute("""
+        SELECT movie_id, title FROM movies WHERE title LIKE ?
+        ORDER BY length(title), movie_id LIMIT ?""", (f"%{text}%", limit)).fetchall()
+
+
+def _percentiles(seconds):
+    seconds = sorted(seconds)
+    pick = lambda p: seconds[min(len(seconds) - 1, int(p / 100 * len(seconds)))] * 1e6
+    return f"p50 {pick(50):8.1f} us  p99 {pick(99):8.1f} us"
+
+
+def bench(con, queries=200, copies=1, seed=42):
+    """
+    Time title lookups through FTS and through LIKE for titles sampled from the catalogue.
+    copies > 1 runs on an in-memory catalogue that many times larger, the extra movies
+    titled with words sampled from the real titles.
+    """
+    rng = random.Random(seed)
+    if copies > 1:
+        mem = sqlite3.connect(":memory:")
+        mem.executescript("""
+            CREATE TABLE movies (movie_id INTEGER PRIMARY KEY, title TEXT, year INTEGER, plot TEXT);
+            CREATE TABLE genres (genre_id INTEGER PRIMARY KEY, genre_name TEXT);
+            CREATE TABLE movie_genres (movie_id INTEGER, genre_id INTEGER);
+            CREATE TABLE directors (director_id INTEGER PRIMARY KEY, director_name TEXT);
+            CREATE TABLE movie_directors (movie_id INTEGER, director_id INTEGER);""")
+        rows = con.execute("SELECT movie_id, title, year, plot FROM movies").fetchall()
+        vocabulary = [w for _, title, _, _ in rows for w in title.split()]
+        step = max(r[0] for r in rows) + 1
+        for c in range(copies):
+            # extra copies get titles of the same length drawn from the catalogue's words
+            mem.executemany("INSERT INTO movies VALUES (?, ?, ?, ?)",
+                            [(mid + c * step,
+                              title if c == 0 else " ".join(rng.choices(vocabulary, k=len(title.split()))),
+                              year, plot) for mid, title, year, plot in rows])
+        rebuild_search(mem)
+        mem.commit()
+        con = mem
+    n = con.execute("SELECT COUNT(*) FROM movies").fetchone()[0]
+    titles = [t for (t,) in con.execute("SELECT title FROM movies")]
+    picks = [rng.choice(titles) for _ in range(queries)]
+    cases = {
+        "full title": [(t, dict(phrase=True, fields=["title"]), t) for t in picks],
+        "title word prefix": [(w[:4], dict(prefix=True, fields=["title"]), w[:4])
+                              for w in (max(re.findall(r"\w+", t) or [t], key=len) for t in picks)],
+    }
+    print(f"{n:,} movies, {queries} queries per case")
+    for case, items in cases.items():
+        fts, like = [], []
+        for text, opts, pattern in items:
+            start = time.perf_counter()
+            search(con, text, **opts)
+            fts.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            like_search(con, pattern)
+            like.append(time.perf_counter() - start)
+        print(f"{case:18s} FTS  {_percentiles(fts)}")
+        print(f"{'':18s} LIKE {_percentiles(like)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Full-text movie search (SQLite FTS5)")
+    parser.add_argument("--db", default=DB, help="SQLite file (default: the DB_URL database)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    q = sub.add_parser("query", help="search titles, plots, genres and directors")
+    q.add_argument("text")
+    q.add_argument("--limit", type=int, default=LIMIT)
+    q.add_argument("--prefix", action="store_true", help="match every word as a prefix")
+    q.add_argument("--phrase", action="store_true", help="match the words as one phrase")
+    q.add_argument("--title-only", action="store_true", help="match titles only")
+    sub.add_parser("rebuild", help="re-index every movie")
+    b = sub.add_parser("bench", help="FTS vs LIKE title lookup latency")
+    b.add_argument("--queries", type=int, default=200)
+    b.add_argument("--copies", type=int, default=1, help="benchmark on this many copies of the catalogue")
+    args = parser.parse_args(argv)
+
+    con = sqlite_connect(args.db)
+    try:
+        if args.command == "rebuild":
+            with con:
+                print(f"Indexed {rebuild_search(con)} movies")
+            return
+        with con:
+            ensure_search_index(con)
+        if args.command == "bench":
+            bench(con, args.queries, args.copies)
+            return
+        try:
+            rows = search(con, args.text, args.limit, args.prefix, args.phrase,
+                          ["title"] if args.title_only else None)
+        except ValueError as e:
+            parser.error(str(e))
+        for movie_id, title, year, score, snippet in rows:
+            print(f"{score:8.3f}  {movie_id:>7}  {title} ({year or '?'})")
+            if snippet and "[" in snippet:
+                print(f"{'':19s}{snippet}")
+        if not rows:
+            print("No matches.")
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""
+Item-item similarity from the ratings table. Ratings are loaded into a scipy.sparse
+movie x user matrix whose rows are L2-normalized, so one sparse product X[block] @ X.T
+gives the cosine similarity of a block of movies against every movie; the top K of each
+row are stored in movie_similarities. Blocks are sized to stay within --block-mb and can
+be spread over --workers processes (this process stays the only writer).
+
+    python similarity.py build                    # incremental: movies with new ratings
+    python similarity.py build --full --workers 4 --method adjusted
+    python similarity.py like "Toy Story"         # or a movie id
+    python similarity.py recommend 42
+
+--method adjusted subtracts each user's mean rating first (adjusted cosine). Only movies
+with at least --min-ratings ratings are used as neighbours, and only positive similarities
+are kept. An incremental build recomputes the lists of changed movies exactly and merges
+their new similarities into everyone else's stored top K; a list that lost a neighbour
+can then hold fewer than K entries (and with --method adjusted the user means drift), so
+run --full now and then.
+"""
+import time
+import argparse
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from metrics import metrics, profiling
+from db import sqlite_connect
+
+DB = None  # the SQLite file named by DB_URL
+K = 20
+MIN_RATINGS = 5
+METHODS = ("cosine", "adjusted")
+BLOCK_MB = 256
+# an incremental build touching more movies than this fraction recomputes everything
+FULL_REFRESH_FRACTION = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movie_similarities (
+    movie_id INTEGER NOT NULL,
+    similar_movie_id INTEGER NOT NULL,
+    similarity REAL NOT NULL,
+    PRIMARY KEY (movie_id, similar_movie_id)
+);
+CREATE TABLE IF NOT EXISTS movie_similarity_state (
+    movie_id INTEGER PRIMARY KEY,
+    rating_count INTEGER NOT NULL,
+    rating_sum REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS movie_similarity_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+RatingMatrix = namedtuple("RatingMatrix", "movie_ids X counts sums")
+
+
+def load_matrix(con, method="cosine", chunk_size=1_000_000):
+    """
+    Row-normalized movie x user CSR matrix (float32) of the ratings, with the movie id of
+    each row and the per-movie rating count and sum (used to detect changed movies).
+    """
+    parts = pd.read_sql_query("SELECT user_id, movie_id, rating FROM ratings", con, chunksize=chunk_size)
+    frames = [p.astype({"user_id": "int32", "movie_id": "int32", "rating": "float32"}) for p in parts]
+    if frames:
+        ratings = pd.concat(frames, ignore_index=True)
+        user, movie = ratings["user_id"].to_numpy(), ratings["movie_id"].to_numpy()
+        values = ratings["rating"].to_numpy(dtype=np.float64)
+    else:
+        user = movie = np.empty(0, np.int32)
+        values = np.empty(0, np.float64)
+    movie_ids, row = np.unique(movie, return_inverse=True)
+    user_ids, col = np.unique(user, return_inverse=True)
+    counts = np.bincount(row, minlength=len(movie_ids))
+    sums = np.bincount(row, weights=values, minlength=len(movie_ids))
+    if method == "adjusted":
+        user_mean = (np.bincount(col, weights=values, minlength=len(user_ids))
+                     / np.maximum(np.bincount(col, minlength=len(user_ids)), 1))
+        values = values - user_mean[col]
+    X = sparse.csr_matrix((values, (row, col)), shape=(len(movie_ids), len(user_ids)))
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    X = (sparse.diags(scale) @ X).astype(np.float32).tocsr()
+    return RatingMatrix(movie_ids.astype(np.int64), X, counts, sums)
+
+
+def rows_per_block(n_movies, block_mb=BLOCK_MB):
+    # a dense float32 block, its negation and the int64 argpartition result: ~16 bytes a cell
+    return max(1, block_mb * 1024 * 1024 // (16 * max(n_movies, 1)))
+
+
+def merge_top_k(owner, other, sim, k):
+    """Keep the k highest `sim` per `owner` (ties by `other`); arrays come back grouped by owner."""
+    order = np.lexsort((other, -sim, owner))
+    owner, other, sim = owner[order], other[order], sim[order]
+    idx = np.arange(len(owner))
+    first = np.ones(len(owner), dtype=bool)
+    first[1:] = owner[1:] != owner[:-1]
+    rank = idx - np.maximum.accumulate(np.where(first, idx, 0))
+    keep = rank < k
+    return owner[keep], other[keep], sim[keep]
+
+
+# set once per process (workers by the pool initializer) so tasks only carry row indices
+_X = _XT = _eligible = None
+_k = K
+
+
+def _init_worker(X, eligible, k):
+    global _X, _XT, _eligible, _k
+    _X, _XT, _eligible, _k = X, X.T.tocsr(), eligible, k
+
+
+def top_k_rows(rows):
+    """Top-k neighbours of the given matrix rows: (owner, other, similarity) arrays."""
+    sims = (_X[rows] @ _XT).toarray()
+    sims[:, ~_eligible] = -np.inf
+    sims[np.arange(len(rows)), rows] = -np.inf
+    k = min(_k, sims.shape[1])
+    if k == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(sims, part, axis=1)
+    owner = np.repeat(np.asarray(rows, dtype=np.int64), k)
+    other, top = part.ravel().astype(np.int64), top.ravel()
+    positive = top > 0
+    return merge_top_k(owner[positive], other[positive], top[positive], k)
+
+
+def compute_top_k(rows, block, workers=1):
+    """Yield top_k_rows results block by block, in order, from this process or a pool."""
+    blocks = [rows[i:i + block] for i in range(0, len(rows), block)]
+    if workers <= 1:
+        for b in blocks:
+            yield top_k_rows(b)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(_X, _eligible, _k)) as pool:
+        pending = deque()
+        for b in blocks:
+            pending.append(pool.submit(top_k_rows, b))
+            # at most two blocks per worker in flight to bound memory
+            while len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def cross_similarities(changed, block):
+    """
+    Positive similarities of every movie to the changed movies, block by block, as
+    (owner, other, similarity) with `other` always a changed movie.
+    """
+    for i in range(0, len(changed), block):
+        cols = changed[i:i + block]
+        prod = (_X @ _X[cols].T).tocoo()
+        keep = (prod.data > 0) & _eligible[cols[prod.col]]
+        yield prod.row[keep].astype(np.int64), cols[prod.col[keep]].astype(np.int64), prod.data[keep]
+
+
+def _concat(parts):
+    """Concatenate a list of (owner, other, similarity) triples."""
+    if not parts:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    return tuple(np.concatenate(cols) for cols in zip(*parts))
+
+
+def _read_meta(con):
+    return dict(con.execute("SELECT name, value FROM movie_similarity_meta").fetchall())
+
+
+def changed_movies(con, mat):
+    """Row indices of movies whose rating count or sum differ from the last build."""
+    state = pd.read_sql_query("SELECT movie_id, rating_count, rating_sum FROM movie_similarity_state", con)
+    pos = np.searchsorted(mat.movie_ids, state["movie_id"].to_numpy())
+    pos = np.minimum(pos, max(len(mat.movie_ids) - 1, 0))
+    known = np.zeros(len(mat.movie_ids), dtype=bool)
+    if len(mat.movie_ids):
+        found = mat.movie_ids[pos] == state["movie_id"].to_numpy()
+        same = (found & (mat.counts[pos] == state["rating_count"].to_numpy())
+                & np.isclose(mat.sums[pos], state["rating_sum"].to_numpy()))
+        known[pos[same]] = True
+    return np.flatnonzero(~known)
+
+
+def _write(con, mat, owners, lists, full, settings):
+    """Replace the stored lists of `owners` (row indices) with `lists` and save the state."""
+    owner, other, sim = lists
+    ids = mat.movie_ids
+    con.execute("BEGIN")
+    if full:
+        con.execute("DELETE FROM movie_similarities")
+        con.execute("DELETE FROM movie_similarity_state")
+    else:
+        con.executemany("DELETE FROM movie_similarities WHERE movie_id = ?", ((m,) for m in ids[owners].tolist()))
+    con.executemany("INSERT INTO movie_similarities (movie_id, similar_movie_id, similarity) VALUES (?, ?, ?)",
+                    zip(ids[owner].tolist(), ids[other].tolist(), sim.astype(np.float64).tolist()))
+    con.execute("DELETE FROM movie_similarity_state")
+    con.executemany("INSERT INTO movie_similarity_state (movie_id, rating_count, rating_sum) VALUES (?, ?, ?)",
+                    zip(ids.tolist(), mat.counts.tolist(), mat.sums.tolist()))
+    # movies that lost all their ratings drop out of every list
+    con.execute("DELETE FROM movie_similarities WHERE movie_id NOT IN (SELECT movie_id FROM movie_similarity_state) "
+                "OR similar_movie_id NOT IN (SELECT movie_id FROM movie_similarity_state)")
+    con.executemany("INSERT OR REPLACE INTO movie_similarity_meta (name, value) VALUES (?, ?)",
+                    [(name, str(value)) for name, value in settings.items()])
+    con.execute("COMMIT")
+
+
+def build(db=DB, full=False, method="cosine", k=K, min_ratings=MIN_RATINGS, workers=1, block_mb=BLOCK_MB):
+    """
+    Refresh movie_similarities. Incremental unless `full`, there is no previous build, the
+    settings changed or too many movies changed. Returns the number of movies recomputed.
+    """
+    global _X, _XT, _eligible
+    settings = {"method": method, "k": k, "min_ratings": min_ratings}
+    con = sqlite_connect(db, isolation_level=None)
+    try:
+        con.executescript(SCHEMA)
+        with metrics.stage("similarity.matrix") as entry:
+            mat = load_matrix(con, method)
+            entry["rows"] += mat.X.nnz
+        n = len(mat.movie_ids)
+        stored = _read_meta(con)
+        if not full and any(stored.get(name) != str(value) for name, value in settings.items()):
+            if stored:
+                print("Similarity settings changed; recomputing every movie.")
+            full = True
+        changed = np.arange(n) if full else changed_movies(con, mat)
+        if not full and len(changed) > FULL_REFRESH_FRACTION * n:
+            full, changed = True, np.arange(n)
+        if not full and not len(changed):
+            print("No movies with new ratings since the last build.")
+            return 0
+
+        _init_worker(mat.X, mat.counts >= min_ratings, k)
+        block = rows_per_block(n, block_mb)
+        start = time.perf_counter()
+        with metrics.stage("similarity.top_k", rows=len(changed)):
+            parts = list(compute_top_k(changed, block, workers))
+        owner, other, sim = _concat(parts)
+        owners = changed
+        if not full:
+            with metrics.stage("similarity.merge"):
+                owner, other, sim, owners = _merge_changed(con, mat, changed, block, (owner, other, sim))
+        with metrics.stage("similarity.write", rows=len(owner)):
+            _write(con, mat, owners, (owner, other, sim), full, settings)
+        kind = "full" if full else "incremental"
+        print(f"Similarities ({kind}, {method}): {len(changed)} movies recomputed, {len(owners)} lists "
+              f"written, {len(owner)} pairs in {time.perf_counter() - start:.2f}s")
+        return len(changed)
+    finally:
+        con.close()
+        _X = _XT = _eligible = None
+
+
+def _merge_changed(con, mat, changed, block, fresh):
+    """
+    Incremental step for the movies that did not change: drop their stored neighbours that
+    changed and merge in the new similarities to those, keeping the top K. Returns the
+    lists of every touched movie (changed ones included) and those movies' row indices.
+    """
+    is_changed = np.zeros(len(mat.movie_ids), dtype=bool)
+    is_changed[changed] = True
+    old = pd.read_sql_query("SELECT movie_id, similar_movie_id, similarity FROM movie_similarities", con)
+    owner = np.searchsorted(mat.movie_ids, old["movie_id"].to_numpy())
+    other = np.searchsorted(mat.movie_ids, old["similar_movie_id"].to_numpy())
+    owner, other = np.minimum(owner, len(mat.movie_ids) - 1), np.minimum(other, len(mat.movie_ids) - 1)
+    valid = ((mat.movie_ids[owner] == old["movie_id"].to_numpy())
+             & (mat.movie_ids[other] == old["similar_movie_id"].to_numpy()))
+    touched = np.zeros(len(mat.movie_ids), dtype=bool)
+    touched[owner[valid & is_changed[other]]] = True
+    keep = valid & ~is_changed[owner] & ~is_changed[other]
+    parts = [(owner[keep], other[keep], old["similarity"].to_numpy(np.float32)[keep])]
+    for cross in cross_similarities(changed, block):
+        mine = ~is_changed[cross[0]]
+        touched[cross[0][mine]] = True
+        parts.append(tuple(a[mine] for a in cross))
+    owner, other, sim = _concat(parts)
+    touched &= ~is_changed
+    kept = merge_top_k(owner, other, sim, _k)
+    mask = touched[kept[0]]
+    owners = np.concatenate([changed, np.flatnonzero(touched)])
+    return (np.concatenate([fresh[0], kept[0][mask]]), np.concatenate([fresh[1], kept[1][mask]]),
+            np.concatenate([fresh[2], kept[2][mask]]), owners)
+
+
+def find_movie(con, movie):
+    """Movie id for an id or a title fragment (the most rated match)."""
+    if str(movie).isdigit():
+        return int(movie)
+    row = con.execute("""
+        SELECT m.movie_id FROM movies m LEFT JOIN movie_similarity_state s ON s.movie_id = m.movie_id
+        WHERE m.title LIKE ? ORDER BY COALESCE(s.rating_count, 0) DESC, m.movie_id LIMIT 1""",
+                      (f"%{movie}%",)).fetchone()
+    if row is None:
+        raise LookupError(f"no movie matches {movie!r}")
+    return row[0]
+
+
+def movies_like(con, movie, limit=10):
+    """The stored nearest neighbours of a movie (id or title fragment)."""
+    return pd.read_sql_query("""
+        SELECT s.similar_movie_id AS movie_id, m.title, ROUND(s.similarity, 4) AS similarity
+        FROM movie_similarities s JOIN movies m ON m.movie_id = s.similar_movie_id
+        WHERE s.movie_id = :movie_id
+        ORDER BY s.similarity DESC, s.similar_movie_id
+        LIMIT :limit""", con, params={"movie_id": find_movie(con, movie), "limit": limit})
+
+
+def recommend_for_user(con, user_id, limit=10, min_support=2):
+    """
+    Item-based recommendations: each unrated movie that neighbours something the user
+    rated is scored by the similarity-weighted average of the user's ratings of those
+    neighbours; min_support is how many of the user's movies must point at it.
+    """
+    return pd.read_sql_query("""
+        SELECT s.similar_movie_id AS movie_id, m.title,
+               ROUND(SUM(s.similarity * r.rating) / SUM(s.similarity), 3) AS predicted_rating,
+               COUNT(*) AS support
+        FROM ratings r
+        JOIN movie_similarities s ON s.movie_id = r.movie_id
+        JOIN movies m ON m.movie_id = s.similar_movie_id
+        WHERE r.user_id = :user_id
+          AND s.similar_movie_id NOT IN (SELECT movie_id FROM ratings WHERE user_id = :user_id)
+        GROUP BY s.similar_movie_id
+        HAVING COUNT(*) >= :min_support
+        ORDER BY predicted_rating DESC, support DESC, s.similar_movie_id
+        LIMIT :limit""", con, params={"user_id": user_id, "limit": limit, "min_support": min_support})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Item-item movie similarities and recommendations")
+    parser.add_argument("--db", default=DB, help="SQLite file (default: the DB_URL database)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="compute or refresh movie_similarities")
+    b.add_argument("--full", action="store_true", help="recompute every movie, not just those with new ratings")
+    b.add_argument("--method", choices=METHODS, default="cosine")
+    b.add_argument("--k", type=int, default=K, help="neighbours stored per movie")
+    b.add_argument("--min-ratings", type=int, default=MIN_RATINGS, help="ratings a movie needs to be a neighbour")
+    b.add_argument("--workers", type=int, default=1, help="processes computing blocks of movies")
+    b.add_argument("--block-mb", type=int, default=BLOCK_MB, help="memory per block of similarity rows")
+    b.add_argument("--profile", metavar="PATH", help="write stage metrics here (.json or Prometheus text)")
+    like = sub.add_parser("like", help="movies similar to a movie")
+    like.add_argument("movie", help="movie id or title fragment")
+    like.add_argument("--limit", type=int, default=10)
+    rec = sub.add_parser("recommend", help="recommendations for a user")
+    rec.add_argument("user_id", type=int)
+    rec.add_argument("--limit", type=int, default=10)
+    rec.add_argument("--min-support", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with profiling(args.profile):
+            build(args.db, args.full, args.method, args.k, args.min_ratings, args.workers, args.block_mb)
+        return
+    con = sqlite_connect(args.db)
+    try:
+        con.executescript(SCHEMA)
+        if args.command == "like":
+            df = movies_like(con, args.movie, args.limit)
+        else:
+            df = recommend_for_user(con, args.user_id, args.limit, args.min_support)
+    finally:
+        con.close()
+    print(df.to_string(index=False) if not df.empty else "No results (run: python similarity.py build).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Versioned columnar snapshots of the loaded tables, one .npy file per column plus a
+manifest.json, so a new analysis node can start from them instead of re-ingesting the CSVs.
+
+    python snapshot.py export                    # snapshots/000001/ ..., CURRENT -> latest
+    python snapshot.py restore --db fresh.db     # bootstrap a SQLite database from CURRENT
+    python snapshot.py info
+
+Numeric columns are stored with the smallest lossless dtype (int32 ids, float32 half-star
+ratings) and read memory-mapped. Text is stored as concatenated UTF-8 bytes plus int64
+offsets. Nullable columns get a `valid` mask. Summary tables are not stored; restore
+rebuilds them from the ratings.
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.sql import sqltypes
+from db import db_url, get_engine, sqlite_url
+
+FORMAT_VERSION = 1
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "snapshots")
+KEEP = 3
+CHUNK_ROWS = 1_000_000
+
+# (table, order-by columns). Optional tables are skipped when the database lacks them.
+TABLES = [
+    ("movies", ("movie_id",)),
+    ("genres", ("genre_id",)),
+    ("movie_genres", ("movie_id", "genre_id")),
+    ("directors", ("director_id",)),
+    ("movie_directors", ("movie_id", "director_id")),
+    ("ratings", ("rating_id",)),
+    ("pipeline_state", ("source",)),
+    ("movie_fingerprints", ("movie_id",)),
+    ("director_enrichment", ("movie_id",)),
+]
+
+
+def _column_kind(sa_type):
+    if isinstance(sa_type, sqltypes.Integer):
+        return "int"
+    if isinstance(sa_type, (sqltypes.Float, sqltypes.Numeric)):
+        return "float"
+    return "text"
+
+
+def _numeric_dtype(conn, table, col, kind):
+    """Smallest dtype that round-trips every value of a numeric column."""
+    if kind == "int":
+        lo, hi = conn.execute(text(f"SELECT MIN({col}), MAX({col}) FROM {table}")).one()
+        info = np.iinfo(np.int32)
+        return "int32" if lo is None or (info.min <= lo and hi <= info.max) else "int64"
+    # halves below 2**20 are exact in float32 (MovieLens ratings); anything else keeps float64
+    inexact = conn.execute(text(
+        f"SELECT COUNT(*) FROM {table} WHERE {col} IS NOT NULL "
+        f"AND ({col} * 2 != CAST({col} * 2 AS INTEGER) OR ABS({col}) >= 1048576)")).scalar()
+    return "float32" if not inexact else "float64"
+
+
+def _is_null(v):
+    return v is None or v is pd.NA or (isinstance(v, float) and v != v)
+
+
+def _encode_strings(values):
+    valid = np.fromiter((not _is_null(v) for v in values), dtype=bool, count=len(values))
+    encoded = [str(v).encode("utf-8") if ok else b"" for v, ok in zip(values, valid)]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    return b"".join(encoded), lengths, valid
+
+
+def export_table(conn, out_dir, table, order_by, columns):
+    """Write one table's columns into out_dir. Returns its manifest entry."""
+    n = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+    entry = {"rows": n, "columns": {}}
+    numeric, strings = {}, {}
+    for col in columns:
+        kind = _column_kind(col["type"])
+        name = col["name"]
+        nulls = n - conn.execute(text(f"SELECT COUNT({name}) FROM {table}")).scalar()
+        meta = {"kind": kind, "nullable": bool(nulls)}
+        if kind == "text":
+            meta.update(data=f"{table}.{name}.data.npy", offsets=f"{table}.{name}.offsets.npy")
+            strings[name] = ([], [], [])
+        else:
+            meta.update(dtype=_numeric_dtype(conn, table, name, kind), file=f"{table}.{name}.npy")
+            numeric[name] = np.lib.format.open_memmap(out_dir / meta["file"], mode="w+",
+                                                      dtype=meta["dtype"], shape=(n,))
+        if meta["nullable"]:
+            meta["valid"] = f"{table}.{name}.valid.npy"
+            if kind != "text":
+                numeric[name + "/valid"] = np.lib.format.open_memmap(out_dir / meta["valid"], mode="w+",
+                                                                     dtype=bool, shape=(n,))
+        entry["columns"][name] = meta
+
+    names = [c["name"] for c in columns]
+    sql = f"SELECT {', '.join(names)} FROM {table} ORDER BY {', '.join(order_by)}"
+    pos = 0
+    for chunk in pd.read_sql_query(text(sql), conn, chunksize=CHUNK_ROWS, coerce_float=False):
+        end = pos + len(chunk)
+        for name in names:
+            meta = entry["columns"][name]
+            values = chunk[name]
+            if meta["kind"] == "text":
+                data, lengths, valid = _encode_strings(values.tolist())
+                parts = strings[name]
+                parts[0].append(data)
+                parts[1].append(lengths)
+                parts[2].append(valid)
+                continue
+            if meta["nullable"]:
+                valid = values.notna().to_numpy()
+                # go through Python objects so large integers never pass through float64
+                numeric[name][pos:end] = np.array(values.where(valid, 0).tolist(), dtype=meta["dtype"])
+                numeric[name + "/valid"][pos:end] = valid
+            else:
+                numeric[name][pos:end] = values.to_numpy().astype(meta["dtype"])
+        pos = end
+
+    for name, (datas, lengths, valids) in strings.items():
+        meta = entry["columns"][name]
+        lengths = np.concatenate(lengths) if lengths else np.empty(0, np.int64)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        np.save(out_dir / meta["data"], np.frombuffer(b"".join(datas), dtype=np.uint8))
+        np.save(out_dir / meta["offsets"], offsets)
+        if meta["nullable"]:
+            np.save(out_dir / meta["valid"], np.concatenate(valids))
+    for arr in numeric.values():
+        arr.flush()
+    return entry
+
+
+def _next_version(root):
+    versions = [int(p.name) for p in root.iterdir() if p.is_dir() and p.name.isdigit()] if root.exists() else []
+    return max(versions, default=0) + 1
+
+
+def write_snapshot(engine, root=SNAPSHOT_DIR, keep=KEEP):
+    """
+    Export every snapshot table into root/<version>/ and point root/CURRENT at it.
+    The version directory is renamed into place only when complete; the oldest
+    versions beyond `keep` are removed. Returns the snapshot path.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    version = _next_version(root)
+    tmp = root / f".tmp-{version:06d}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+    start = time.perf_counter()
+    insp = inspect(engine)
+    existing = set(insp.get_table_names())
+    manifest = {"format_version": FORMAT_VERSION, "version": version,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "tables": {}}
+    with engine.connect() as conn:
+        for table, order_by in TABLES:
+            if table in existing:
+                manifest["tables"][table] = export_table(conn, tmp, table, order_by, insp.get_columns(table))
+    (tmp / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    final = root / f"{version:06d}"
+    os.replace(tmp, final)
+    current_tmp = root / "CURRENT.tmp"
+    current_tmp.write_text(final.name, encoding="utf-8")
+    os.replace(current_tmp, root / "CURRENT")
+    for old in sorted(p for p in root.iterdir() if p.is_dir() and p.name.isdigit())[:-keep]:
+        shutil.rmtree(old)
+    rows = sum(t["rows"] for t in manifest["tables"].values())
+    print(f"Snapshot {final} written: {rows:,} rows in {time.perf_counter() - start:.1f}s")
+    return final
+
+
+def resolve(path=None, root=SNAPSHOT_DIR):
+    """A snapshot directory: `path` itself, or the one root/CURRENT points to."""
+    if path:
+        return Path(path)
+    current = Path(root) / "CURRENT"
+    if not current.exists():
+        raise FileNotFoundError(f"no snapshot found under {root}/ (run: python snapshot.py export)")
+    return Path(root) / current.read_text(encoding="utf-8").strip()
+
+
+class Snapshot:
+    """Read access to one snapshot; numeric columns come back memory-mapped."""
+
+    def __init__(self, path=None):
+        self.path = resolve(path)
+        self.manifest = json.loads((self.path / "manifest.json").read_text(encoding="utf-8"))
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"{self.path}: snapshot format {self.manifest.get('format_version')} "
+                             f"is not supported (expected {FORMAT_VERSION})")
+        self.tables = self.manifest["tables"]
+
+    def _load(self, name):
+        return np.load(self.path / name, mmap_mode="r")
+
+    def column(self, table, col):
+        """
+        numpy array for non-null numeric columns, a nullable pandas array (Int64/Float64)
+        for numeric columns with NULLs, and an object array of str/None for text.
+        """
+        meta = self.tables[table]["columns"][col]
+        valid = self._load(meta["valid"]) if meta["nullable"] else None
+        if meta["kind"] != "text":
+            values = self._load(meta["file"])
+            if valid is None:
+                return values
+            if meta["kind"] == "int":
+                return pd.arrays.IntegerArray(np.asarray(values, dtype=np.int64), ~valid)
+            return pd.arrays.FloatingArray(np.asarray(values, dtype=np.float64), ~valid)
+        data = self._load(meta["data"])
+        offsets = self._load(meta["offsets"])
+        raw = data.tobytes()
+        out = np.empty(len(offsets) - 1, dtype=object)
+        bounds = offsets.tolist()
+        for i in range(len(out)):
+            out[i] = raw[bounds[i]:bounds[i + 1]].decode("utf-8")
+        if valid is not None:
+            out[~valid] = None
+        return out
+
+    def frame(self, table, columns=None):
+        columns = columns or list(self.tables[table]["columns"])
+        return {col: self.column(table, col) for col in columns}
+
+    def rows(self, table, chunk_rows=CHUNK_ROWS):
+        """Yield lists of row tuples (None for NULL) in chunks, for re-inserting."""
+        names = list(self.tables[table]["columns"])
+        n = self.tables[table]["rows"]
+        cols = [self.column(table, c) for c in names]
+        for start in range(0, n, chunk_rows):
+            parts = []
+            for col in cols:
+                part = col[start:start + chunk_rows]
+                if isinstance(part, pd.api.extensions.ExtensionArray):
+                    part = part.astype(object).tolist()
+                    part = [None if v is pd.NA else v for v in part]
+                else:
+                    part = part.tolist()
+                parts.append(part)
+            yield list(zip(*parts))
+
+
+def restore(snapshot, db, schema_file="schema.sql"):
+    """Create `db` (must not exist) from a snapshot, then rebuild summaries and indexes."""
+    from pipeline_state import ensure_state_schema, bump_data_version
+    from aggregates import ensure_aggregate_schema, rebuild
+    from db_profile import bulk_load
+    from search import rebuild_search
+    from enrich_directors import SCHEMA as ENRICHMENT_SCHEMA
+    if Path(db).exists():
+        raise FileExistsError(f"{db} already exists; restore only bootstraps a fresh database")
+    start = time.perf_counter()
+    with sqlite3.connect(db) as con:
+        con.executescript(Path(schema_file).read_text(encoding="utf-8"))
+        if "director_enrichment" in snapshot.tables:
+            con.executescript(ENRICHMENT_SCHEMA)
+    engine = get_engine(sqlite_url(db))
+    ensure_state_schema(engine)
+    ensure_aggregate_schema(engine)
+    existing = set(inspect(engine).get_table_names())
+    with bulk_load(engine):
+        raw = engine.raw_connection()
+        try:
+            for table, meta in snapshot.tables.items():
+                if table not in existing:
+                    print(f"Skipping {table}: not in the target schema")
+                    continue
+                names = list(meta["columns"])
+                sql = f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+                for rows in snapshot.rows(table):
+                    raw.executemany(sql, rows)
+                raw.commit()
+        finally:
+            raw.close()
+        with engine.begin() as conn:
+            rebuild(conn)
+            rebuild_search(conn)
+            bump_data_version(conn)
+    print(f"Restored {db} from {snapshot.path} in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar snapshots of the pipeline tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="write a new snapshot version")
+    exp.add_argument("--db", help="SQLite file or database URL (default: DB_URL)")
+    exp.add_argument("--dir", default=SNAPSHOT_DIR)
+    exp.add_argument("--keep", type=int, default=KEEP, help="snapshot versions to keep")
+    res = sub.add_parser("restore", help="bootstrap a fresh SQLite database from a snapshot")
+    res.add_argument("--snapshot", help="snapshot directory (default: the CURRENT one)")
+    res.add_argument("--dir", default=SNAPSHOT_DIR)
+    res.add_argument("--db", default="movies.db")
+    info = sub.add_parser("info", help="describe a snapshot")
+    info.add_argument("--snapshot")
+    info.add_argument("--dir", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        write_snapshot(get_engine(db_url(args.db)), args.dir, args.keep)
+    elif args.command == "restore":
+        restore(Snapshot(resolve(args.snapshot, args.dir)), args.db)
+    else:
+        snap = Snapshot(resolve(args.snapshot, args.dir))
+        print(f"{snap.path} (format {snap.manifest['format_version']}, created {snap.manifest['created']})")
+        for table, meta in snap.tables.items():
+            cols = ", ".join(f"{c}:{m.get('dtype', m['kind'])}{'?' if m['nullable'] else ''}"
+                             for c, m in meta["columns"].items())
+            print(f"  {table:20s} {meta['rows']:>12,} rows  {cols}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Local stand-in for the OMDb API, for exercising the enrichment code offline.
+
+    python stub_omdb.py --port 8765 --fail-every 10
+    OMDB_URL=http://127.0.0.1:8765/ python etl.py --omdb-concurrency 16
+
+Every title is "found" except ones containing --missing-marker; the director is derived
+from the title so repeated runs are deterministic. With --strict-titles, titles still in
+MovieLens form (a trailing ", The"-style article or a parenthetical alternate title) are
+not found either, as on the real API.
+"""
+import re
+import json
+import time
+import argparse
+import threading
+import hashlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+DIRECTORS = ["Martin Scorsese", "Robert Rodriguez", "Mel Gibson", "Kathryn Bigelow",
+             "Akira Kurosawa", "Agnes Varda", "Sofia Coppola", "Hayao Miyazaki"]
+# "Matrix, The", "Seven (a.k.a. Se7en)": the real API finds neither form
+MOVIELENS_FORM = re.compile(r", (?:The|A|An|Les|La|Le|L'|Il|El|Los|Las|Das|Der|Die)\Z|\)\Z", re.IGNORECASE)
+
+
+def fake_movie(title, year):
+    h = int(hashlib.md5(title.encode("utf-8")).hexdigest(), 16)
+    return {
+        "Title": title,
+        "Year": year or str(1950 + h % 70),
+        "imdbID": f"tt{h % 10**12:012d}",
+        "Plot": f"A stub plot about {title}.",
+        "BoxOffice": "N/A",
+        "Runtime": f"{80 + h % 70} min",
+        "Director": ", ".join(DIRECTORS[(h >> i) % len(DIRECTORS)] for i in range(1 + h % 2)),
+        "Response": "True",
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "StubOMDb/1.0"
+    # Keep-alive like the real API, and no Nagle delay between the header and body writes.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.request_count += 1
+            n = srv.request_count
+        if srv.latency:
+            time.sleep(srv.latency)
+        if srv.fail_every and n % srv.fail_every == 0:
+            self._send(429, {"Response": "False", "Error": "Request limit reached!"}, {"Retry-After": "0"})
+            return
+        q = parse_qs(urlparse(self.path).query)
+        title = q.get("t", [""])[0]
+        year = q.get("y", [None])[0]
+        if not title or srv.missing_marker in title or (srv.strict_titles and MOVIELENS_FORM.search(title)):
+            self._send(200, {"Response": "False", "Error": "Movie not found!"})
+            return
+        self._send(200, fake_movie(title, year))
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def start_stub_server(port=0, latency=0.0, fail_every=0, missing_marker="(unknown)", strict_titles=False):
+    """Start the stub in a daemon thread. Returns (server, base_url); call server.shutdown()."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.latency = latency
+    server.fail_every = fail_every
+    server.missing_marker = missing_marker
+    server.strict_titles = strict_titles
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OMDb stub server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to each response")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every Nth request with HTTP 429")
+    parser.add_argument("--missing-marker", default="(unknown)", help="titles containing this are not found")
+    parser.add_argument("--strict-titles", action="store_true",
+                        help="titles in MovieLens form (\"Matrix, The\", alternate titles) are not found")
+    args = parser.parse_args()
+    server, url = start_stub_server(args.port, args.latency, args.fail_every, args.missing_marker,
+                                    args.strict_titles)
+    print(f"Stub OMDb listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
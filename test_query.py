@@ -1,58 +1,48 @@
 # test_queries.py
-import sqlite3
-import pandas as pd
+import argparse
+from metrics import metrics, profiling
+from reports import open_engine, REPORTS, add_engine_argument
+from query_cache import QueryCache
 
-con = sqlite3.connect("movies.db")
+parser = argparse.ArgumentParser(description="Run the report queries")
+add_engine_argument(parser)
+parser.add_argument("--profile", metavar="PATH", help="write per-query metrics here (.json or Prometheus text)")
+parser.add_argument("--cprofile", metavar="PATH", help="also dump cProfile stats here")
+args = parser.parse_args()
 
+# name -> (report in reports.py, parameters)
 queries = {
-    "Top Rated Movies": """
-        SELECT m.title, ROUND(AVG(r.rating),3) AS avg_rating, COUNT(r.rating) AS cnt
-        FROM movies m
-        JOIN ratings r ON m.movie_id = r.movie_id
-        GROUP BY m.movie_id
-        HAVING COUNT(r.rating) > 5
-        ORDER BY avg_rating DESC
-        LIMIT 5;
-    """,
-    "Top Genres": """
-        SELECT g.genre_name, ROUND(AVG(r.rating),3) AS avg_rating, COUNT(r.rating) AS cnt
-        FROM genres g
-        JOIN movie_genres mg ON g.genre_id = mg.genre_id
-        JOIN ratings r ON mg.movie_id = r.movie_id
-        GROUP BY g.genre_id
-        HAVING COUNT(r.rating) >= 50
-        ORDER BY avg_rating DESC
-        LIMIT 5;
-    """,
-    "Top Directors": """
-        SELECT d.director_name, COUNT(md.movie_id) AS movie_count
-        FROM directors d
-        JOIN movie_directors md ON d.director_id = md.director_id
-        GROUP BY d.director_id
-        ORDER BY movie_count DESC
-        LIMIT 5;
-    """,
-    "Ratings by Year": """
-        SELECT m.year, ROUND(AVG(r.rating),3) AS avg_rating, COUNT(r.rating) AS cnt
-        FROM movies m
-        JOIN ratings r ON m.movie_id = r.movie_id
-        WHERE m.year IS NOT NULL
-        GROUP BY m.year
-        ORDER BY m.year;
-    """
+    "Top Rated Movies": ("top_movies", {"min_count": 6, "digits": 3, "limit": 5}),
+    "Top Genres": ("top_genres", {"min_count": 50, "digits": 3, "limit": 5}),
+    "Top Directors": ("prolific_directors", {"limit": 5}),
+    "Ratings by Year": ("ratings_by_year", {"digits": 3}),
 }
 
-for name, q in queries.items():
-    print("\n" + "="*40)
-    print(name)
-    print("="*40)
-    try:
-        df = pd.read_sql_query(q, con)
-        if df.empty:
-            print(" No rows returned (table may be empty).")
-        else:
-            print(df.to_string(index=False))
-    except Exception as e:
-        print("Error running query:", e)
+cache = QueryCache() if args.cache else None
 
-con.close()
\ No newline at end of file
+with profiling(args.profile, args.cprofile):
+    with metrics.stage(f"engine.{args.engine}"):
+        engine = open_engine(args.engine, cache=cache)
+    if args.profile and args.engine == "sqlite":
+        metrics.watch_sqlite(engine.con)
+    for name, (report_name, params) in queries.items():
+        print("\n" + "="*40)
+        print(name)
+        print("="*40)
+        try:
+            with metrics.stage(f"query.{name}") as entry:
+                df = engine.run(REPORTS[report_name], params)
+                entry["rows"] += len(df)
+            if df.empty:
+                print(" No rows returned (table may be empty).")
+            else:
+                print(df.to_string(index=False))
+        except Exception as e:
+            print("Error running query:", e)
+            metrics.count("query_errors")
+    engine.close()
+    if cache is not None:
+        for name, value in cache.stats().items():
+            if name != "hit_rate":
+                metrics.count(f"query_cache_{name}", value)
+        cache.close()
@@ -0,0 +1,340 @@
+"""
+Local title matching in front of OMDb. MovieLens titles are rewritten into the queries
+OMDb answers, and titles OMDb already resolved are matched from an n-gram index before
+any request goes out.
+
+    python title_match.py "City of Lost Children, The (Cité des enfants perdus, La)" 1995
+    python title_match.py --eval          # cache + local index hit rate over movies.csv, no requests
+
+MovieLens moves leading articles to the end ("Shawshank Redemption, The") and appends
+original-language or a.k.a. titles in parentheses; OMDb knows neither form, so the raw
+title misses and the old title-only retry missed again. candidates() turns one MovieLens
+(title, year) into at most MAX_CANDIDATES ranked queries: the normalized title with its
+year, each alternate title with the year, then the normalized title without it.
+TitleMatcher resolves a movie from the cache (raw query, then candidates), then the local
+index, and only then sends the remaining candidates in order, stopping at the first hit.
+Every answer is cached, so a known miss costs no request on the next run.
+"""
+import re
+import sys
+import argparse
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from omdb import normalize_year
+from omdb_cache import cache_key
+
+MAX_CANDIDATES = 3
+MIN_SIMILARITY = 0.85  # trigram Dice coefficient for a fuzzy local match (same year only)
+
+ARTICLES = ("The", "A", "An", "Les", "La", "Le", "L'", "Il", "Lo", "Gli", "I", "El", "Los", "Las",
+            "Das", "Der", "Die", "Den", "Det", "Ett", "En", "De", "Het", "Een", "O", "Os", "Un",
+            "Une", "Una", "Da")
+TRAILING_ARTICLE = re.compile(r"\A(?P<title>.+), (?P<article>%s)\Z" % "|".join(re.escape(a) for a in ARTICLES),
+                              re.IGNORECASE)
+# "Seven (a.k.a. Se7en)", "Vanishing, The (Spoorloos)": one alternate title per trailing group
+PARENTHETICAL = re.compile(r"\s*\(([^()]*)\)\Z")
+AKA = re.compile(r"\A(?:a\.k\.a\.|aka)\s+", re.IGNORECASE)
+# sequel and part numbers: "Ultimate Avengers 2" or "Volume II" never fuzzy-match another number
+NUMBER = re.compile(r"\A(?:\d+|[ivx]+)\Z")
+
+
+def move_article(title):
+    """"Shawshank Redemption, The" -> "The Shawshank Redemption"; "Atalante, L'" -> "L'Atalante"."""
+    m = TRAILING_ARTICLE.match(title)
+    if not m:
+        return title
+    article = m.group("article")
+    separator = "" if article.endswith("'") else " "
+    return f"{article}{separator}{m.group('title')}"
+
+
+def normalize_title(title):
+    """MovieLens title -> (OMDb-style title, [alternate titles]), articles moved to the front."""
+    title = " ".join(str(title).split())
+    alternates = []
+    while True:
+        m = PARENTHETICAL.search(title)
+        if not m or m.start() == 0:
+            break
+        alternate = AKA.sub("", m.group(1)).strip()
+        if alternate:
+            alternates.insert(0, move_article(alternate))
+        title = title[:m.start()]
+    return move_article(title.strip()), alternates
+
+
+def candidates(title, year, limit=MAX_CANDIDATES):
+    """Ranked (title, year) OMDb queries for one MovieLens movie, best first."""
+    year = normalize_year(year)
+    main, alternates = normalize_title(title)
+    ranked = [(main, year)] + [(alt, year) for alt in alternates]
+    if year is not None:
+        ranked.append((main, None))
+    return list(dict.fromkeys(ranked))[:limit]
+
+
+def match_key(title):
+    """Normalized title for matching: article moved to the front, accents, case and punctuation dropped."""
+    main, _ = normalize_title(title)
+    text = unicodedata.normalize("NFKD", main.casefold().replace("&", " and "))
+    return " ".join(re.findall(r"\w+", "".join(c for c in text if not unicodedata.combining(c))))
+
+
+def numbers(key):
+    return tuple(w for w in key.split() if NUMBER.match(w))
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def omdb_year(value):
+    """First year of an OMDb Year field ("1994", "2005–2010"), or None."""
+    m = re.match(r"\d{4}", str(value or ""))
+    return int(m.group()) if m else None
+
+
+class TitleIndex:
+    """
+    Titles OMDb has resolved, each pointing at its cache key. Exact lookups go by
+    match_key and year; fuzzy ones by trigram overlap among titles of the same year with
+    the same sequel numbers, so a lookup only scans one year's postings.
+    """
+
+    def __init__(self):
+        self.entries = []  # (match key, year, cache key, trigram count, numbers)
+        self.by_key = defaultdict(list)
+        self.grams = defaultdict(lambda: defaultdict(list))  # year -> trigram -> entry ids
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_cache(cls, cache):
+        """Index every unexpired hit in an omdb_cache.OmdbCache, under its query and OMDb titles."""
+        index = cls()
+        for ref, omdb_title, year in cache.resolved():
+            query_title, _, query_year = ref.rpartition("|||")
+            index.add(query_title, normalize_year(query_year), ref)
+            if omdb_title:
+                index.add(omdb_title, omdb_year(year), ref)
+        return index
+
+    def add(self, title, year, ref):
+        key = match_key(title)
+        if not key or (key, year, ref) in self.seen:
+            return
+        grams = trigrams(key)
+        with self.lock:
+            self.seen.add((key, year, ref))
+            i = len(self.entries)
+            self.entries.append((key, year, ref, len(grams), numbers(key)))
+            self.by_key[key].append(i)
+            if year is not None:
+                for g in grams:
+                    self.grams[year][g].append(i)
+
+    def add_result(self, query, data):
+        """Index a fresh OMDb answer for `query`, stored under cache_key(*query)."""
+        ref = cache_key(*query)
+        self.add(query[0], normalize_year(query[1]), ref)
+        self.add(data.get("Title", ""), omdb_year(data.get("Year")), ref)
+
+    def match(self, title, year):
+        """(cache key, similarity) of the best resolved title for a query, or None."""
+        key = match_key(title)
+        year = normalize_year(year)
+        if not key:
+            return None
+        with self.lock:
+            exact = [self.entries[i] for i in self.by_key.get(key, ())]
+            if year is None:
+                refs = {e[2] for e in exact}
+                return (refs.pop(), 1.0) if len(refs) == 1 else None
+            for e in exact:
+                if e[1] == year:
+                    return e[2], 1.0
+            postings = self.grams.get(year)
+            if not postings:
+                return None
+            grams = trigrams(key)
+            nums = numbers(key)
+            shared = Counter()
+            for g in grams:
+                shared.update(postings.get(g, ()))
+            best = None
+            for i, n in shared.items():
+                _, _, ref, count, entry_nums = self.entries[i]
+                score = 2 * n / (len(grams) + count)
+                if score >= MIN_SIMILARITY and entry_nums == nums and (best is None or score > best[1]):
+                    best = (ref, round(score, 3))
+            return best
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TitleMatcher:
+    """
+    Resolves MovieLens (title, year) queries with as few OMDb requests as possible: the
+    cache (raw query, then each candidate), the local index, then the candidates through
+    `client` (an omdb.OmdbClient, or None to stay offline) in rank order. Counts where each
+    movie was resolved and how many requests it took; see stats().
+    """
+
+    def __init__(self, cache, client=None, index=None, max_candidates=MAX_CANDIDATES):
+        self.cache = cache
+        self.client = client
+        self.index = TitleIndex.from_cache(cache) if index is None else index
+        self.max_candidates = max_candidates
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    def _resolve_locally(self, query):
+        """
+        (source, data, candidates still worth a request). source is "cache" or "local" when
+        the movie was resolved (data None: a cached not-found), None when it was not.
+        """
+        hit, data = self.cache.get(*query)
+        if hit:
+            return "cache", data, []
+        ranked = candidates(*query, limit=self.max_candidates)
+        remaining = []
+        for cand in ranked:
+            if cand == query:  # just missed above
+                remaining.append(cand)
+                continue
+            hit, data = self.cache.get(*cand)
+            if hit and data is not None:
+                return "cache", data, []
+            if not hit:
+                remaining.append(cand)
+        for title in dict.fromkeys(t for t, _ in ranked):
+            match = self.index.match(title, query[1])
+            data = self.cache.load(match[0]) if match else None
+            if data is not None:
+                return "local", data, []
+        return None, None, remaining
+
+    def _fetch(self, remaining):
+        """Send candidates in rank order, caching each answer; stop at the first hit."""
+        for cand in remaining:
+            self._count("calls")
+            data = self.client.get(*cand)
+            self.cache.put(cand[0], cand[1], data)
+            if data is not None:
+                return data
+        return None
+
+    def lookup_many(self, queries):
+        """
+        Resolve (title, year) queries, yielding (query, data, error) as each one is settled:
+        data is the OMDb record or None for not-found, error the OmdbError of a lookup that
+        failed (data None) or None. Offline (client None), movies that would need a request
+        are left out.
+        """
+        pending = {}
+        for query in dict.fromkeys(queries):
+            self._count("movies")
+            source, data, remaining = self._resolve_locally(query)
+            if source is None and remaining:
+                pending[query] = remaining
+                continue
+            self._count(source if data is not None else "not_found")
+            yield query, data, None
+        if self.client is None or not pending:
+            return
+        self._count("fetched", len(pending))
+        fetch = lambda title, year: self._fetch(pending[(title, year)])
+        for query, data, error in self.client.lookup_many(pending, lookup=fetch):
+            if error is not None:
+                self._count("errors")
+            else:
+                self._count("network" if data is not None else "not_found")
+                if query != pending[query][0]:
+                    self.cache.put(query[0], query[1], data)
+                if data is not None:
+                    self.index.add_result(query, data)
+            yield query, data, error
+
+    def stats(self):
+        """Where movies were resolved, and OMDb calls (one per candidate sent, retries excluded)."""
+        c = self.counts
+        resolved = c["cache"] + c["local"] + c["network"]
+        return {
+            "movies": c["movies"],
+            "resolved": resolved,
+            "hit_rate": round(resolved / c["movies"], 4) if c["movies"] else 0.0,
+            "cache": c["cache"],
+            "local": c["local"],
+            "network": c["network"],
+            "not_found": c["not_found"],
+            "errors": c["errors"],
+            "fetched": c["fetched"],
+            "calls": c["calls"],
+            "calls_per_movie": round(c["calls"] / c["movies"], 3) if c["movies"] else 0.0,
+            "calls_per_fetched": round(c["calls"] / c["fetched"], 3) if c["fetched"] else 0.0,
+        }
+
+
+def evaluate(path, cache):
+    """Offline hit rate over a movies.csv: what the cache and local index resolve without requests."""
+    import csv
+    from transform import TITLE_YEAR_PATTERN
+    queries = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            m = re.match(TITLE_YEAR_PATTERN, row["title"].strip())
+            queries.append((m.group(1).strip(), int(m.group(2))) if m else (row["title"].strip(), None))
+    matcher = TitleMatcher(cache)
+    for _ in matcher.lookup_many(queries):
+        pass
+    stats = matcher.stats()
+    needing = stats["movies"] - stats["resolved"] - stats["not_found"]
+    rewritten = sum(1 for q in dict.fromkeys(queries) if candidates(*q)[0] != q)
+    print(f"{stats['movies']} movies, {len(matcher.index)} indexed titles")
+    print(f"resolved without requests: {stats['resolved']} ({stats['hit_rate']:.1%}): "
+          f"cache {stats['cache']}, local index {stats['local']}")
+    print(f"known not found: {stats['not_found']}, would need requests: {needing}")
+    print(f"titles rewritten before querying OMDb: {rewritten}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MovieLens title normalization and local OMDb matching")
+    parser.add_argument("title", nargs="?", help="MovieLens title, without the (year)")
+    parser.add_argument("year", nargs="?", type=int)
+    parser.add_argument("--eval", nargs="?", const="movies.csv", metavar="MOVIES_CSV",
+                        help="report the offline hit rate over a movies.csv")
+    args = parser.parse_args(argv)
+    if not args.title and not args.eval:
+        parser.error("give a title or --eval")
+
+    from omdb_cache import open_cache
+    cache = open_cache()
+    try:
+        if args.eval:
+            evaluate(args.eval, cache)
+            return
+        for rank, (title, year) in enumerate(candidates(args.title, args.year), 1):
+            print(f"{rank}. {title!r} year={year}")
+        index = TitleIndex.from_cache(cache)
+        for title in dict.fromkeys(t for t, _ in candidates(args.title, args.year)):
+            match = index.match(title, args.year)
+            if match:
+                data = cache.load(match[0])
+                print(f"local match ({match[1]:.2f}): {data.get('Title')} ({data.get('Year')}) "
+                      f"{data.get('imdbID')}")
+                break
+        else:
+            print(f"no local match among {len(index)} indexed titles")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+import pandas as pd
+
+# "Title (1995)": the year is the digits inside the last " (...)" at the very end of the title.
+# The greedy title group keeps nested parentheses such as alternate-language titles.
+TITLE_YEAR_PATTERN = r'(?s)\A(.*) \((\d+)\)\Z'
+NO_GENRES = '(no genres listed)'
+
+
+def parse_titles(raw_titles):
+    """
+    Vectorized parse_title_and_year: returns a DataFrame with `title` (stripped) and
+    nullable Int64 `year`, aligned with the input index.
+    """
+    raw = raw_titles.astype(str)
+    parts = raw.str.extract(TITLE_YEAR_PATTERN)
+    has_year = parts[1].notna()
+    title = raw.where(~has_year, parts[0]).str.strip()
+    year = pd.Series(pd.NA, index=raw.index, dtype='Int64')
+    year[has_year] = parts.loc[has_year, 1].map(int)
+    return pd.DataFrame({'title': title, 'year': year})
+
+
+def explode_genres(df, id_col='movieId', genres_col='genres'):
+    """
+    Long (movie_id, genre) frame from the pipe-separated genres column, skipping
+    '(no genres listed)', blanks and repeated genres within a movie.
+    """
+    long = pd.DataFrame({'movie_id': df[id_col].astype('int64'), 'genre': df[genres_col]})
+    long = long.dropna(subset=['genre'])
+    long['genre'] = long['genre'].astype(str).str.split('|')
+    long = long.explode('genre')
+    long = long[long['genre'] != NO_GENRES]
+    long['genre'] = long['genre'].str.strip()
+    long = long[long['genre'] != '']
+    return long.drop_duplicates().reset_index(drop=True)
+
+
+def factorize_genres(long):
+    """
+    Adds an integer `genre_code` to a frame from explode_genres. Returns (frame, names)
+    where names[code] is the genre name, in first-seen order.
+    """
+    codes, names = pd.factorize(long['genre'])
+    long = long.assign(genre_code=codes)
+    return long, list(names)
+
+
+def genres_by_movie(long):
+    """{movie_id: [genre, ...]} from a frame produced by explode_genres."""
+    return long.groupby('movie_id', sort=False)['genre'].agg(list).to_dict()
@@ -0,0 +1,276 @@
+"""
+Watch mode for etl.py: tail ratings.csv (or every *.csv in a drop directory) and load the
+appended ratings in micro-batches, so new ratings are queryable within seconds.
+
+    python etl.py --watch                                  # catch up, then tail ratings.csv
+    python etl.py --watch --watch-dir incoming/ --flush-rows 2000 --flush-seconds 0.5
+
+Each file is read from its persisted byte offset: ratings.csv shares the pipeline_state row
+of etl.py --incremental, and every drop file gets its own "drop:<name>" row. Only complete
+lines are consumed; a partially written last line stays in the file until its newline
+arrives. Rows are flushed once --flush-rows are pending or the oldest has waited
+--flush-seconds, and a flush is one transaction: the ratings upsert with its summary and
+time-rollup deltas, the derived genre/director/year stats, the leaderboards, the data
+version and the new offset of every file read, so a crash never loses or double-loads a line.
+
+When the watched path is replaced (rotation: a new inode) the old file is drained to its
+end, unterminated last line included, before the new one is read from the start; a file
+truncated in place is re-read from the start. Batch latency runs from the file's
+modification time when its first lines were read to the commit that made them queryable.
+"""
+import io
+import os
+import csv
+import time
+import hashlib
+from pathlib import Path
+from db import get_engine
+from aggregates import load_rating_batch, refresh_derived, rebuild
+from pipeline_state import get_state, save_state, plan_ratings_load, bump_data_version, TAIL_WINDOW
+from ranking import refresh as refresh_rankings
+from metrics import metrics
+
+POLL_SECONDS = 0.2
+FLUSH_ROWS = 5000
+FLUSH_SECONDS = 1.0
+READ_BLOCK = 1 << 20
+COLUMNS = ("userId", "movieId", "rating", "timestamp")
+
+
+class TailedFile:
+    """
+    One ratings CSV read from a byte offset. poll() returns the complete lines appended
+    since the last call, following rotation and truncation of the path.
+    """
+
+    def __init__(self, path, source, offset=0, watermark=None, newest=None):
+        self.path = Path(path)
+        self.source = source
+        self.watermark = watermark  # skip rows at or below it: set when a rewritten file is re-read
+        self.newest = newest
+        self.dirty = False
+        self._open(offset)
+
+    def _open(self, offset):
+        self.f = open(self.path, "rb")
+        self.inode = os.fstat(self.f.fileno()).st_ino
+        self.offset = offset
+        start = max(0, offset - TAIL_WINDOW)
+        self.f.seek(start)
+        self.tail = self.f.read(offset - start)
+        self.columns = None
+
+    def _read_header(self):
+        """Column positions from the header line; False until the header is complete."""
+        self.f.seek(0)
+        line = self.f.readline()
+        if not line.endswith(b"\n"):
+            return False
+        names = next(csv.reader([line.decode("utf-8-sig")]))
+        missing = [c for c in COLUMNS[:3] if c not in names]
+        if missing:
+            raise ValueError(f"{self.path}: missing columns {missing}")
+        self.columns = [names.index(c) if c in names else None for c in COLUMNS]
+        if self.offset < len(line):
+            self._consume(line[self.offset:])
+        return True
+
+    def _consume(self, data):
+        if data:
+            self.offset += len(data)
+            self.tail = (self.tail + data)[-TAIL_WINDOW:]
+            self.dirty = True
+
+    def checksum(self):
+        """Same value as pipeline_state.tail_checksum(path, offset) while the file is unchanged."""
+        return hashlib.sha1(self.tail).hexdigest()
+
+    def size(self):
+        return os.fstat(self.f.fileno()).st_size
+
+    def read(self, max_lines=None, final=False):
+        """
+        Bytes of the complete lines after the offset (at most READ_BLOCK bytes and max_lines
+        lines); final=True also takes an unterminated last line, for a file nobody writes to
+        any more.
+        """
+        if self.columns is None and not self._read_header():
+            return b""
+        self.f.seek(self.offset)
+        data = self.f.read(READ_BLOCK)
+        if not (final and len(data) < READ_BLOCK):
+            data = data[:data.rfind(b"\n") + 1]
+        if max_lines is not None:
+            end = -1
+            for _ in range(max_lines):
+                end = data.find(b"\n", end + 1)
+                if end == -1:
+                    break
+            else:
+                data = data[:end + 1]
+        self._consume(data)
+        return data
+
+    def poll(self, max_lines=None):
+        """(new complete lines as bytes, file mtime), following rotation and truncation."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None  # mid-rotation: keep reading the open file
+        if st is not None and st.st_ino != self.inode:
+            data = self.read(max_lines, final=True)
+            if data:
+                return data, os.fstat(self.f.fileno()).st_mtime
+            print(f"[watch] {self.path} was rotated; reading the new file from the start")
+            metrics.count("watch_rotations")
+            self.f.close()
+            self._open(0)
+            self.dirty = True
+        elif st is not None and st.st_size < self.offset:
+            print(f"[watch] {self.path} was truncated; reading it again from the start")
+            metrics.count("watch_truncations")
+            self.f.close()
+            self._open(0)
+            self.dirty = True
+        return self.read(max_lines), os.fstat(self.f.fileno()).st_mtime
+
+    def parse(self, data):
+        """Rating dicts from complete CSV lines; malformed rows are counted and skipped."""
+        user_col, movie_col, rating_col, ts_col = self.columns
+        rows, bad = [], 0
+        for rec in csv.reader(io.StringIO(data.decode("utf-8"))):
+            if not rec:
+                continue
+            try:
+                ts = rec[ts_col] if ts_col is not None else ""
+                row = {"user_id": int(rec[user_col]), "movie_id": int(rec[movie_col]),
+                       "rating": float(rec[rating_col]), "timestamp": int(ts) if ts != "" else None}
+            except (ValueError, IndexError):
+                bad += 1
+                continue
+            ts = row["timestamp"]
+            if ts is not None:
+                if self.watermark is not None and ts <= self.watermark:
+                    continue
+                self.newest = ts if self.newest is None else max(self.newest, ts)
+            rows.append(row)
+        if bad:
+            metrics.count("watch_bad_rows", bad)
+        return rows
+
+    def close(self):
+        self.f.close()
+
+
+def open_source(conn, path, source):
+    """TailedFile resuming from the source's saved state (see pipeline_state.plan_ratings_load)."""
+    state = get_state(conn, source)
+    plan = plan_ratings_load(path, state)
+    watermark = state.get("watermark") if state else None
+    if plan["mode"] == "full" and state:
+        print(f"[watch] {path} changed since its last load; re-reading rows newer than {plan['watermark']}")
+    return TailedFile(path, source, plan["start"], plan["watermark"], watermark)
+
+
+def flush(engine, files, rows):
+    """Load one micro-batch and save every file's new offset, all in one transaction."""
+    with metrics.stage("watch.flush", rows=len(rows)), engine.begin() as conn:
+        if rows:
+            if conn.dialect.name == "sqlite":
+                load_rating_batch(conn, rows)
+                refresh_derived(conn)
+            else:
+                from etl_load import bulk_upsert, ratings
+                bulk_upsert(conn, ratings, rows, ['user_id', 'movie_id'])
+                rebuild(conn)
+            refresh_rankings(conn, full=conn.dialect.name != "sqlite")
+            bump_data_version(conn)
+        for tf in files:
+            if tf.dirty:
+                save_state(conn, tf.source, path=str(tf.path), size=tf.size(), byte_offset=tf.offset,
+                           tail_checksum=tf.checksum(), watermark=tf.newest)
+                tf.dirty = False
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def watch(ratings_path="ratings.csv", drop_dir=None, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS,
+          timeout=None, poll_seconds=POLL_SECONDS):
+    """
+    Tail ratings_path, or every *.csv in drop_dir (new files picked up as they appear),
+    until interrupted or `timeout` seconds have passed. Returns a summary dict.
+    """
+    engine = get_engine()
+    files = {}
+    if drop_dir is None:
+        with engine.connect() as conn:
+            files["ratings"] = open_source(conn, ratings_path, "ratings")
+    print(f"[watch] tailing {Path(drop_dir) / '*.csv' if drop_dir else ratings_path}; flush every "
+          f"{flush_rows} rows or {flush_seconds}s (Ctrl+C to stop)", flush=True)
+
+    pending = {}  # (user_id, movie_id) -> row: the last rating of a pair in a batch wins
+    batch_started = appended_at = None
+    latencies, batches, loaded = [], 0, 0
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            if drop_dir is not None:
+                for path in sorted(Path(drop_dir).glob("*.csv")):
+                    source = f"drop:{path.name}"
+                    if source not in files:
+                        with engine.connect() as conn:
+                            files[source] = open_source(conn, path, source)
+            got = False
+            for tf in list(files.values()):
+                if len(pending) >= flush_rows:
+                    break
+                data, mtime = tf.poll(flush_rows - len(pending))
+                if not data:
+                    continue
+                got = True
+                for row in tf.parse(data):
+                    pending[(row["user_id"], row["movie_id"])] = row
+                if batch_started is None:
+                    batch_started = time.monotonic()
+                    appended_at = mtime
+            dirty = any(tf.dirty for tf in files.values())
+            if dirty and (len(pending) >= flush_rows or batch_started is None
+                          or time.monotonic() - batch_started >= flush_seconds):
+                rows = list(pending.values())
+                flush(engine, files.values(), rows)
+                if rows:
+                    latency = time.time() - appended_at if appended_at is not None else 0.0
+                    latencies.append(latency)
+                    batches += 1
+                    loaded += len(rows)
+                    print(f"[watch] loaded {len(rows)} ratings; latency {latency * 1000:,.0f} ms", flush=True)
+                pending.clear()
+                batch_started = appended_at = None
+            if drop_dir is not None:
+                # forget drop files that were removed once everything read from them is saved
+                for source, tf in list(files.items()):
+                    if not tf.dirty and not tf.path.exists():
+                        tf.close()
+                        del files[source]
+            if not got:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pending or any(tf.dirty for tf in files.values()):
+            flush(engine, files.values(), list(pending.values()))
+            loaded += len(pending)
+            batches += bool(pending)
+        for tf in files.values():
+            tf.close()
+
+    metrics.count("watch_batches", batches)
+    summary = {"batches": batches, "ratings": loaded}
+    if latencies:
+        summary["latency_ms"] = {f"p{p}": round(_percentile(latencies, p) * 1000, 1) for p in (50, 99)}
+        summary["latency_ms"]["max"] = round(max(latencies) * 1000, 1)
+    print(f"[watch] stopped: {summary}")
+    return summary